@@ -1,20 +1,30 @@
 # -*- coding: utf-8 -*-
 import streamlit as st
 import os
-import tempfile
 import logging
 import time
 import zipfile
-import glob
 
 # Importar funções dos módulos dos agentes
-from data_ingestion import create_connection, create_tables, ingest_data, DB_FILE
-from database_agent import query_database_agent
-from output_formatter import format_response
+from data_ingestion import DB_FILE, CHUNK_SIZE, PARSE_WORKERS
+from database_agent import query_database_agent, invalidate_agent_pool
+import ingestion_jobs
+from csv_sources import source_from_buffer, sources_from_zip, find_csv_pairs
+from db_generations import database_exists, resolve_db_file, rollback_generation
+from columnar_backend import available_backends
+from output_formatter import format_response, result_dataframe
+from tracing import start_trace, span, start_metrics_server, METRICS_ENABLED
+import chat_history
+import pandas as pd
 
 # Configuração básica de logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+# Endpoint /metrics (Prometheus) com as durações do fluxo de perguntas; opcional (METRICS_ENABLED=1)
+# e sobe uma única vez por processo
+if METRICS_ENABLED:
+    start_metrics_server()
+
 # --- REMOVIDO: Limpeza do Banco de Dados na Inicialização ---
 # try:
 #     if os.path.exists(DB_FILE):
@@ -33,35 +43,35 @@ st.title("📊 Chat com Notas Fiscais usando Gemini + SQLite")
 def initialize_session_state():
     if "history" not in st.session_state:
         st.session_state.history = []
+        chat_history.cleanup_old_sessions()
+    if "history_dir" not in st.session_state:
+        st.session_state.history_dir = chat_history.new_session_dir()
     if "google_api_key" not in st.session_state:
         st.session_state.google_api_key = None
     # Verificar se o DB existe para definir o estado inicial de ingestão
-    db_already_exists = os.path.exists(DB_FILE)
+    db_already_exists = database_exists(DB_FILE)
     if "ingestion_complete" not in st.session_state:
         st.session_state.ingestion_complete = db_already_exists 
         if db_already_exists:
             logging.info(f"Banco de dados {DB_FILE} já existe. Assumindo ingestão completa.")
-    if "ingestion_in_progress" not in st.session_state:
-        st.session_state.ingestion_in_progress = False
-    if "processed_file_paths" not in st.session_state:
-        st.session_state.processed_file_paths = {"cabecalho": None, "itens": None}
+    if "ingestion_job_id" not in st.session_state:
+        # Uma sessão nova (ex.: página recarregada) acompanha o job que já estiver em andamento
+        job = ingestion_jobs.active_job()
+        st.session_state.ingestion_job_id = job.id if job else None
+    job = ingestion_jobs.get_job(st.session_state.ingestion_job_id) if st.session_state.ingestion_job_id else None
+    st.session_state.ingestion_in_progress = job is not None and job.status not in ingestion_jobs.FINISHED_STATES
+    if "upload_pairs" not in st.session_state:
+        st.session_state.upload_pairs = []  # [(prefixo, CsvSource cabeçalho, CsvSource itens)]
     if "files_ready_for_ingestion" not in st.session_state:
         st.session_state.files_ready_for_ingestion = False
     # Não precisamos mais de db_exists separado, usamos ingestion_complete
 
 initialize_session_state()
 
-# --- Função para limpar arquivos temporários processados ---
+# --- Função para descartar os arquivos identificados no upload ---
 def cleanup_processed_files():
-    cabecalho_path = st.session_state.processed_file_paths.get("cabecalho")
-    itens_path = st.session_state.processed_file_paths.get("itens")
-    if cabecalho_path and os.path.exists(cabecalho_path):
-        try: os.remove(cabecalho_path); logging.info(f"Arquivo temp {cabecalho_path} removido.")
-        except Exception as clean_e: logging.error(f"Erro ao limpar {cabecalho_path}: {clean_e}")
-    if itens_path and os.path.exists(itens_path):
-        try: os.remove(itens_path); logging.info(f"Arquivo temp {itens_path} removido.")
-        except Exception as clean_e: logging.error(f"Erro ao limpar {itens_path}: {clean_e}")
-    st.session_state.processed_file_paths = {"cabecalho": None, "itens": None}
+    # Os CSVs são lidos direto dos buffers do upload: não há arquivos temporários para apagar
+    st.session_state.upload_pairs = []
     st.session_state.files_ready_for_ingestion = False
 
 # --- Barra Lateral (Sidebar) ---
@@ -82,7 +92,7 @@ st.sidebar.divider()
 st.sidebar.header("Upload de Arquivos (CSV ou ZIP)")
 
 uploaded_files = st.sidebar.file_uploader(
-    "Envie os 2 arquivos CSV ou 1 arquivo ZIP",
+    "Envie os pares de CSV (Cabeçalho e Itens) ou arquivos ZIP com eles",
     type=["csv", "zip"],
     accept_multiple_files=True,
     key="file_uploader",
@@ -91,110 +101,35 @@ uploaded_files = st.sidebar.file_uploader(
 )
 
 upload_error = None
-cabecalho_found_path = None
-itens_found_path = None
 
 # Processar arquivos APENAS se novos arquivos foram enviados E não estão prontos ainda
 if uploaded_files and not st.session_state.files_ready_for_ingestion:
-    # Limpar arquivos temporários de processamentos anteriores desta sessão
-    # cleanup_processed_files() # Já é chamado pelo on_change
-
-    if len(uploaded_files) == 1 and uploaded_files[0].name.lower().endswith(".zip"):
-        zip_file = uploaded_files[0]
-        st.sidebar.info(f"Processando arquivo ZIP: {zip_file.name}...")
-        with tempfile.TemporaryDirectory() as tmpdir:
-            try:
-                with zipfile.ZipFile(zip_file, 'r') as zip_ref:
-                    zip_ref.extractall(tmpdir)
-                logging.info(f"ZIP extraído para {tmpdir}")
-                
-                all_files = []
-                for root, _, files in os.walk(tmpdir):
-                   for file in files:
-                       all_files.append(os.path.join(root, file))
-
-                cabecalho_candidates = [f for f in all_files if f.lower().endswith("_nfs_cabecalho.csv")]
-                itens_candidates = [f for f in all_files if f.lower().endswith("_nfs_itens.csv")]
-
-                if len(cabecalho_candidates) == 1:
-                    cabecalho_found_path = cabecalho_candidates[0]
-                elif len(cabecalho_candidates) > 1:
-                     upload_error = "Erro: Múltiplos arquivos `*_NFs_Cabecalho.csv` encontrados no ZIP."
-                else:
-                     upload_error = "Erro: Arquivo `*_NFs_Cabecalho.csv` não encontrado no ZIP."
-
-                if not upload_error:
-                    if len(itens_candidates) == 1:
-                        itens_found_path = itens_candidates[0]
-                    elif len(itens_candidates) > 1:
-                         upload_error = "Erro: Múltiplos arquivos `*_NFs_Itens.csv` encontrados no ZIP."
-                    else:
-                         upload_error = "Erro: Arquivo `*_NFs_Itens.csv` não encontrado no ZIP."
-
-                if cabecalho_found_path and itens_found_path and not upload_error:
-                    try:
-                        # Usar arquivos temporários nomeados que persistem até serem limpos
-                        tmp_cabecalho_perm = tempfile.NamedTemporaryFile(delete=False, suffix="_cabecalho.csv")
-                        with open(cabecalho_found_path, 'rb') as src:
-                            tmp_cabecalho_perm.write(src.read())
-                        st.session_state.processed_file_paths["cabecalho"] = tmp_cabecalho_perm.name
-                        tmp_cabecalho_perm.close() # Fechar o handle, mas o arquivo persiste
-                        logging.info(f"Arquivo Cabeçalho encontrado no ZIP e salvo em {st.session_state.processed_file_paths['cabecalho']}")
-                        
-                        tmp_itens_perm = tempfile.NamedTemporaryFile(delete=False, suffix="_itens.csv")
-                        with open(itens_found_path, 'rb') as src:
-                            tmp_itens_perm.write(src.read())
-                        st.session_state.processed_file_paths["itens"] = tmp_itens_perm.name
-                        tmp_itens_perm.close()
-                        logging.info(f"Arquivo Itens encontrado no ZIP e salvo em {st.session_state.processed_file_paths['itens']}")
-                        
-                        st.session_state.files_ready_for_ingestion = True
-                        st.sidebar.success("Arquivos do ZIP identificados!")
-                        # Não usar st.rerun() aqui, deixar o fluxo seguir
-                    except Exception as copy_e:
-                        upload_error = f"Erro ao salvar arquivos temporários do ZIP: {copy_e}"
-                        cleanup_processed_files()
-
-            except zipfile.BadZipFile:
-                upload_error = "Erro: O arquivo enviado não parece ser um ZIP válido."
-            except Exception as e:
-                upload_error = f"Erro ao processar o ZIP: {e}"
-                logging.error(f"Erro ao processar ZIP: {e}", exc_info=True)
-
-    elif len(uploaded_files) == 2 and all(f.name.lower().endswith(".csv") for f in uploaded_files):
-        st.sidebar.info("Processando arquivos CSV...")
-        file1, file2 = uploaded_files
-        identified_cabecalho = None
-        identified_itens = None
-
-        if file1.name.lower().endswith("_nfs_cabecalho.csv"): identified_cabecalho = file1
-        elif file2.name.lower().endswith("_nfs_cabecalho.csv"): identified_cabecalho = file2
-
-        if file1.name.lower().endswith("_nfs_itens.csv"): identified_itens = file1
-        elif file2.name.lower().endswith("_nfs_itens.csv"): identified_itens = file2
-
-        if identified_cabecalho and identified_itens:
-            try:
-                tmp_cabecalho_perm = tempfile.NamedTemporaryFile(delete=False, suffix="_cabecalho.csv")
-                tmp_cabecalho_perm.write(identified_cabecalho.getvalue())
-                st.session_state.processed_file_paths["cabecalho"] = tmp_cabecalho_perm.name
-                tmp_cabecalho_perm.close()
-
-                tmp_itens_perm = tempfile.NamedTemporaryFile(delete=False, suffix="_itens.csv")
-                tmp_itens_perm.write(identified_itens.getvalue())
-                st.session_state.processed_file_paths["itens"] = tmp_itens_perm.name
-                tmp_itens_perm.close()
-                
-                st.session_state.files_ready_for_ingestion = True
-                st.sidebar.success("Arquivos CSV identificados!")
-            except Exception as copy_e:
-                upload_error = f"Erro ao salvar arquivos temporários CSV: {copy_e}"
-                cleanup_processed_files()
+    # Os CSVs são lidos em streaming a partir do próprio upload: membros do ZIP são descompactados
+    # durante a ingestão e os CSVs avulsos são lidos da memória, sem cópias em arquivos temporários.
+    # getvalue() devolve os bytes do upload sem copiá-los.
+    st.sidebar.info("Processando arquivos enviados...")
+    sources = []
+    try:
+        for uploaded in uploaded_files:
+            if uploaded.name.lower().endswith(".zip"):
+                sources.extend(sources_from_zip(uploaded.getvalue()))
+                logging.info(f"ZIP {uploaded.name} aberto para leitura em streaming.")
+            else:
+                sources.append(source_from_buffer(uploaded.name, uploaded.getvalue()))
+        pairs, pair_errors = find_csv_pairs(sources)
+        if pair_errors:
+            upload_error = "Erro: " + " ".join(pair_errors) + (
+                " Os arquivos devem terminar com `_NFs_Cabecalho.csv` e `_NFs_Itens.csv`."
+            )
         else:
-            upload_error = "Erro: Renomeie os arquivos para terminar com `_NFs_Cabecalho.csv` e `_NFs_Itens.csv`."
-
-    elif len(uploaded_files) > 0:
-        upload_error = "Erro: Envie exatamente 2 arquivos CSV ou 1 arquivo ZIP."
+            st.session_state.upload_pairs = pairs
+            st.session_state.files_ready_for_ingestion = True
+            st.sidebar.success(f"{len(pairs)} par(es) de arquivos identificado(s): {', '.join(p for p, _, _ in pairs)}")
+    except zipfile.BadZipFile:
+        upload_error = "Erro: O arquivo enviado não parece ser um ZIP válido."
+    except Exception as e:
+        upload_error = f"Erro ao processar os arquivos enviados: {e}"
+        logging.error(f"Erro ao processar upload: {e}", exc_info=True)
 
     if upload_error:
         st.sidebar.error(upload_error)
@@ -205,85 +140,206 @@ if uploaded_files and not st.session_state.files_ready_for_ingestion:
 # Isso permite re-ingerir se o usuário quiser, mas não enquanto uma ingestão está ocorrendo.
 ingest_button_disabled = not st.session_state.files_ready_for_ingestion or st.session_state.ingestion_in_progress
 
+# Modo incremental: mantém os dados já carregados e só atualiza as notas dos novos arquivos
+incremental_ingestion = st.sidebar.checkbox(
+    "Ingestão incremental (manter dados já carregados)",
+    value=False,
+    key="incremental_ingestion",
+    help="Atualiza as notas pela CHAVE_DE_ACESSO e pula arquivos já ingeridos, sem apagar o histórico.",
+)
+
+# Motor das consultas do agente: SQLite ou exportação colunar (DuckDB/Parquet), se instalados
+query_backend = st.sidebar.selectbox(
+    "Motor de consulta",
+    options=available_backends(),
+    key="query_backend",
+    help="DuckDB e Parquet usam armazenamento colunar, mais rápido em agregações sobre muitos itens.",
+)
+
 if st.sidebar.button("Processar Arquivos e Ingerir Dados", key="ingest_button", disabled=ingest_button_disabled):
-    st.session_state.ingestion_in_progress = True
-    st.session_state.ingestion_complete = False # Marcar como não completo ao iniciar nova ingestão
-    st.rerun() # Mostrar spinner
-
-# --- Lógica de Ingestão --- 
-if st.session_state.ingestion_in_progress:
-    with st.spinner("Processando arquivos e ingerindo dados no banco de dados SQLite..."):
-        ingestion_success = False
-        try:
-            cabecalho_path = st.session_state.processed_file_paths.get("cabecalho")
-            itens_path = st.session_state.processed_file_paths.get("itens")
-            if not cabecalho_path or not itens_path or not os.path.exists(cabecalho_path) or not os.path.exists(itens_path):
-                 raise ValueError("Caminhos dos arquivos CSV processados inválidos ou não encontrados para ingestão.")
-
-            logging.info("Iniciando processo de ingestão...")
-            conn = create_connection()
-            if conn:
-                create_tables(conn)
-                success = ingest_data(conn, cabecalho_path, itens_path)
-                conn.close()
-                if success:
-                    logging.info("Ingestão concluída com sucesso.")
-                    ingestion_success = True # Marcar sucesso
-                    st.sidebar.success("Dados ingeridos com sucesso! ✅") # Mover msg de sucesso para cá
-                else:
-                    st.sidebar.error("Falha na ingestão dos dados. Verifique os logs.")
-                    logging.error("Falha durante a ingestão de dados.")
-            else:
-                st.sidebar.error("Não foi possível conectar ao banco de dados.")
-                logging.error("Falha ao criar conexão com o banco de dados para ingestão.")
-            
-            # ATUALIZAR ESTADO AQUI, ANTES DO FINALLY E RERUN
-            st.session_state.ingestion_complete = ingestion_success
-            # st.session_state.db_exists = ingestion_success # Não precisamos mais disso
-
-        except Exception as e:
-            st.sidebar.error(f"Erro durante a ingestão: {e}")
-            logging.error(f"Erro excepcional durante ingestão: {e}", exc_info=True)
-            st.session_state.ingestion_complete = False # Garantir que falha marque como não completo
-        finally:
-            st.session_state.ingestion_in_progress = False # Terminou o processo
-            # Limpar arquivos temporários processados APÓS a tentativa de ingestão
-            cleanup_processed_files()
-            # st.rerun() # Rerun para atualizar a UI com o novo estado de ingestion_complete
-            # O rerun aqui pode ser o problema. Vamos tentar atualizar o estado e deixar o fluxo natural do Streamlit redesenhar.
-            # Se o rerun for necessário, garantir que o estado seja lido corretamente após ele.
-            # Vamos remover o rerun explícito e ver se o Streamlit atualiza corretamente.
-            pass # Deixar o Streamlit redesenhar
+    pairs = st.session_state.upload_pairs
+    if not pairs:
+        st.sidebar.error("Nenhum par de arquivos identificado para ingestão.")
+        cleanup_processed_files()
+    else:
+        # A ingestão roda em segundo plano; o chat segue consultando o banco atual até o commit
+        job = ingestion_jobs.submit_ingestion(
+            [cabecalho for _, cabecalho, _ in pairs], [itens for _, _, itens in pairs],
+            on_success=invalidate_agent_pool,  # Agentes em cache refletem o banco anterior
+            chunksize=CHUNK_SIZE, incremental=st.session_state.incremental_ingestion, workers=PARSE_WORKERS,
+            export_backend=None if st.session_state.query_backend == "sqlite" else st.session_state.query_backend,
+        )
+        st.session_state.ingestion_job_id = job.id
+        st.session_state.ingestion_in_progress = True
+        # As origens agora pertencem ao job
+        st.session_state.upload_pairs = []
+        st.session_state.files_ready_for_ingestion = False
+        st.rerun()
+
+def _format_eta(seconds):
+    if seconds is None:
+        return "calculando..."
+    minutes, seconds = divmod(int(seconds), 60)
+    return f"{minutes} min {seconds:02d} s" if minutes else f"{seconds} s"
+
+# --- Progresso da Ingestão ---
+@st.fragment(run_every=1.0)
+def render_ingestion_progress():
+    """ Consulta o job de ingestão a cada segundo sem rodar o script inteiro; ao terminar, atualiza a página. """
+    job = ingestion_jobs.get_job(st.session_state.ingestion_job_id)
+    if job is None:
+        return
+    if job.status in ingestion_jobs.FINISHED_STATES:
+        if st.session_state.ingestion_in_progress:
+            st.session_state.ingestion_in_progress = False
+            st.rerun()
+        return
+    progress = job.to_dict()
+    if job.status == ingestion_jobs.QUEUED:
+        label = "Ingestão na fila..."
+    elif progress["etapa"] == "finalizacao":
+        label = "Criando índices e tabelas de resumo..."
+    else:
+        label = f"Ingerindo dados (restante: {_format_eta(progress['eta_s'])})"
+    st.progress(progress["fracao"], text=label)
+    for table, counts in progress["tabelas"].items():
+        st.caption(
+            f"nfs_{table}: {counts['lidas']:,} lidas, {counts['inseridas']:,} inseridas "
+            f"de ~{counts['estimadas']:,}".replace(",", ".")
+        )
+    if job.cancel_requested:
+        st.caption("Cancelamento solicitado; desfazendo a transação...")
+    elif st.button("Cancelar ingestão", key=f"cancelar_{job.id}"):
+        ingestion_jobs.cancel_job(job.id)
+
+if st.session_state.ingestion_job_id:
+    job = ingestion_jobs.get_job(st.session_state.ingestion_job_id)
+    if job is not None and st.session_state.ingestion_in_progress:
+        with st.sidebar:
+            render_ingestion_progress()
+    elif job is not None and job.status in ingestion_jobs.FINISHED_STATES:
+        # Resultado do job mostrado uma única vez, no primeiro rerun depois do término
+        if job.status == ingestion_jobs.SUCCEEDED:
+            st.session_state.ingestion_complete = True
+            st.sidebar.success("Dados ingeridos com sucesso! ✅")
+        elif job.status == ingestion_jobs.CANCELLED:
+            st.sidebar.warning("Ingestão cancelada. O banco de dados permanece como estava.")
+        else:
+            st.sidebar.error(f"Erro durante a ingestão: {job.error}")
+        st.session_state.ingestion_job_id = None
 
 # --- Mensagens de Status --- 
 # Usar o estado atualizado para mostrar mensagens
 if st.session_state.ingestion_complete:
-    st.sidebar.success(f"Banco de dados `{os.path.basename(DB_FILE)}` pronto para consulta. ✅")
+    st.sidebar.success(f"Banco de dados `{os.path.basename(resolve_db_file(DB_FILE))}` pronto para consulta. ✅")
+    # A geração anterior fica em disco até a próxima ingestão e pode ser restaurada
+    if not st.session_state.ingestion_in_progress and st.sidebar.button("Voltar para a geração anterior", key="rollback_button"):
+        if rollback_generation(DB_FILE):
+            invalidate_agent_pool()
+            st.rerun()
+        else:
+            st.sidebar.warning("Não há geração anterior disponível.")
 elif st.session_state.files_ready_for_ingestion and not st.session_state.ingestion_in_progress:
      st.sidebar.info("Arquivos identificados. Clique em \"Processar Arquivos\" para iniciar.")
 elif not uploaded_files:
-     st.sidebar.info("Aguardando o upload de arquivos (2 CSVs ou 1 ZIP).")
+     st.sidebar.info("Aguardando o upload de arquivos (pares de CSV ou ZIP).")
 elif uploaded_files and not st.session_state.files_ready_for_ingestion and not upload_error:
      st.sidebar.info("Processando arquivos enviados...")
 # Adicionar uma mensagem se a ingestão falhou mas não está mais em progresso
-elif not st.session_state.ingestion_complete and not st.session_state.ingestion_in_progress and st.session_state.processed_file_paths.get("cabecalho") is None:
-    # Isso cobre o caso onde a ingestão falhou e os arquivos temporários foram limpos
+elif not st.session_state.ingestion_complete and not st.session_state.ingestion_in_progress and not st.session_state.upload_pairs:
+    # Isso cobre o caso onde a ingestão falhou e os arquivos identificados foram descartados
     st.sidebar.warning("A ingestão anterior falhou ou foi interrompida. Faça upload dos arquivos novamente.")
 
 
 # --- Interface de Chat --- 
 st.header("Chat com os Dados das Notas Fiscais")
 
+def render_timeline(trace):
+    """ Linha do tempo da pergunta: início e duração de cada etapa, com as etapas filhas indentadas. """
+    depth = {None: -1}
+    for item in trace["spans"]:
+        depth[item["id"]] = depth.get(item["pai"], -1) + 1
+    timeline = pd.DataFrame([
+        {
+            "Etapa": "\u2003" * depth[item["id"]] + ("↳ " if depth[item["id"]] else "") + item["nome"],
+            "Início (ms)": item["inicio_ms"],
+            "Duração (ms)": item["duracao_ms"],
+            "Detalhes": ", ".join(f"{k}={v}" for k, v in item["atributos"].items() if v is not None),
+        }
+        for item in trace["spans"]
+    ])
+    with st.expander(f"⏱️ Tempo de resposta: {trace['duracao_ms'] / 1000:.2f}s"):
+        if timeline.empty:
+            st.caption("Nenhuma etapa registrada.")
+            return
+        st.dataframe(
+            timeline,
+            hide_index=True,
+            use_container_width=True,
+            column_config={
+                "Duração (ms)": st.column_config.ProgressColumn(
+                    "Duração (ms)", format="%.0f", min_value=0, max_value=max(trace["duracao_ms"], 1)
+                )
+            },
+        )
+
+def render_result_table(df, truncated=False):
+    """ Tabela do resultado estruturado da consulta, sem depender do LLM reescrever as linhas.
+
+    Os valores seguem numéricos (ordenação por valor); as colunas decimais são exibidas no formato do
+    navegador (1.234,56 em pt-BR).
+    """
+    column_config = {
+        column: st.column_config.NumberColumn(format="localized")
+        for column in df.columns if pd.api.types.is_float_dtype(df[column])
+    }
+    st.dataframe(df, hide_index=True, use_container_width=True, column_config=column_config)
+    if truncated:
+        st.caption(f"Exibindo as primeiras {len(df)} linhas do resultado.")
+
+def render_history_table(entry):
+    """ Tabela de uma mensagem do histórico: prévia em memória ou páginas lidas do disco sob demanda. """
+    if entry.get("data_rows", 0) == 0:
+        return
+    if entry.get("data_file") is None:
+        render_result_table(entry["data"], entry.get("truncated", False))
+        return
+    pages = chat_history.page_count(entry)
+    if entry.get("data") is None and not st.toggle(
+        f"Mostrar tabela ({entry['data_rows']} linhas)", key=f"mostrar_{entry['id']}"
+    ):
+        return
+    page = st.number_input(
+        f"Página (de {pages})", min_value=1, max_value=pages, value=1, key=f"pagina_{entry['id']}"
+    )
+    render_result_table(chat_history.load_page(entry, page - 1))
+    st.caption(f"{entry['data_rows']} linhas no total, {chat_history.INLINE_ROWS} por página.")
+    if entry.get("truncated"):
+        st.caption(f"O resultado da consulta foi limitado às primeiras {entry['data_rows']} linhas.")
+
+def add_to_history(role, content, data=None, truncated=False, trace=None):
+    entry = chat_history.make_entry(
+        role, content, st.session_state.history_dir, data=data, truncated=truncated, trace=trace
+    )
+    chat_history.append_entry(st.session_state.history, entry, st.session_state.history_dir)
+
+archived = chat_history.archived_count(st.session_state.history_dir)
+if archived:
+    st.caption(f"{archived} mensagem(ns) mais antiga(s) foram arquivadas para manter a sessão leve.")
+
 for entry in st.session_state.history:
     with st.chat_message(entry["role"]):
         st.markdown(entry["content"])
+        render_history_table(entry)
+        if entry.get("trace"):
+            render_timeline(entry["trace"])
 
 # Habilitar chat SE a ingestão estiver completa E a chave API estiver presente
 chat_disabled = not st.session_state.ingestion_complete or not st.session_state.google_api_key
 disabled_reason = "" 
 if not st.session_state.ingestion_complete:
     # Mensagem mais específica se o DB existe mas o estado não está completo (pode acontecer se app reiniciar)
-    if os.path.exists(DB_FILE) and not st.session_state.ingestion_complete:
+    if database_exists(DB_FILE) and not st.session_state.ingestion_complete:
          disabled_reason += " O banco de dados existe, mas a ingestão precisa ser refeita nesta sessão. Faça upload e processe os arquivos."
     else:
         disabled_reason += " Faça o upload e processe os arquivos primeiro." 
@@ -301,7 +357,7 @@ if chat_disabled and not st.session_state.ingestion_in_progress and not st.sessi
     st.info(f"O chat está desabilitado.{disabled_reason}")
 
 if user_input and not chat_disabled:
-    st.session_state.history.append({"role": "user", "content": user_input})
+    add_to_history("user", user_input)
     with st.chat_message("user"):
         st.markdown(user_input)
 
@@ -309,28 +365,41 @@ if user_input and not chat_disabled:
         with st.spinner("Pensando..."):
             try:
                 # Verificar se o DB existe antes de tentar consultar
-                if not os.path.exists(DB_FILE):
+                if not database_exists(DB_FILE):
                     raise FileNotFoundError(f"O arquivo do banco de dados {DB_FILE} não foi encontrado. A ingestão pode ter falhado ou sido interrompida.")
                 
                 logging.info(f"Enviando pergunta para o agente: {user_input}")
-                agent_raw_response = query_database_agent(user_input, st.session_state.google_api_key)
-                logging.info(f"Resposta bruta do agente: {agent_raw_response}")
-                
-                formatted_output = format_response(agent_raw_response, user_input)
-                logging.info("Resposta formatada gerada.")
-                
+                with start_trace("pergunta", backend=st.session_state.query_backend) as trace:
+                    agent_raw_response = query_database_agent(
+                        user_input, st.session_state.google_api_key, backend=st.session_state.query_backend
+                    )
+                    logging.info(f"Resposta bruta do agente: {agent_raw_response}")
+
+                    with span("formatacao"):
+                        formatted_output = format_response(agent_raw_response, user_input)
+                    logging.info("Resposta formatada gerada.")
+                    with span("tabela_resultado"):
+                        result_df = result_dataframe(agent_raw_response)
+                trace_summary = trace.to_dict()
+                truncated = bool(agent_raw_response.get("data", {}).get("truncated"))
+
                 st.markdown(formatted_output)
-                st.session_state.history.append({"role": "assistant", "content": formatted_output})
+                if result_df is not None:
+                    render_result_table(result_df, truncated)
+                render_timeline(trace_summary)
+                add_to_history(
+                    "assistant", formatted_output, data=result_df, truncated=truncated, trace=trace_summary
+                )
             
             except FileNotFoundError as e:
                 error_msg = f"Erro: {e}"
                 st.error(error_msg)
-                st.session_state.history.append({"role": "assistant", "content": error_msg})
+                add_to_history("assistant", error_msg)
                 logging.error(error_msg)
             except Exception as e:
                 error_msg = f"Ocorreu um erro inesperado ao processar sua pergunta: {e}"
                 st.error(error_msg)
-                st.session_state.history.append({"role": "assistant", "content": error_msg})
+                add_to_history("assistant", error_msg)
                 logging.error(f"Erro excepcional no fluxo de chat: {e}", exc_info=True)
 
 st.sidebar.divider()
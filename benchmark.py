@@ -0,0 +1,529 @@
+# -*- coding: utf-8 -*-
+""" Benchmarks de ingestão e consulta do csv-nav.
+
+Uso:
+    python benchmark.py esquema --notas 50000
+    python benchmark.py ingestao --notas 200000
+    python benchmark.py carga --sessoes 8 --com-ingestao
+    python benchmark.py resumos --notas 100000 --meses 6
+    python benchmark.py colunar --notas 200000
+    python benchmark.py suite --notas 50000 [--salvar-baseline]
+    python benchmark.py formatacao --linhas 100000
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import platform
+import sqlite3
+import sys
+import statistics
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+from data_ingestion import create_connection, create_tables, ingest_data, get_ingestion_instructions, read_csv_flexible
+from db_pool import read_connection, writer_connection, close_pools
+from rollups import MONTH_EXPRESSION
+from synthetic_data import generate_synthetic_csvs, destinatario_cnpj, ncm_codes, SEED
+import columnar_backend
+import data_ingestion
+import database_agent
+import output_formatter
+
+# Os módulos importados configuram o logging em INFO; no benchmark só interessam avisos e erros
+logging.getLogger().setLevel(logging.WARNING)
+
+BASELINE_FILE = "benchmark_baseline.json"
+BASELINE_TOLERANCE = 0.25  # Variação relativa aceita antes de acusar regressão
+
+# Consultas de junção típicas do agente (nfs_itens -> nfs_cabecalho por CHAVE_DE_ACESSO)
+JOIN_QUERIES = {
+    "itens_por_destinatario": (
+        "SELECT i.DESCRICAO_PRODUTO_SERVICO, SUM(i.VALOR_TOTAL) FROM nfs_cabecalho c "
+        "JOIN nfs_itens i ON i.CHAVE_DE_ACESSO = c.CHAVE_DE_ACESSO "
+        f"WHERE c.CNPJ_DESTINATARIO = '{destinatario_cnpj(10)}' GROUP BY i.DESCRICAO_PRODUTO_SERVICO"
+    ),
+    "total_itens_por_uf": (
+        "SELECT c.UF_EMITENTE, SUM(i.VALOR_TOTAL) FROM nfs_itens i "
+        "JOIN nfs_cabecalho c ON c.CHAVE_DE_ACESSO = i.CHAVE_DE_ACESSO GROUP BY c.UF_EMITENTE"
+    ),
+    "notas_de_um_ncm": (
+        "SELECT COUNT(DISTINCT c.CHAVE_DE_ACESSO) FROM nfs_itens i "
+        f"JOIN nfs_cabecalho c ON c.CHAVE_DE_ACESSO = i.CHAVE_DE_ACESSO WHERE i.CODIGO_NCM_SH = '{ncm_codes()[20]}'"
+    ),
+}
+
+# Perguntas comuns: (SQL sobre as tabelas de notas, SQL equivalente sobre as tabelas de resumo)
+ROLLUP_QUERIES = {
+    "valor_por_uf_emitente": (
+        "SELECT c.UF_EMITENTE, SUM(c.VALOR_NOTA_FISCAL) FROM nfs_cabecalho c GROUP BY 1 ORDER BY 1",
+        "SELECT UF_EMITENTE, SUM(VALOR_TOTAL_NOTAS) FROM resumo_mensal_uf GROUP BY 1 ORDER BY 1",
+    ),
+    "valor_por_mes": (
+        f"SELECT {MONTH_EXPRESSION}, SUM(c.VALOR_NOTA_FISCAL) FROM nfs_cabecalho c GROUP BY 1 ORDER BY 1",
+        "SELECT MES, SUM(VALOR_TOTAL_NOTAS) FROM resumo_mensal_uf GROUP BY 1 ORDER BY 1",
+    ),
+    "top_destinatarios": (
+        "SELECT c.CNPJ_DESTINATARIO, SUM(c.VALOR_NOTA_FISCAL) AS v FROM nfs_cabecalho c GROUP BY 1 ORDER BY v DESC, 1 LIMIT 10",
+        "SELECT CNPJ_DESTINATARIO, SUM(VALOR_TOTAL_NOTAS) AS v FROM resumo_mensal_destinatario GROUP BY 1 ORDER BY v DESC, 1 LIMIT 10",
+    ),
+    "top_produtos_quantidade": (
+        "SELECT i.DESCRICAO_PRODUTO_SERVICO, SUM(i.QUANTIDADE) AS q FROM nfs_itens i GROUP BY 1 ORDER BY q DESC, 1 LIMIT 10",
+        "SELECT DESCRICAO_PRODUTO_SERVICO, SUM(QUANTIDADE_TOTAL) AS q FROM resumo_mensal_produto GROUP BY 1 ORDER BY q DESC, 1 LIMIT 10",
+    ),
+    "valor_itens_por_ncm_mes": (
+        f"SELECT {MONTH_EXPRESSION}, i.CODIGO_NCM_SH, SUM(i.VALOR_TOTAL) FROM nfs_itens i "
+        "JOIN nfs_cabecalho c ON c.CHAVE_DE_ACESSO = i.CHAVE_DE_ACESSO GROUP BY 1, 2 ORDER BY 1, 2",
+        "SELECT MES, CODIGO_NCM_SH, SUM(VALOR_TOTAL_ITENS) FROM resumo_mensal_ncm_cfop GROUP BY 1, 2 ORDER BY 1, 2",
+    ),
+}
+
+def _time_query(conn, sql, repeats):
+    """ Mediana do tempo (ms) de `repeats` execuções da consulta. """
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        conn.execute(sql).fetchall()
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+def _ingest_legacy(db_file, cabecalho_path, itens_path):
+    """ Reproduz o caminho antigo: to_sql(if_exists='replace') em tabelas planas, sem chave, dimensões nem índices. """
+    mapping = get_ingestion_instructions()
+    conn = sqlite3.connect(db_file)
+    df_cab = read_csv_flexible(cabecalho_path).rename(columns=mapping["cabecalho"])
+    df_cab.to_sql('nfs_cabecalho', conn, if_exists='replace', index=False)
+    df_itens = read_csv_flexible(itens_path).rename(columns=mapping["itens"])
+    df_itens.to_sql('nfs_itens', conn, if_exists='replace', index=False)
+    conn.commit()
+    return conn
+
+def _ingest_schema(db_file, cabecalho_path, itens_path, **ingest_kwargs):
+    """ Caminho atual: esquema declarado com chave primária e índices secundários. """
+    conn = create_connection(db_file)
+    create_tables(conn)
+    if not ingest_data(conn, cabecalho_path, itens_path, **ingest_kwargs):
+        raise RuntimeError("Falha na ingestão do benchmark.")
+    return conn
+
+def bench_schema(args):
+    """ Compara a latência das junções entre o esquema antigo (to_sql) e o esquema declarado. """
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cabecalho_path, itens_path = generate_synthetic_csvs(tmpdir, args.notas)
+        results = {}
+        for label, ingest in (("to_sql (antigo)", _ingest_legacy), ("esquema + índices", _ingest_schema)):
+            db_file = os.path.join(tmpdir, f"{label.split()[0]}.db")
+            started = time.perf_counter()
+            conn = ingest(db_file, cabecalho_path, itens_path)
+            ingest_seconds = time.perf_counter() - started
+            results[label] = {name: _time_query(conn, sql, args.repeticoes) for name, sql in JOIN_QUERIES.items()}
+            results[label]["ingestao_s"] = ingest_seconds
+            conn.close()
+
+    print(f"\nNotas: {args.notas} | Itens: {args.notas * 3} | mediana de {args.repeticoes} execuções")
+    print(pd.DataFrame(results).round(2).to_string())
+
+# Etapas da carga medidas em bench_ingestion: nome -> (objeto, atributo) cronometrado
+INGESTION_PHASES = {
+    "dimensoes_s": (data_ingestion._DimensionIds, "encode"),
+    "gravacao_s": (data_ingestion, "insert_dataframe"),  # Inclui as dimensões; descontadas abaixo
+    "indices_s": (data_ingestion, "_create_secondary_indexes"),
+    "resumos_s": (data_ingestion, "rebuild_rollups"),
+}
+
+@contextmanager
+def _phase_timers():
+    """ Cronometra as etapas de INGESTION_PHASES enquanto ativo. Produz o dict de segundos por etapa. """
+    totals = dict.fromkeys(INGESTION_PHASES, 0.0)
+    originals = {}
+
+    def timed(name, function):
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                totals[name] += time.perf_counter() - started
+        return wrapper
+
+    for name, (owner, attribute) in INGESTION_PHASES.items():
+        originals[name] = getattr(owner, attribute)
+        setattr(owner, attribute, timed(name, originals[name]))
+    try:
+        yield totals
+    finally:
+        for name, (owner, attribute) in INGESTION_PHASES.items():
+            setattr(owner, attribute, originals[name])
+    totals["gravacao_s"] -= totals["dimensoes_s"]
+
+def bench_ingestion(args):
+    """ Mede linhas/s da ingestão: to_sql antigo x transação única no esquema declarado.
+
+    O caminho atual faz mais trabalho que o to_sql (dimensões, chave primária, índices secundários e
+    tabelas de resumo); o tempo de cada etapa é mostrado separadamente. "leitura_e_resto_s" é o que
+    sobra: leitura e conversão dos CSVs, limpeza das tabelas e commit.
+    """
+    variants = {
+        "to_sql (antigo)": lambda db, cab, itens: _ingest_legacy(db, cab, itens),
+        "transação única": lambda db, cab, itens: _ingest_schema(db, cab, itens, chunksize=args.bloco),
+    }
+    total_rows = args.notas * 4  # 1 cabeçalho + 3 itens por nota
+    results = {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cabecalho_path, itens_path = generate_synthetic_csvs(tmpdir, args.notas)
+        for label, ingest in variants.items():
+            runs = []
+            for run in range(args.repeticoes):
+                db_file = os.path.join(tmpdir, f"ingestao_{len(results)}_{run}.db")
+                with _phase_timers() as phases:
+                    started = time.perf_counter()
+                    ingest(db_file, cabecalho_path, itens_path).close()
+                    seconds = time.perf_counter() - started
+                runs.append(dict(phases, segundos=seconds))
+            seconds = statistics.median(run["segundos"] for run in runs)
+            results[label] = {"segundos": seconds, "linhas_por_s": total_rows / seconds}
+            for name in INGESTION_PHASES:
+                results[label][name] = statistics.median(run[name] for run in runs)
+            results[label]["leitura_e_resto_s"] = statistics.median(
+                run["segundos"] - sum(run[name] for name in INGESTION_PHASES) for run in runs
+            )
+
+    print(f"\nNotas: {args.notas} | Linhas totais: {total_rows} | blocos de {args.bloco} | mediana de {args.repeticoes} execuções")
+    table = pd.DataFrame(results).T
+    table["ganho"] = table["linhas_por_s"] / table.loc["to_sql (antigo)", "linhas_por_s"]
+    print(table.round(2).to_string())
+
+def _same_rows(rows_a, rows_b):
+    """ Compara resultados tolerando diferenças de arredondamento nas somas em ponto flutuante. """
+    return len(rows_a) == len(rows_b) and all(
+        all(abs(a - b) < 1e-6 * max(1.0, abs(a)) if isinstance(a, float) else a == b for a, b in zip(ra, rb))
+        for ra, rb in zip(rows_a, rows_b)
+    )
+
+def bench_rollups(args):
+    """ Latência das perguntas comuns sobre as tabelas de notas x tabelas de resumo mensal. """
+    results = {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        db_file = os.path.join(tmpdir, "resumos.db")
+        conn = create_connection(db_file)
+        create_tables(conn)
+        notas_por_mes = args.notas // args.meses
+        started = time.perf_counter()
+        for month in range(1, args.meses + 1):
+            cabecalho_path, itens_path = generate_synthetic_csvs(
+                tmpdir, notas_por_mes, prefix=f"2024{month:02d}", seed=SEED + month
+            )
+            ingest_data(conn, cabecalho_path, itens_path, chunksize=args.bloco, incremental=True)
+        ingest_seconds = time.perf_counter() - started
+
+        for name, (raw_sql, rollup_sql) in ROLLUP_QUERIES.items():
+            if not _same_rows(conn.execute(raw_sql).fetchall(), conn.execute(rollup_sql).fetchall()):
+                raise RuntimeError(f"Resumo divergente das tabelas de notas na consulta {name}.")
+            raw_ms = _time_query(conn, raw_sql, args.repeticoes)
+            rollup_ms = _time_query(conn, rollup_sql, args.repeticoes)
+            results[name] = {"notas_ms": raw_ms, "resumo_ms": rollup_ms, "ganho": raw_ms / max(rollup_ms, 1e-6)}
+        conn.close()
+
+    print(f"\nNotas: {notas_por_mes * args.meses} em {args.meses} meses (ingestão incremental em {ingest_seconds:.2f}s)"
+          f" | mediana de {args.repeticoes} execuções")
+    print(pd.DataFrame(results).T.round(2).to_string())
+
+def bench_columnar(args):
+    """ Latência das consultas típicas do agente: SQLite x DuckDB x Parquet (via DuckDB). """
+    backends = [backend for backend in columnar_backend.COLUMNAR_BACKENDS if columnar_backend.is_available(backend)]
+    if not backends:
+        print("Instale duckdb e pyarrow para comparar os backends colunares.")
+        return
+    queries = dict(JOIN_QUERIES)
+    queries.update({name: raw_sql for name, (raw_sql, _) in ROLLUP_QUERIES.items()})
+    results, export_seconds = {}, {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cabecalho_path, itens_path = generate_synthetic_csvs(tmpdir, args.notas)
+        db_file = os.path.join(tmpdir, "colunar.db")
+        conn = _ingest_schema(db_file, cabecalho_path, itens_path, chunksize=args.bloco)
+        results["sqlite"] = {name: _time_query(conn, sql, args.repeticoes) for name, sql in queries.items()}
+        conn.close()
+
+        for backend in backends:
+            started = time.perf_counter()
+            duck_file = columnar_backend.export_from_sqlite(db_file, backend, os.path.join(tmpdir, "colunar"))
+            export_seconds[backend] = time.perf_counter() - started
+            duck = columnar_backend.duckdb.connect(duck_file, read_only=True)
+            results[backend] = {name: _time_query(duck, sql, args.repeticoes) for name, sql in queries.items()}
+            duck.close()
+        close_pools()
+
+    print(f"\nNotas: {args.notas} | Itens: {args.notas * 3} | mediana de {args.repeticoes} execuções (ms)")
+    print("Exportação: " + ", ".join(f"{backend} {seconds:.2f}s" for backend, seconds in export_seconds.items()))
+    print(pd.DataFrame(results).round(2).to_string())
+
+def _run_sessions(query, n_sessions, n_queries):
+    """ Dispara `n_sessions` threads, cada uma com `n_queries` consultas. Retorna as latências (ms) e a duração (s). """
+    latencies, lock = [], threading.Lock()
+    queries = list(JOIN_QUERIES.values())
+
+    def session(session_id):
+        timings = []
+        for n in range(n_queries):
+            started = time.perf_counter()
+            query(queries[(session_id + n) % len(queries)])
+            timings.append((time.perf_counter() - started) * 1000)
+        with lock:
+            latencies.extend(timings)
+
+    threads = [threading.Thread(target=session, args=(i,)) for i in range(n_sessions)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, time.perf_counter() - started
+
+def bench_load(args):
+    """ Latência p50/p99 de consultas com N sessões concorrentes, com e sem ingestão simultânea. """
+    results = {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        cabecalho_path, itens_path = generate_synthetic_csvs(tmpdir, args.notas)
+        db_file = os.path.join(tmpdir, "carga.db")
+        _ingest_schema(db_file, cabecalho_path, itens_path, chunksize=args.bloco).close()
+
+        def new_connection_query(sql):
+            conn = sqlite3.connect(db_file)  # Caminho antigo: uma conexão nova por consulta
+            try:
+                conn.execute(sql).fetchall()
+            finally:
+                conn.close()
+
+        def pooled_query(sql):
+            with read_connection(db_file) as conn:
+                conn.execute(sql).fetchall()
+
+        stop = threading.Event()
+
+        def reingest():
+            """ Recarrega os mesmos arquivos em loop pela conexão de escrita até o fim da medição. """
+            while not stop.is_set():
+                with writer_connection(db_file) as conn:
+                    ingest_data(conn, cabecalho_path, itens_path, chunksize=args.bloco)
+
+        scenarios = [("sem ingestão", False)] + ([("com ingestão", True)] if args.com_ingestao else [])
+        for scenario, with_ingestion in scenarios:
+            for label, query in (("conexão nova", new_connection_query), ("pool somente leitura", pooled_query)):
+                writer = None
+                if with_ingestion:
+                    stop.clear()
+                    writer = threading.Thread(target=reingest)
+                    writer.start()
+                    time.sleep(0.5)  # Deixa a ingestão entrar na transação de escrita
+                latencies, seconds = _run_sessions(query, args.sessoes, args.consultas)
+                if writer is not None:
+                    stop.set()
+                    writer.join()
+                percentiles = statistics.quantiles(latencies, n=100, method="inclusive")
+                results[f"{label} ({scenario})"] = {
+                    "p50_ms": percentiles[49], "p99_ms": percentiles[98], "max_ms": max(latencies),
+                    "consultas_por_s": len(latencies) / seconds,
+                }
+        close_pools()
+
+    print(f"\nNotas: {args.notas} | {args.sessoes} sessões x {args.consultas} consultas")
+    print(pd.DataFrame(results).T.round(2).to_string())
+
+# Perguntas ao agente com o LLM substituído por respostas fixas: mede o custo do agente fora do modelo
+AGENT_QUESTIONS = {
+    "valor_por_uf": ("Qual o valor total das notas por UF do emitente?", ROLLUP_QUERIES["valor_por_uf_emitente"][1]),
+    "top_destinatarios": ("Quais os 10 destinatários com maior valor?", ROLLUP_QUERIES["top_destinatarios"][1]),
+    "itens_por_destinatario": ("Quanto um destinatário comprou de cada produto?", JOIN_QUERIES["itens_por_destinatario"]),
+}
+
+def _stub_llm(sql):
+    """ Chat local que sempre responde com um passo ReAct executando `sql` e depois a resposta final. """
+    from langchain_core.language_models.fake_chat_models import FakeListChatModel
+
+    return FakeListChatModel(responses=[
+        f"Thought: Vou consultar o banco.\nAction: sql_db_query\nAction Input: {sql}",
+        "Thought: Já tenho o resultado.\nFinal Answer: Resposta calculada a partir da consulta.",
+    ])
+
+def _result_digest(rows):
+    """ Resumo estável do resultado (floats arredondados) para detectar mudanças de conteúdo. """
+    normalized = [[round(value, 2) if isinstance(value, float) else value for value in row] for row in rows]
+    return hashlib.sha256(json.dumps(normalized, default=str).encode()).hexdigest()[:16]
+
+def _time_agent(db_file, question, sql, repeats):
+    """ Mediana (ms) de `query_database_agent` com o LLM local, depois de uma chamada de aquecimento. """
+    previous_db_file = database_agent.DB_FILE
+    database_agent.DB_FILE = db_file
+    try:
+        llm = _stub_llm(sql)
+        timings = []
+        for run in range(repeats + 1):
+            started = time.perf_counter()
+            response = database_agent.query_database_agent(question, None, llm=llm, use_cache=False)
+            if "error" in response:
+                raise RuntimeError(f"Agente falhou no benchmark: {response['error']}")
+            if run:  # A primeira chamada constrói o agente
+                timings.append((time.perf_counter() - started) * 1000)
+        return statistics.median(timings)
+    finally:
+        database_agent.DB_FILE = previous_db_file
+        database_agent.invalidate_agent_pool()
+
+def run_suite(n_notas, repeats, chunksize):
+    """ Mede ingestão (os dois separadores), consultas fixas e o agente. Retorna métricas e resumos dos resultados. """
+    metrics, digests = {}, {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for label, sep in (("virgula", ","), ("ponto_e_virgula", ";")):
+            cabecalho_path, itens_path = generate_synthetic_csvs(os.path.join(tmpdir, label), n_notas, sep=sep)
+            db_file = os.path.join(tmpdir, f"{label}.db")
+            started = time.perf_counter()
+            _ingest_schema(db_file, cabecalho_path, itens_path, chunksize=chunksize).close()
+            metrics[f"ingestao_{label}_s"] = time.perf_counter() - started
+
+        queries = dict(JOIN_QUERIES)
+        queries.update({f"{name}_notas": raw for name, (raw, _) in ROLLUP_QUERIES.items()})
+        queries.update({f"{name}_resumo": rollup for name, (_, rollup) in ROLLUP_QUERIES.items()})
+        conn = sqlite3.connect(db_file)
+        for name, sql in queries.items():
+            metrics[f"sql_{name}_ms"] = _time_query(conn, sql, repeats)
+            digests[f"sql_{name}"] = _result_digest(conn.execute(sql).fetchall())
+        conn.close()
+
+        for name, (question, sql) in AGENT_QUESTIONS.items():
+            metrics[f"agente_{name}_ms"] = _time_agent(db_file, question, sql, repeats)
+        close_pools()
+    return metrics, digests
+
+def compare_with_baseline(metrics, digests, baseline, tolerance):
+    """ Tabela atual x baseline. Retorna (tabela, houve regressão ou resultado diferente). """
+    rows, failed = {}, False
+    for name, value in metrics.items():
+        reference = baseline["metricas"].get(name)
+        status = "novo"
+        if reference:
+            change = value / reference - 1
+            status = "REGRESSÃO" if change > tolerance else "melhora" if change < -tolerance else "ok"
+            failed |= status == "REGRESSÃO"
+        rows[name] = {"baseline": reference, "atual": round(value, 3),
+                      "variacao_%": None if not reference else round(100 * (value / reference - 1), 1), "status": status}
+    for name, digest in digests.items():
+        expected = baseline.get("resultados", {}).get(name)
+        if expected is not None and expected != digest:
+            rows.setdefault(f"{name}_ms", {})["status"] = "RESULTADO DIFERENTE"
+            failed = True
+    return pd.DataFrame(rows).T, failed
+
+def bench_suite(args):
+    """ Suíte reprodutível: dados sintéticos fixos, comparação com o baseline gravado em BASELINE_FILE. """
+    metrics, digests = run_suite(args.notas, args.repeticoes, args.bloco)
+    parameters = {"notas": args.notas, "repeticoes": args.repeticoes, "bloco": args.bloco, "semente": SEED}
+    if args.salvar_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({
+                "parametros": parameters,
+                "ambiente": {"python": platform.python_version(), "sqlite": sqlite3.sqlite_version,
+                             "plataforma": platform.platform(), "cpus": os.cpu_count()},
+                "metricas": {name: round(value, 3) for name, value in metrics.items()},
+                "resultados": digests,
+            }, f, indent=2, ensure_ascii=False)
+        print(f"Baseline gravado em {args.baseline}.")
+        print(pd.Series(metrics).round(2).to_string())
+        return
+
+    if not os.path.exists(args.baseline):
+        print(f"Baseline {args.baseline} não encontrado; rode com --salvar-baseline para criá-lo.")
+        print(pd.Series(metrics).round(2).to_string())
+        return
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    if baseline["parametros"] != parameters:
+        print(f"Aviso: parâmetros diferentes do baseline ({baseline['parametros']}); tempos não são comparáveis.")
+    table, failed = compare_with_baseline(metrics, digests, baseline, args.tolerancia)
+    print(f"\nNotas: {args.notas} | mediana de {args.repeticoes} execuções | tolerância {args.tolerancia:.0%}")
+    print(table.to_string())
+    if failed:
+        sys.exit(1)
+
+def bench_formatting(args):
+    """ Células/s da formatação brasileira: funções escalares (uma chamada por célula) x colunas vetorizadas. """
+    rng = np.random.default_rng(SEED)
+    values = pd.Series(np.round(rng.lognormal(6, 3, args.linhas), 3))  # 3 casas: inclui empates de meio centavo
+    values[rng.random(args.linhas) < 0.01] = np.nan
+    variants = {
+        "moeda": (output_formatter.format_brazilian_currency, output_formatter.format_brazilian_currency_column),
+        "número": (output_formatter.format_brazilian_number, output_formatter.format_brazilian_number_column),
+    }
+    results = {}
+    for label, (scalar, vectorized) in variants.items():
+        if not (values.map(scalar) == vectorized(values)).all():
+            raise RuntimeError(f"Formatação vetorizada ({label}) diverge da escalar.")
+        for kind, format_values in (("escalar", lambda: values.map(scalar)), ("vetorizada", lambda: vectorized(values))):
+            timings = []
+            for _ in range(args.repeticoes):
+                started = time.perf_counter()
+                format_values()
+                timings.append(time.perf_counter() - started)
+            results[f"{label} ({kind})"] = {"ms": statistics.median(timings) * 1000,
+                                            "celulas_por_s": args.linhas / statistics.median(timings)}
+
+    print(f"\nLinhas: {args.linhas} | mediana de {args.repeticoes} execuções")
+    print(pd.DataFrame(results).T.round(1).to_string())
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmarks do csv-nav.")
+    subparsers = parser.add_subparsers(dest="comando", required=True)
+
+    parser_schema = subparsers.add_parser("esquema", help="Latência de junções: to_sql antigo x esquema declarado.")
+    parser_schema.add_argument("--notas", type=int, default=50_000)
+    parser_schema.add_argument("--repeticoes", type=int, default=5)
+    parser_schema.set_defaults(func=bench_schema)
+
+    parser_ingestion = subparsers.add_parser("ingestao", help="Linhas/s da ingestão (to_sql antigo x transação única), por etapa.")
+    parser_ingestion.add_argument("--notas", type=int, default=200_000)
+    parser_ingestion.add_argument("--bloco", type=int, default=100_000)
+    parser_ingestion.add_argument("--repeticoes", type=int, default=3)
+    parser_ingestion.set_defaults(func=bench_ingestion)
+
+    parser_load = subparsers.add_parser("carga", help="Latência p50/p99 com sessões concorrentes (pool x conexão nova).")
+    parser_load.add_argument("--notas", type=int, default=20_000)
+    parser_load.add_argument("--bloco", type=int, default=100_000)
+    parser_load.add_argument("--sessoes", type=int, default=8)
+    parser_load.add_argument("--consultas", type=int, default=20)
+    parser_load.add_argument("--com-ingestao", action="store_true", help="Recarrega o banco em paralelo às consultas.")
+    parser_load.set_defaults(func=bench_load)
+
+    parser_rollups = subparsers.add_parser("resumos", help="Perguntas comuns: tabelas de notas x tabelas de resumo.")
+    parser_rollups.add_argument("--notas", type=int, default=100_000)
+    parser_rollups.add_argument("--meses", type=int, default=6)
+    parser_rollups.add_argument("--bloco", type=int, default=100_000)
+    parser_rollups.add_argument("--repeticoes", type=int, default=5)
+    parser_rollups.set_defaults(func=bench_rollups)
+
+    parser_columnar = subparsers.add_parser("colunar", help="Consultas típicas do agente: SQLite x DuckDB x Parquet.")
+    parser_columnar.add_argument("--notas", type=int, default=200_000)
+    parser_columnar.add_argument("--bloco", type=int, default=100_000)
+    parser_columnar.add_argument("--repeticoes", type=int, default=5)
+    parser_columnar.set_defaults(func=bench_columnar)
+
+    parser_suite = subparsers.add_parser("suite", help="Ingestão, consultas fixas e agente (LLM local) x baseline gravado.")
+    parser_suite.add_argument("--notas", type=int, default=50_000)
+    parser_suite.add_argument("--bloco", type=int, default=100_000)
+    parser_suite.add_argument("--repeticoes", type=int, default=5)
+    parser_suite.add_argument("--baseline", default=BASELINE_FILE)
+    parser_suite.add_argument("--tolerancia", type=float, default=BASELINE_TOLERANCE)
+    parser_suite.add_argument("--salvar-baseline", action="store_true", help="Grava as medições atuais como baseline.")
+    parser_suite.set_defaults(func=bench_suite)
+
+    parser_formatting = subparsers.add_parser("formatacao", help="Formatação brasileira: escalar x vetorizada.")
+    parser_formatting.add_argument("--linhas", type=int, default=100_000)
+    parser_formatting.add_argument("--repeticoes", type=int, default=5)
+    parser_formatting.set_defaults(func=bench_formatting)
+
+    args = parser.parse_args()
+    args.func(args)
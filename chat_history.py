@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+""" Histórico do chat com tamanho limitado por sessão do Streamlit.
+
+Cada mensagem é guardada já formatada (texto Markdown pronto para `st.markdown`). Tabelas de
+resultado com mais de INLINE_ROWS linhas vão inteiras para um arquivo da sessão em HISTORY_DIR e só
+uma prévia fica na memória; a prévia das mensagens mais antigas é descartada (a tabela é paginada a
+partir do disco quando o usuário pede). Além de MAX_ENTRIES mensagens, as mais antigas saem da sessão
+e são arquivadas em disco. Assim a memória por sessão e o tempo de cada rerun não crescem com a
+duração da conversa.
+"""
+import os
+import json
+import time
+import uuid
+import shutil
+import pickle
+import logging
+
+try:
+    import pyarrow.parquet as pa_parquet  # Opcional: tabelas em Parquet, lidas por página (row group)
+except ImportError:
+    pa_parquet = None
+
+# Configuração básica de logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+HISTORY_DIR = "historico_chat"
+INLINE_ROWS = 200  # Linhas mantidas na sessão; também o tamanho da página lida do disco
+MAX_ENTRIES = 60  # Mensagens mantidas na sessão; as anteriores são arquivadas em disco
+PREVIEW_ENTRIES = 10  # Mensagens mais recentes que mantêm a prévia da tabela em memória
+SESSION_MAX_AGE_S = 24 * 3600  # Pastas de sessões sem uso há mais tempo são removidas
+ARCHIVE_FILE = "mensagens_arquivadas.jsonl"
+
+def new_session_dir(base_dir=HISTORY_DIR):
+    """ Pasta exclusiva da sessão para as tabelas e mensagens arquivadas. """
+    path = os.path.join(base_dir, uuid.uuid4().hex)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def cleanup_old_sessions(base_dir=HISTORY_DIR, max_age_s=SESSION_MAX_AGE_S):
+    """ Remove as pastas de sessões não modificadas há mais de `max_age_s` segundos. """
+    if not os.path.isdir(base_dir):
+        return
+    limit = time.time() - max_age_s
+    for name in os.listdir(base_dir):
+        path = os.path.join(base_dir, name)
+        try:
+            if os.path.isdir(path) and os.path.getmtime(path) < limit:
+                shutil.rmtree(path)
+                logging.info(f"Histórico de sessão antiga removido: {path}")
+        except OSError as e:
+            logging.warning(f"Não foi possível remover o histórico {path}: {e}")
+
+def _spill(df, session_dir, entry_id):
+    """ Grava a tabela completa da mensagem na pasta da sessão. Retorna o caminho. """
+    if pa_parquet is not None:
+        path = os.path.join(session_dir, f"{entry_id}.parquet")
+        df.to_parquet(path, index=False, row_group_size=INLINE_ROWS)
+    else:
+        path = os.path.join(session_dir, f"{entry_id}.pkl")
+        df.to_pickle(path)
+    return path
+
+def make_entry(role, content, session_dir, data=None, truncated=False, trace=None):
+    """ Mensagem do histórico já formatada; tabelas grandes vão para o disco com uma prévia em memória. """
+    entry = {"id": uuid.uuid4().hex[:12], "role": role, "content": content, "trace": trace,
+             "data": None, "data_rows": 0, "data_file": None, "truncated": truncated}
+    if data is not None:
+        entry["data_rows"] = len(data)
+        if len(data) > INLINE_ROWS:
+            entry["data_file"] = _spill(data, session_dir, entry["id"])
+            data = data.head(INLINE_ROWS)
+        entry["data"] = data
+    return entry
+
+def append_entry(history, entry, session_dir):
+    """ Acrescenta a mensagem e aplica os limites de memória ao histórico (no lugar). """
+    history.append(entry)
+    # Mensagens antigas perdem a prévia de tabelas que estão em disco
+    for old in history[:-PREVIEW_ENTRIES]:
+        if old.get("data_file") and old.get("data") is not None:
+            old["data"] = None
+    overflow = len(history) - MAX_ENTRIES
+    if overflow > 0:
+        archived = history[:overflow]
+        del history[:overflow]
+        with open(os.path.join(session_dir, ARCHIVE_FILE), "a", encoding="utf-8") as f:
+            for old in archived:
+                record = {key: old.get(key) for key in ("id", "role", "content", "data_rows", "data_file")}
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        logging.info(f"{overflow} mensagem(ns) antiga(s) arquivada(s) em {session_dir}.")
+
+def archived_count(session_dir):
+    """ Quantas mensagens já saíram da sessão para o arquivo em disco. """
+    path = os.path.join(session_dir, ARCHIVE_FILE)
+    if not os.path.exists(path):
+        return 0
+    with open(path, encoding="utf-8") as f:
+        return sum(1 for _ in f)
+
+def page_count(entry):
+    """ Número de páginas de INLINE_ROWS linhas da tabela da mensagem. """
+    return max(1, -(-entry.get("data_rows", 0) // INLINE_ROWS))
+
+def load_page(entry, page):
+    """ Página `page` (a partir de 0) da tabela da mensagem, lida do disco quando não está em memória. """
+    if entry.get("data_file") is None:
+        return entry.get("data")
+    if page == 0 and entry.get("data") is not None:
+        return entry["data"]
+    path = entry["data_file"]
+    if path.endswith(".parquet"):
+        parquet_file = pa_parquet.ParquetFile(path)
+        return parquet_file.read_row_group(min(page, parquet_file.num_row_groups - 1)).to_pandas()
+    with open(path, "rb") as f:
+        df = pickle.load(f)
+    return df.iloc[page * INLINE_ROWS:(page + 1) * INLINE_ROWS]
@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+""" Backend colunar (DuckDB ou Parquet) para as consultas analíticas do agente.
+
+O SQLite continua sendo a fonte da verdade da ingestão (chaves, upserts, registro de arquivos).
+Depois de cada ingestão as tabelas de notas e de resumo são exportadas em blocos para um banco
+DuckDB ou para arquivos Parquet (consultados pelo DuckDB por meio de visões), mantendo os nomes
+`nfs_cabecalho`/`nfs_itens`. Cada exportação pertence a uma geração do banco SQLite e é publicada
+por renomeação atômica, então leitores nunca veem uma exportação pela metade.
+"""
+import os
+import glob
+import shutil
+import logging
+import threading
+import time
+
+from db_pool import read_connection
+from rollups import ROLLUPS
+
+try:
+    import duckdb  # Opcional: consulta dos backends colunares
+except ImportError:
+    duckdb = None
+
+try:
+    import pyarrow as pa  # Opcional: blocos de exportação e escrita dos arquivos Parquet
+    import pyarrow.parquet as pa_parquet
+except ImportError:
+    pa = None
+    pa_parquet = None
+
+# Configuração básica de logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+COLUMNAR_DIR = "colunar"
+COLUMNAR_BACKENDS = ("duckdb", "parquet")
+EXPORT_CHUNK_ROWS = 200_000
+EXPORTED_TABLES = ["nfs_cabecalho", "nfs_itens"] + list(ROLLUPS)
+
+# Tipo declarado no SQLite -> (tipo DuckDB, tipo Arrow)
+_TYPE_MAP = {
+    "INTEGER": ("BIGINT", "int64"),
+    "REAL": ("DOUBLE", "float64"),
+    "TEXT": ("VARCHAR", "string"),
+}
+
+_export_lock = threading.Lock()
+# Uma conexão DuckDB somente leitura por arquivo, compartilhada pelo processo: o DuckDB não aceita
+# conexões ao mesmo arquivo com configurações diferentes, então consultas diretas e o SQLAlchemy do
+# agente usam cursores (conexões duplicadas, seguras entre threads) desta mesma conexão.
+_shared_connections = {}
+_connections_lock = threading.Lock()
+
+def is_available(backend):
+    """ O backend pode ser usado com os pacotes instalados? """
+    if backend == "sqlite":
+        return True
+    return backend in COLUMNAR_BACKENDS and duckdb is not None and pa is not None
+
+def available_backends():
+    """ Backends de consulta disponíveis neste ambiente, com o SQLite sempre em primeiro. """
+    return ["sqlite"] + [backend for backend in COLUMNAR_BACKENDS if is_available(backend)]
+
+def _sqlite_generation(sqlite_file):
+    with read_connection(sqlite_file) as conn:
+        return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def _generation_path(backend, generation, base_dir):
+    if backend == "duckdb":
+        return os.path.join(base_dir, f"duckdb_g{generation:06d}.duckdb")
+    return os.path.join(base_dir, f"parquet_g{generation:06d}")
+
+def _database_file_of(backend, path):
+    return path if backend == "duckdb" else os.path.join(path, "visoes.duckdb")
+
+def columnar_database_file(backend, generation, base_dir=COLUMNAR_DIR):
+    """ Arquivo DuckDB consultado para a geração: o próprio banco ou o arquivo de visões sobre o Parquet. """
+    return _database_file_of(backend, _generation_path(backend, generation, base_dir))
+
+def _table_columns(conn, table):
+    """ [(coluna, tipo DuckDB, tipo Arrow)] a partir do tipo declarado no SQLite. """
+    columns = []
+    for _, name, declared_type, *_ in conn.execute(f"PRAGMA table_info({table})"):
+        duck_type, arrow_type = _TYPE_MAP.get(declared_type.upper(), ("VARCHAR", "string"))
+        columns.append((name, duck_type, arrow_type))
+    return columns
+
+def _iter_arrow_chunks(conn, table, columns, chunk_rows):
+    """ Lê a tabela do SQLite em blocos e os devolve como pyarrow.Table com os tipos declarados. """
+    schema = pa.schema([(name, arrow_type) for name, _, arrow_type in columns])
+    cursor = conn.execute(f"SELECT {', '.join(name for name, _, _ in columns)} FROM {table}")
+    try:
+        while True:
+            rows = cursor.fetchmany(chunk_rows)
+            if not rows:
+                break
+            arrays = [pa.array(values, type=field.type) for values, field in zip(zip(*rows), schema)]
+            yield pa.Table.from_arrays(arrays, schema=schema)
+    finally:
+        cursor.close()
+
+def _export_duckdb(conn, target, chunk_rows):
+    temp_target = target + ".tmp"
+    if os.path.exists(temp_target):
+        os.remove(temp_target)
+    duck = duckdb.connect(temp_target)
+    try:
+        for table in EXPORTED_TABLES:
+            columns = _table_columns(conn, table)
+            duck.execute(f"CREATE TABLE {table} ({', '.join(f'{name} {duck_type}' for name, duck_type, _ in columns)})")
+            for chunk in _iter_arrow_chunks(conn, table, columns, chunk_rows):
+                duck.register("bloco", chunk)
+                duck.execute(f"INSERT INTO {table} SELECT * FROM bloco")
+                duck.unregister("bloco")
+    finally:
+        duck.close()
+    os.replace(temp_target, target)
+
+def _export_parquet(conn, target, chunk_rows):
+    temp_target = target + ".tmp"
+    shutil.rmtree(temp_target, ignore_errors=True)
+    os.makedirs(temp_target)
+    for table in EXPORTED_TABLES:
+        columns = _table_columns(conn, table)
+        schema = pa.schema([(name, arrow_type) for name, _, arrow_type in columns])
+        with pa_parquet.ParquetWriter(os.path.join(temp_target, f"{table}.parquet"), schema) as writer:
+            for chunk in _iter_arrow_chunks(conn, table, columns, chunk_rows):
+                writer.write_table(chunk)
+    shutil.rmtree(target, ignore_errors=True)
+    os.replace(temp_target, target)
+
+    # As visões apontam para o caminho definitivo; o arquivo de visões marca a exportação como completa
+    views_file = os.path.join(target, "visoes.duckdb")
+    duck = duckdb.connect(views_file + ".tmp")
+    try:
+        for table in EXPORTED_TABLES:
+            parquet_path = os.path.abspath(os.path.join(target, f"{table}.parquet")).replace("'", "''")
+            duck.execute(f"CREATE VIEW {table} AS SELECT * FROM read_parquet('{parquet_path}')")
+    finally:
+        duck.close()
+    os.replace(views_file + ".tmp", views_file)
+
+def _remove_old_generations(backend, generation, base_dir):
+    """ Mantém apenas a geração atual e a anterior (que ainda pode estar em uso por leitores). """
+    pattern = "duckdb_g*.duckdb" if backend == "duckdb" else "parquet_g*"
+    keep = {_generation_path(backend, g, base_dir) for g in (generation, generation - 1)}
+    for path in glob.glob(os.path.join(base_dir, pattern)):
+        if path in keep:
+            continue
+        with _connections_lock:
+            shared = _shared_connections.pop(os.path.abspath(_database_file_of(backend, path)), None)
+        if shared is not None:
+            shared.close()
+        try:
+            shutil.rmtree(path) if os.path.isdir(path) else os.remove(path)
+        except OSError as e:
+            logging.warning(f"Não foi possível remover a exportação antiga {path}: {e}")
+
+def export_from_sqlite(sqlite_file, backend, base_dir=COLUMNAR_DIR, chunk_rows=EXPORT_CHUNK_ROWS):
+    """ Exporta as tabelas do SQLite para o backend colunar na geração atual. Retorna o arquivo DuckDB. """
+    if not is_available(backend):
+        raise ImportError(f"O backend '{backend}' requer os pacotes duckdb e pyarrow.")
+    os.makedirs(base_dir, exist_ok=True)
+    started = time.perf_counter()
+    with read_connection(sqlite_file) as conn:
+        # Uma única transação de leitura: todas as tabelas vêm do mesmo commit
+        conn.execute("BEGIN")
+        try:
+            generation = conn.execute("PRAGMA user_version").fetchone()[0]
+            target = _generation_path(backend, generation, base_dir)
+            if backend == "duckdb":
+                _export_duckdb(conn, target, chunk_rows)
+            else:
+                _export_parquet(conn, target, chunk_rows)
+        finally:
+            conn.rollback()
+    _remove_old_generations(backend, generation, base_dir)
+    logging.info(f"Exportação {backend} da geração {generation} concluída em {time.perf_counter() - started:.2f}s.")
+    return columnar_database_file(backend, generation, base_dir)
+
+def ensure_export(sqlite_file, backend, base_dir=COLUMNAR_DIR):
+    """ Retorna o arquivo DuckDB da geração atual do SQLite, exportando-o se ainda não existir. """
+    database_file = columnar_database_file(backend, _sqlite_generation(sqlite_file), base_dir)
+    if os.path.exists(database_file):
+        return database_file
+    with _export_lock:
+        database_file = columnar_database_file(backend, _sqlite_generation(sqlite_file), base_dir)
+        if not os.path.exists(database_file):
+            database_file = export_from_sqlite(sqlite_file, backend, base_dir)
+    return database_file
+
+def connect(sqlite_file, backend):
+    """ Cursor somente leitura sobre a exportação colunar da geração atual (exportando se preciso). """
+    database_file = os.path.abspath(ensure_export(sqlite_file, backend))
+    with _connections_lock:
+        shared = _shared_connections.get(database_file)
+        if shared is None:
+            shared = _shared_connections[database_file] = duckdb.connect(database_file, read_only=True)
+        return shared.cursor()
+
+def execute(sqlite_file, backend, sql_query, max_rows=None):
+    """ Executa a consulta no backend colunar da geração atual. Retorna (colunas, linhas, truncado). """
+    duck = connect(sqlite_file, backend)
+    try:
+        cursor = duck.execute(sql_query)
+        column_names = [description[0] for description in cursor.description] if cursor.description else []
+        if max_rows is None:
+            return column_names, cursor.fetchall(), False
+        rows = cursor.fetchmany(max_rows + 1)
+        return column_names, rows[:max_rows], len(rows) > max_rows
+    finally:
+        duck.close()
+
+def sqlalchemy_engine_args(sqlite_file, backend):
+    """ URI e argumentos do SQLAlchemy (dialeto duckdb_engine) para o SQLDatabase do agente. """
+    import duckdb_engine  # Necessário apenas para o agente consultar o backend colunar
+
+    database_file = os.path.abspath(ensure_export(sqlite_file, backend))
+    return f"duckdb:///{database_file}", {
+        "creator": lambda: duckdb_engine.ConnectionWrapper(connect(sqlite_file, backend))
+    }
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+""" Origens dos CSVs de ingestão: arquivo em disco, membro de um ZIP ou buffer enviado pelo upload.
+
+A ingestão lê os CSVs em streaming a partir de `CsvSource.open()`, sem extrair o ZIP nem copiar o
+upload para arquivos temporários. Cada origem informa nome, tamanho descompactado e a impressão
+digital usada no registro de arquivos ingeridos: o SHA-256 do conteúdo (descompactado, no caso de
+membros de ZIP), calculado em streaming na primeira consulta. O mesmo CSV tem, portanto, a mesma
+impressão digital em disco, no upload ou dentro de um ZIP.
+"""
+import io
+import os
+import hashlib
+import zipfile
+
+CABECALHO_SUFFIX = "_nfs_cabecalho.csv"
+ITENS_SUFFIX = "_nfs_itens.csv"
+
+class CsvSource:
+    """ Um CSV a ser ingerido. `path` só é definido para arquivos em disco (leitura paralela por faixas). """
+
+    def __init__(self, name, size, opener, fingerprint, path=None):
+        self.name = name
+        self.size = size
+        self.path = path
+        self._opener = opener
+        self._fingerprint = fingerprint
+
+    def open(self):
+        """ Novo handle binário posicionado no início do CSV. Deve ser fechado por quem abriu. """
+        return self._opener()
+
+    def fingerprint(self):
+        """ Hash do conteúdo usado em `arquivos_ingeridos` para pular arquivos repetidos. """
+        if callable(self._fingerprint):
+            self._fingerprint = self._fingerprint()
+        return self._fingerprint
+
+    def __repr__(self):
+        return f"CsvSource({self.name!r}, {self.size} bytes)"
+
+def _sha256_stream(opener, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with opener() as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def source_from_path(path):
+    """ CSV em disco; o hash do conteúdo só é calculado quando for consultado. """
+    return CsvSource(
+        os.path.basename(path), os.path.getsize(path), lambda: open(path, 'rb'),
+        lambda: _sha256_stream(lambda: open(path, 'rb')), path=path,
+    )
+
+def source_from_buffer(name, data):
+    """ CSV enviado pelo upload, lido direto da memória (`data` é bytes, compartilhado sem cópia). """
+    return CsvSource(name, len(data), lambda: io.BytesIO(data), lambda: hashlib.sha256(data).hexdigest())
+
+def as_source(csv):
+    """ Aceita um caminho ou uma CsvSource. """
+    return csv if isinstance(csv, CsvSource) else source_from_path(csv)
+
+def _zip_member_source(open_archive, info):
+    # O ZipExtFile mantém o arquivo subjacente aberto até ser fechado, mesmo sem referência ao ZipFile
+    opener = lambda: open_archive().open(info)
+    return CsvSource(
+        os.path.basename(info.filename), info.file_size, opener,
+        lambda: _sha256_stream(opener),  # Conteúdo descompactado (o ZipExtFile também confere o CRC)
+    )
+
+def sources_from_zip(archive):
+    """ CsvSources dos CSVs de um ZIP, dado o caminho do arquivo ou o seu conteúdo em bytes.
+
+    Levanta zipfile.BadZipFile se o arquivo não for um ZIP válido.
+    """
+    if isinstance(archive, (bytes, bytearray, memoryview)):
+        open_archive = lambda: zipfile.ZipFile(io.BytesIO(archive))
+    else:
+        open_archive = lambda: zipfile.ZipFile(archive)
+    with open_archive() as zip_ref:
+        members = [info for info in zip_ref.infolist() if not info.is_dir() and info.filename.lower().endswith(".csv")]
+    return [_zip_member_source(open_archive, info) for info in members]
+
+def sources_from_paths(paths):
+    """ CsvSources dos CSVs em disco e dos CSVs dentro de ZIPs, dados arquivos e/ou diretórios (recursivo). """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                files.extend(os.path.join(root, name) for name in names)
+        else:
+            files.append(path)
+    sources = []
+    for file_path in sorted(files):
+        if file_path.lower().endswith(".zip"):
+            sources.extend(sources_from_zip(file_path))
+        elif file_path.lower().endswith(".csv"):
+            sources.append(source_from_path(file_path))
+    return sources
+
+def period_of(name):
+    """ Prefixo do par ('202401' em '202401_NFs_Cabecalho.csv'), ou None se o nome não seguir o padrão. """
+    lower = os.path.basename(name).lower()
+    for suffix in (CABECALHO_SUFFIX, ITENS_SUFFIX):
+        if lower.endswith(suffix):
+            return os.path.basename(name)[:-len(suffix)]
+    return None
+
+def find_csv_pairs(sources):
+    """ Agrupa as origens em pares (cabeçalho, itens) pelo prefixo do nome.
+
+    Retorna ([(prefixo, cabeçalho, itens)] em ordem de prefixo, [mensagens de erro]). Prefixos sem o par
+    completo ou repetidos são reportados como erro.
+    """
+    pairs, errors = {}, []
+    for source in sources:
+        prefix = period_of(source.name)
+        if prefix is None:
+            continue
+        table = "cabecalho" if source.name.lower().endswith(CABECALHO_SUFFIX) else "itens"
+        pair = pairs.setdefault(prefix, {})
+        if table in pair:
+            errors.append(f"Arquivo `{source.name}` repetido para o prefixo `{prefix}`.")
+        pair[table] = source
+    result = []
+    for prefix in sorted(pairs):
+        pair = pairs[prefix]
+        missing = [table for table in ("cabecalho", "itens") if table not in pair]
+        if missing:
+            errors.append(f"Falta o arquivo `{prefix}_NFs_{missing[0].capitalize()}.csv` do par `{prefix}`.")
+            continue
+        result.append((prefix, pair["cabecalho"], pair["itens"]))
+    if not result and not errors:
+        errors.append("Nenhum par `*_NFs_Cabecalho.csv` / `*_NFs_Itens.csv` encontrado.")
+    return result, errors
@@ -1,58 +1,255 @@
 # -*- coding: utf-8 -*-
+import os
 import sqlite3
+import numpy as np
 import pandas as pd
 import logging
+import hashlib
+import re
+import time
+
+import io
+import csv
+import codecs
+import argparse
+import multiprocessing
+from collections import deque, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+from db_pool import enable_wal, read_connection, writer_connection
+import columnar_backend
+import db_generations
+from csv_sources import as_source, period_of, sources_from_paths, find_csv_pairs
+from rollups import (
+    get_rollup_schema, prepare_affected_months, track_affected_months, rollups_need_full_rebuild, rebuild_rollups
+)
+
+try:
+    import resource  # Disponível apenas em sistemas Unix
+except ImportError:
+    resource = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv  # Opcional: parser multithread e em streaming
+except ImportError:
+    pa = None
+    pa_csv = None
 
 # Configuração básica de logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 DB_FILE = "notas_fiscais.db"
+CHUNK_SIZE = 200_000  # Linhas por bloco no modo de ingestão em streaming
+PARSE_WORKERS = os.cpu_count() or 1  # Processos de parsing quando o pyarrow não está instalado
+SAMPLE_BYTES = 64 * 1024  # Amostra usada para estimar o tamanho médio das linhas
+
+SNIFF_BYTES = 16 * 1024  # Amostra usada para detectar o dialeto do CSV
+SNIFF_CACHE_MAX_ENTRIES = 256
+_dialect_cache = {}  # impressão digital da amostra -> dialeto detectado
+
+class IngestionCancelled(Exception):
+    """ Levantada pelo callback de progresso para interromper a ingestão; a transação é desfeita. """
+
+class LegacyMigrationError(Exception):
+    """ Levantada quando as tabelas de um banco antigo não podem ser migradas; o banco fica inalterado. """
+
+# Conversão de tipos aplicada a cada tabela após a renomeação das colunas
+COLUMN_TYPES = {
+    "cabecalho": {
+        'VALOR_NOTA_FISCAL': 'float',
+        'SERIE': 'Int64',
+        'NUMERO': 'Int64',
+    },
+    "itens": {
+        'NUMERO_PRODUTO': 'Int64',
+        'CFOP': 'Int64',
+        'QUANTIDADE': 'float',
+        'VALOR_UNITARIO': 'float',
+        'VALOR_TOTAL': 'float',
+    },
+}
+
+# Colunas de data no formato brasileiro e a coluna ISO-8601 ('AAAA-MM-DD HH:MM:SS') derivada de cada uma
+DATE_COLUMNS = {
+    'DATA_EMISSAO': 'DATA_EMISSAO_ISO',
+    'DATA_HORA_EVENTO_MAIS_RECENTE': 'DATA_HORA_EVENTO_ISO',
+}
+
+# Período 'AAAAMM' do arquivo de origem (prefixo do nome), gravado em PERIODO nas duas tabelas
+PERIOD_PATTERN = re.compile(r"\d{6}")
 
-# --- Funções do "Agente Curador" --- 
+# Colunas derivadas acrescentadas ao cabeçalho por ALTER TABLE em bancos criados antes delas
+DERIVED_DATE_COLUMNS = {
+    'DATA_EMISSAO_ISO': 'TEXT',
+    'ANO_EMISSAO': 'INTEGER',
+    'MES_EMISSAO': 'INTEGER',
+    'DATA_HORA_EVENTO_ISO': 'TEXT',
+}
+
+# Dimensões dos atributos de texto repetitivos que não são usados em filtros e agrupamentos frequentes:
+# cada combinação distinta de valores é gravada uma vez, com uma chave inteira (`chave`) referenciada
+# pela tabela fato (`fato_<tabela>`). CNPJs, UFs, código NCM, CFOP, unidade, datas e PERIODO ficam na
+# própria tabela fato, com seus índices, para que varreduras e agrupamentos não consultem dimensões.
+DIMENSIONS = {
+    "dim_emitente": {
+        "tabela": "cabecalho", "chave": "ID_EMITENTE",
+        "colunas": {
+            'RAZAO_SOCIAL_EMITENTE': 'TEXT', 'INSCRICAO_ESTADUAL_EMITENTE': 'TEXT', 'MUNICIPIO_EMITENTE': 'TEXT',
+        },
+    },
+    "dim_destinatario": {
+        "tabela": "cabecalho", "chave": "ID_DESTINATARIO",
+        "colunas": {'NOME_DESTINATARIO': 'TEXT', 'INDICADOR_IE_DESTINATARIO': 'TEXT'},
+    },
+    # Atributos da operação com poucos valores cada, combinados em uma única dimensão
+    "dim_operacao": {
+        "tabela": "cabecalho", "chave": "ID_OPERACAO",
+        "colunas": {
+            'MODELO': 'TEXT', 'NATUREZA_DA_OPERACAO': 'TEXT', 'EVENTO_MAIS_RECENTE': 'TEXT',
+            'DESTINO_DA_OPERACAO': 'TEXT', 'CONSUMIDOR_FINAL': 'TEXT', 'PRESENCA_DO_COMPRADOR': 'TEXT',
+        },
+    },
+    "dim_ncm": {
+        "tabela": "itens", "chave": "ID_NCM",
+        "colunas": {'NCM_SH_TIPO_PRODUTO': 'TEXT'},
+    },
+}
+
+# Colunas de texto com poucos valores distintos, lidas do CSV como categóricas (dicionário + códigos)
+CATEGORICAL_COLUMNS = {
+    column for dimension in DIMENSIONS.values() for column in dimension["colunas"]
+} | {'UF_EMITENTE', 'UF_DESTINATARIO', 'UNIDADE'}
+
+# Colunas das visões nfs_cabecalho/nfs_itens, na ordem do esquema original (antes das dimensões)
+VIEW_COLUMNS = {
+    "cabecalho": [
+        'CHAVE_DE_ACESSO', 'MODELO', 'SERIE', 'NUMERO', 'NATUREZA_DA_OPERACAO', 'DATA_EMISSAO',
+        'EVENTO_MAIS_RECENTE', 'DATA_HORA_EVENTO_MAIS_RECENTE', 'CPF_CNPJ_EMITENTE', 'RAZAO_SOCIAL_EMITENTE',
+        'INSCRICAO_ESTADUAL_EMITENTE', 'UF_EMITENTE', 'MUNICIPIO_EMITENTE', 'CNPJ_DESTINATARIO',
+        'NOME_DESTINATARIO', 'UF_DESTINATARIO', 'INDICADOR_IE_DESTINATARIO', 'DESTINO_DA_OPERACAO',
+        'CONSUMIDOR_FINAL', 'PRESENCA_DO_COMPRADOR', 'VALOR_NOTA_FISCAL', 'DATA_EMISSAO_ISO', 'ANO_EMISSAO',
+        'MES_EMISSAO', 'DATA_HORA_EVENTO_ISO', 'PERIODO',
+    ],
+    "itens": [
+        'ID_ITEM', 'CHAVE_DE_ACESSO', 'NUMERO_PRODUTO', 'DESCRICAO_PRODUTO_SERVICO', 'CODIGO_NCM_SH',
+        'NCM_SH_TIPO_PRODUTO', 'CFOP', 'QUANTIDADE', 'UNIDADE', 'VALOR_UNITARIO', 'VALOR_TOTAL', 'PERIODO',
+    ],
+}
+
+# Tabelas do esquema normalizado; o agente consulta as visões nfs_cabecalho/nfs_itens
+NORMALIZED_TABLES = ["fato_cabecalho", "fato_itens"] + list(DIMENSIONS)
+
+# --- Funções do "Agente Curador" ---
+
+def _dimension_table_sql(dimension, spec):
+    columns = ', '.join(f"{column} {sql_type}" for column, sql_type in spec["colunas"].items())
+    return f"CREATE TABLE IF NOT EXISTS {dimension} ({spec['chave']} INTEGER PRIMARY KEY, {columns});"
+
+def _view_sql(table):
+    """ Visão `nfs_<table>` com as colunas originais da tabela fato e de suas dimensões.
+
+    Cada coluna de dimensão é uma subconsulta escalar pela chave primária: o SQLite só a avalia quando
+    a coluna é usada, então consultas que não tocam as dimensões varrem apenas a tabela fato.
+    """
+    sources = {}
+    for dimension, spec in DIMENSIONS.items():
+        if spec["tabela"] == table:
+            sources.update({column: (dimension, spec["chave"]) for column in spec["colunas"]})
+    columns = []
+    for column in VIEW_COLUMNS[table]:
+        if column in sources:
+            dimension, key = sources[column]
+            columns.append(f"(SELECT d.{column} FROM {dimension} d WHERE d.{key} = f.{key}) AS {column}")
+        else:
+            columns.append(f"f.{column}")
+    return f"CREATE VIEW IF NOT EXISTS nfs_{table} AS SELECT {', '.join(columns)} FROM fato_{table} f;"
 
 def get_database_schema():
-    """ Retorna a definição do esquema do banco de dados (SQL para criação). """
+    """ Retorna a definição do esquema do banco de dados (SQL para criação).
+
+    As notas ficam em tabelas fato (`fato_cabecalho`, `fato_itens`) com chaves inteiras para as
+    dimensões de DIMENSIONS; as visões `nfs_cabecalho` e `nfs_itens` expõem as colunas originais.
+    """
+    sql_create_dimension_tables = [_dimension_table_sql(dimension, spec) for dimension, spec in DIMENSIONS.items()]
+
     sql_create_cabecalho_table = """
-    CREATE TABLE IF NOT EXISTS nfs_cabecalho (
+    CREATE TABLE IF NOT EXISTS fato_cabecalho (
         CHAVE_DE_ACESSO TEXT PRIMARY KEY,
-        MODELO TEXT,
+        ID_EMITENTE INTEGER NOT NULL REFERENCES dim_emitente (ID_EMITENTE),
+        ID_DESTINATARIO INTEGER NOT NULL REFERENCES dim_destinatario (ID_DESTINATARIO),
+        ID_OPERACAO INTEGER NOT NULL REFERENCES dim_operacao (ID_OPERACAO),
         SERIE INTEGER,
         NUMERO INTEGER,
-        NATUREZA_DA_OPERACAO TEXT,
         DATA_EMISSAO TEXT,
-        EVENTO_MAIS_RECENTE TEXT,
         DATA_HORA_EVENTO_MAIS_RECENTE TEXT,
         CPF_CNPJ_EMITENTE TEXT,
-        RAZAO_SOCIAL_EMITENTE TEXT,
-        INSCRICAO_ESTADUAL_EMITENTE TEXT,
         UF_EMITENTE TEXT,
-        MUNICIPIO_EMITENTE TEXT,
         CNPJ_DESTINATARIO TEXT,
-        NOME_DESTINATARIO TEXT,
         UF_DESTINATARIO TEXT,
-        INDICADOR_IE_DESTINATARIO TEXT,
-        DESTINO_DA_OPERACAO TEXT,
-        CONSUMIDOR_FINAL TEXT,
-        PRESENCA_DO_COMPRADOR TEXT,
-        VALOR_NOTA_FISCAL REAL
+        VALOR_NOTA_FISCAL REAL,
+        DATA_EMISSAO_ISO TEXT,
+        ANO_EMISSAO INTEGER,
+        MES_EMISSAO INTEGER,
+        DATA_HORA_EVENTO_ISO TEXT,
+        PERIODO TEXT
     );"""
 
     sql_create_itens_table = """
-    CREATE TABLE IF NOT EXISTS nfs_itens (
+    CREATE TABLE IF NOT EXISTS fato_itens (
         ID_ITEM INTEGER PRIMARY KEY AUTOINCREMENT,
         CHAVE_DE_ACESSO TEXT NOT NULL,
         NUMERO_PRODUTO INTEGER,
         DESCRICAO_PRODUTO_SERVICO TEXT,
         CODIGO_NCM_SH TEXT,
-        NCM_SH_TIPO_PRODUTO TEXT,
+        ID_NCM INTEGER NOT NULL REFERENCES dim_ncm (ID_NCM),
         CFOP INTEGER,
         QUANTIDADE REAL,
         UNIDADE TEXT,
         VALOR_UNITARIO REAL,
         VALOR_TOTAL REAL,
-        FOREIGN KEY (CHAVE_DE_ACESSO) REFERENCES nfs_cabecalho (CHAVE_DE_ACESSO)
+        PERIODO TEXT,
+        FOREIGN KEY (CHAVE_DE_ACESSO) REFERENCES fato_cabecalho (CHAVE_DE_ACESSO)
+    );"""
+
+    # Registro dos arquivos já ingeridos, usado para pular arquivos repetidos no modo incremental
+    sql_create_arquivos_table = """
+    CREATE TABLE IF NOT EXISTS arquivos_ingeridos (
+        HASH_ARQUIVO TEXT PRIMARY KEY,
+        NOME_ARQUIVO TEXT NOT NULL,
+        TABELA TEXT NOT NULL,
+        LINHAS INTEGER,
+        DATA_INGESTAO TEXT DEFAULT CURRENT_TIMESTAMP
+    );"""
+
+    # Metadados do conteúdo carregado (ex.: impressão digital usada para invalidar caches persistentes)
+    sql_create_metadados_table = """
+    CREATE TABLE IF NOT EXISTS metadados_banco (
+        CHAVE TEXT PRIMARY KEY,
+        VALOR TEXT
     );"""
-    return [sql_create_cabecalho_table, sql_create_itens_table]
+    return (
+        sql_create_dimension_tables
+        + [sql_create_cabecalho_table, sql_create_itens_table, sql_create_arquivos_table, sql_create_metadados_table]
+        + [_view_sql("cabecalho"), _view_sql("itens")]
+    )
+
+def get_index_definitions():
+    """ Retorna os índices secundários nas colunas mais usadas em filtros e junções pelo agente. """
+    return [
+        "CREATE INDEX IF NOT EXISTS idx_itens_chave_de_acesso ON fato_itens (CHAVE_DE_ACESSO);",
+        "CREATE INDEX IF NOT EXISTS idx_itens_codigo_ncm_sh ON fato_itens (CODIGO_NCM_SH);",
+        "CREATE INDEX IF NOT EXISTS idx_cabecalho_cnpj_destinatario ON fato_cabecalho (CNPJ_DESTINATARIO);",
+        "CREATE INDEX IF NOT EXISTS idx_cabecalho_cpf_cnpj_emitente ON fato_cabecalho (CPF_CNPJ_EMITENTE);",
+        "CREATE INDEX IF NOT EXISTS idx_cabecalho_data_emissao ON fato_cabecalho (DATA_EMISSAO);",
+        "CREATE INDEX IF NOT EXISTS idx_cabecalho_uf_emitente ON fato_cabecalho (UF_EMITENTE);",
+        "CREATE INDEX IF NOT EXISTS idx_cabecalho_uf_destinatario ON fato_cabecalho (UF_DESTINATARIO);",
+        "CREATE INDEX IF NOT EXISTS idx_cabecalho_data_emissao_iso ON fato_cabecalho (DATA_EMISSAO_ISO);",
+        "CREATE INDEX IF NOT EXISTS idx_cabecalho_ano_mes_emissao ON fato_cabecalho (ANO_EMISSAO, MES_EMISSAO);",
+        "CREATE INDEX IF NOT EXISTS idx_cabecalho_data_hora_evento_iso ON fato_cabecalho (DATA_HORA_EVENTO_ISO);",
+        "CREATE INDEX IF NOT EXISTS idx_cabecalho_periodo ON fato_cabecalho (PERIODO);",
+        "CREATE INDEX IF NOT EXISTS idx_itens_periodo ON fato_itens (PERIODO);",
+    ]
 
 def get_ingestion_instructions():
     """ Retorna as instruções de mapeamento de colunas para a ingestão. """
@@ -97,90 +294,814 @@ def get_ingestion_instructions():
 # --- Funções de Banco de Dados (Poderiam estar no Agente Especialista) ---
 
 def create_connection(db_file=DB_FILE):
-    """ Cria uma conexão com o banco de dados SQLite. """
+    """ Cria uma conexão com o banco de dados SQLite, em modo WAL para não bloquear os leitores. """
     conn = None
     try:
-        conn = sqlite3.connect(db_file)
+        conn = enable_wal(sqlite3.connect(db_file))
         logging.info(f"Conexão com SQLite DB versão {sqlite3.sqlite_version} estabelecida em {db_file}")
         return conn
     except sqlite3.Error as e:
         logging.error(f"Erro ao conectar ao banco de dados {db_file}: {e}")
         return None
 
+def _is_table(cursor, name):
+    """ `name` é uma tabela (e não uma visão ou inexistente)? """
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,))
+    return cursor.fetchone() is not None
+
+def _iso_from_brazilian_sql(column):
+    """ Expressão SQL que converte 'dd/mm/aaaa[ hh:mm:ss]' em ISO-8601; outros formatos passam inalterados. """
+    return (
+        f"CASE WHEN substr({column}, 3, 1) = '/' THEN substr({column}, 7, 4) || '-' || substr({column}, 4, 2) "
+        f"|| '-' || substr({column}, 1, 2) || substr({column}, 11) ELSE {column} END"
+    )
+
+def _add_derived_date_columns(cursor):
+    """ Acrescenta as colunas de data derivadas a um cabeçalho antigo e as preenche a partir do texto original. """
+    cursor.execute("PRAGMA table_info(nfs_cabecalho)")
+    existing = {column[1] for column in cursor.fetchall()}
+    missing = [column for column in DERIVED_DATE_COLUMNS if column not in existing]
+    if not missing:
+        return
+    for column in missing:
+        cursor.execute(f"ALTER TABLE nfs_cabecalho ADD COLUMN {column} {DERIVED_DATE_COLUMNS[column]}")
+    cursor.execute(
+        f"UPDATE nfs_cabecalho SET "
+        f"DATA_EMISSAO_ISO = {_iso_from_brazilian_sql('DATA_EMISSAO')}, "
+        f"DATA_HORA_EVENTO_ISO = {_iso_from_brazilian_sql('DATA_HORA_EVENTO_MAIS_RECENTE')}"
+    )
+    cursor.execute(
+        "UPDATE nfs_cabecalho SET ANO_EMISSAO = CAST(substr(DATA_EMISSAO_ISO, 1, 4) AS INTEGER), "
+        "MES_EMISSAO = CAST(substr(DATA_EMISSAO_ISO, 6, 2) AS INTEGER) WHERE DATA_EMISSAO_ISO IS NOT NULL"
+    )
+    logging.info(f"Colunas de data derivadas adicionadas ao cabeçalho existente: {missing}")
+
+def _fill_missing_periods(cursor):
+    """ Preenche PERIODO onde ele ficou nulo (arquivos sem prefixo AAAAMM ou bancos antigos):
+    no cabeçalho pelo mês de emissão e nos itens pelo período da nota. """
+    cursor.execute(
+        "UPDATE fato_cabecalho SET PERIODO = substr(DATA_EMISSAO_ISO, 1, 4) || substr(DATA_EMISSAO_ISO, 6, 2) "
+        "WHERE PERIODO IS NULL AND DATA_EMISSAO_ISO IS NOT NULL"
+    )
+    cursor.execute(
+        "UPDATE fato_itens SET PERIODO = (SELECT c.PERIODO FROM fato_cabecalho c "
+        "WHERE c.CHAVE_DE_ACESSO = fato_itens.CHAVE_DE_ACESSO) WHERE PERIODO IS NULL"
+    )
+
+def _add_period_columns(cursor):
+    """ Acrescenta PERIODO às tabelas de um banco antigo (preenchida depois, em `_fill_missing_periods`). """
+    for table in ('nfs_cabecalho', 'nfs_itens'):
+        cursor.execute(f"PRAGMA table_info({table})")
+        if 'PERIODO' not in {column[1] for column in cursor.fetchall()}:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN PERIODO TEXT")
+            logging.info(f"Coluna PERIODO adicionada em {table}")
+
+def _legacy_select_sql(cursor, table):
+    """ SELECT das colunas de `VIEW_COLUMNS` na tabela antiga `nfs_<table>_antiga`; as ausentes viram NULL.
+
+    Cobre também as tabelas gravadas por to_sql(if_exists='replace'), sem chave primária nem colunas
+    derivadas. Sem CHAVE_DE_ACESSO não há como ligar cabeçalho e itens e a migração é recusada.
+    """
+    cursor.execute(f"PRAGMA table_info(nfs_{table}_antiga)")
+    existing = {column[1] for column in cursor.fetchall()}
+    if 'CHAVE_DE_ACESSO' not in existing:
+        raise LegacyMigrationError(f"Tabela nfs_{table} antiga sem a coluna CHAVE_DE_ACESSO.")
+    columns = ', '.join(column if column in existing else f"NULL AS {column}" for column in VIEW_COLUMNS[table])
+    return f"SELECT {columns} FROM nfs_{table}_antiga"
+
+def _migrate_flat_tables(conn):
+    """ Converte as tabelas nfs_cabecalho/nfs_itens de um banco antigo para o esquema normalizado.
+
+    As tabelas antigas (com ou sem chave primária) são renomeadas, copiadas em blocos para as tabelas
+    fato e dimensões (pelo mesmo caminho da ingestão, `insert_dataframe`) e removidas; as visões
+    assumem os nomes originais. Notas repetidas num cabeçalho sem chave primária ficam com a última
+    linha. Retorna True se houve migração; se ela falhar, a transação é desfeita (as tabelas antigas
+    ficam intactas) e `LegacyMigrationError` é levantada.
+    """
+    cursor = conn.cursor()
+    if not _is_table(cursor, 'nfs_cabecalho'):
+        return False
+    if not _is_table(cursor, 'nfs_itens'):
+        raise LegacyMigrationError("Banco antigo com nfs_cabecalho mas sem a tabela nfs_itens.")
+    started = time.perf_counter()
+    logging.warning("Tabelas nfs_cabecalho/nfs_itens no formato antigo. Migrando para tabelas fato e dimensões.")
+    if conn.in_transaction:
+        conn.commit()
+    conn.execute("BEGIN")
+    try:
+        _add_derived_date_columns(cursor)
+        _add_period_columns(cursor)
+        for table in ('nfs_cabecalho', 'nfs_itens'):
+            cursor.execute(f"ALTER TABLE {table} RENAME TO {table}_antiga")
+        for sql in get_database_schema():
+            cursor.execute(sql)
+        dimension_ids = _DimensionIds(conn)
+        for table in ('cabecalho', 'itens'):
+            for chunk in pd.read_sql_query(_legacy_select_sql(cursor, table), conn, chunksize=CHUNK_SIZE):
+                insert_dataframe(conn, table, chunk, dimension_ids)
+        cursor.execute("DROP TABLE nfs_itens_antiga")
+        cursor.execute("DROP TABLE nfs_cabecalho_antiga")
+        _fill_missing_periods(cursor)
+        conn.commit()
+    except sqlite3.Error as e:
+        conn.rollback()
+        raise LegacyMigrationError(f"Falha ao migrar as tabelas nfs_cabecalho/nfs_itens antigas: {e}") from e
+    except BaseException:
+        conn.rollback()
+        raise
+    logging.info(f"Migração para o esquema normalizado concluída em {time.perf_counter() - started:.2f}s.")
+    return True
+
 def create_tables(conn):
-    """ Cria as tabelas com base no esquema do 'Agente Curador'. """
-    schema_sqls = get_database_schema()
+    """ Cria as tabelas, visões, índices e tabelas de resumo com base no esquema do 'Agente Curador'.
+
+    Um banco com as tabelas de notas no formato antigo (sem dimensões) é migrado e compactado (VACUUM);
+    `LegacyMigrationError` é propagada em vez de descartar os dados antigos.
+    """
     try:
         cursor = conn.cursor()
-        logging.info("Executando criação de tabelas (se não existirem)...")
-        for sql in schema_sqls:
+        migrated = _migrate_flat_tables(conn)
+        logging.info("Executando criação de tabelas e índices (se não existirem)...")
+        for sql in get_database_schema():
+            cursor.execute(sql)
+        for sql in get_index_definitions() + get_rollup_schema():
             cursor.execute(sql)
         conn.commit()
+        if migrated:
+            conn.execute("VACUUM")  # Devolve ao sistema as páginas liberadas pelas tabelas antigas
         logging.info("Tabelas verificadas/criadas com sucesso.")
     except sqlite3.Error as e:
         logging.error(f"Erro ao criar tabelas: {e}")
 
-def read_csv_flexible(filepath):
-    """ Tenta ler um CSV com separador vírgula e depois ponto e vírgula. """
+def _sample_fingerprint(source, sample):
+    """ Identifica o arquivo pelo tamanho e pelo hash da amostra inicial, sem ler o arquivo inteiro. """
+    digest = hashlib.sha256(sample)
+    digest.update(str(source.size).encode())
+    return digest.hexdigest()
+
+def _read_sample(source, size):
+    with source.open() as f:
+        return f.read(size)
+
+def _detect_encoding(sample):
+    if sample.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
     try:
-        df = pd.read_csv(filepath, sep=',')
-        logging.info(f"CSV {filepath} lido com separador ','")
+        sample.decode('utf-8')
+        return 'utf-8'
+    except UnicodeDecodeError:
+        return 'latin-1'  # Exportações antigas da Receita
+
+def _detect_decimal(rows):
+    """ Vota entre vírgula e ponto decimal com base nos campos numéricos da amostra. """
+    comma_votes = dot_votes = 0
+    for row in rows:
+        for field in row:
+            field = field.strip()
+            if re.fullmatch(r"-?\d{1,3}(\.\d{3})*,\d+|-?\d+,\d+", field):
+                comma_votes += 1
+            elif re.fullmatch(r"-?\d+\.\d+", field):
+                dot_votes += 1
+    return ',' if comma_votes > dot_votes else '.'
+
+def sniff_csv_dialect(filepath):
+    """ Detecta separador, encoding, aspas e convenção decimal/milhar lendo só os primeiros KB do CSV.
+
+    `filepath` é um caminho ou uma `csv_sources.CsvSource` (ex.: membro de um ZIP). O resultado é
+    guardado em cache pela impressão digital do arquivo (tamanho + hash da amostra).
+    """
+    source = as_source(filepath)
+    sample = _read_sample(source, SNIFF_BYTES)
+    fingerprint = _sample_fingerprint(source, sample)
+    if fingerprint in _dialect_cache:
+        return _dialect_cache[fingerprint]
+
+    # Descartar a última linha, possivelmente cortada (inclusive no meio de um caractere multibyte)
+    if b'\n' in sample:
+        sample = sample[:sample.rindex(b'\n')]
+    encoding = _detect_encoding(sample)
+    text = sample.decode(encoding)
+    header = text.splitlines()[0] if text else ''
+    try:
+        sniffed = csv.Sniffer().sniff(text, delimiters=',;|\t')
+        sep, quotechar = sniffed.delimiter, sniffed.quotechar or '"'
+    except csv.Error:
+        sep, quotechar = (';' if header.count(';') > header.count(',') else ','), '"'
+
+    rows = list(csv.reader(io.StringIO(text), delimiter=sep, quotechar=quotechar))[1:]
+    decimal = _detect_decimal(rows)
+    dialect = {
+        'sep': sep,
+        'encoding': encoding,
+        'quotechar': quotechar,
+        'decimal': decimal,
+        'thousands': '.' if decimal == ',' else None,
+    }
+    if len(_dialect_cache) >= SNIFF_CACHE_MAX_ENTRIES:
+        _dialect_cache.clear()
+    _dialect_cache[fingerprint] = dialect
+    logging.info(f"Dialeto detectado para {source.name}: {dialect}")
+    return dialect
+
+def _pandas_read_options(dialect, categorical=()):
+    """ Opções do pd.read_csv para o dialeto. Tudo é lido como texto: sem passada de inferência de tipos
+    e sem perder zeros à esquerda de CNPJs, NCMs e da chave de acesso de 44 dígitos. As colunas de
+    `categorical` (nomes do CSV) são lidas como categóricas. """
+    dtype = defaultdict(lambda: str, {column: 'category' for column in categorical}) if categorical else str
+    return {'sep': dialect['sep'], 'encoding': dialect['encoding'], 'quotechar': dialect['quotechar'], 'dtype': dtype}
+
+def read_csv_flexible(filepath, categorical=()):
+    """ Lê um CSV inteiro com o dialeto detectado por `sniff_csv_dialect`, em uma única passada.
+
+    Usa o parser multithread do pyarrow quando disponível e o engine C do pandas caso contrário. As
+    colunas de `categorical` (nomes do CSV) chegam como categóricas.
+    """
+    source = as_source(filepath)
+    dialect = sniff_csv_dialect(source)
+    try:
+        with source.open() as f:
+            if pa_csv is not None:
+                df = pa_csv.read_csv(f, **_pyarrow_read_options(source, dialect, categorical=categorical)).to_pandas()
+                engine = 'pyarrow'
+            else:
+                df = pd.read_csv(f, **_pandas_read_options(dialect, categorical))
+                engine = 'c'
+        logging.info(f"CSV {source.name} lido com separador '{dialect['sep']}' (engine {engine})")
         return df
-    except Exception as e1:
-        logging.warning(f"Falha ao ler {filepath} com ',': {e1}. Tentando com ';'")
-        try:
-            df = pd.read_csv(filepath, sep=';')
-            logging.info(f"CSV {filepath} lido com separador ';'")
-            return df
-        except Exception as e2:
-            logging.error(f"Falha ao ler {filepath} com ',' e ';': {e2}")
-            raise
-
-def ingest_data(conn, cabecalho_csv_path, itens_csv_path):
-    """ Lê os arquivos CSV e insere os dados nas tabelas SQLite usando as instruções do 'Agente Curador'. """
+    except Exception as e:
+        logging.error(f"Falha ao ler {source.name} com separador '{dialect['sep']}': {e}")
+        raise
+
+def _read_header(source, dialect):
+    with source.open() as f:
+        return pd.read_csv(f, nrows=0, **_pandas_read_options(dialect)).columns.tolist()
+
+def _estimate_chunk_bytes(source, chunksize):
+    """ Converte um bloco de `chunksize` linhas em bytes, pelo tamanho médio das linhas da amostra. """
+    sample = _read_sample(source, SAMPLE_BYTES)
+    lines = max(sample.count(b'\n'), 1)
+    return max(len(sample) // lines, 1) * chunksize
+
+def estimate_row_count(filepath):
+    """ Estimativa do número de linhas de dados do CSV pelo tamanho médio das linhas da amostra. """
+    source = as_source(filepath)
+    return max(source.size // _estimate_chunk_bytes(source, 1) - 1, 1)
+
+def _split_line_ranges(filepath, chunk_bytes):
+    """ Divide o arquivo (após o cabeçalho) em faixas de bytes terminadas em quebra de linha.
+
+    Assume que não há quebras de linha dentro de campos entre aspas, o que vale para os
+    arquivos de NF-e da Receita.
+    """
+    file_size = os.path.getsize(filepath)
+    ranges = []
+    with open(filepath, 'rb') as f:
+        f.readline()  # cabeçalho
+        start = f.tell()
+        while start < file_size:
+            f.seek(min(start + chunk_bytes, file_size))
+            f.readline()  # avança até o fim da linha corrente
+            end = min(f.tell(), file_size)
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+def _parse_line_range(filepath, start, end, columns, dialect, categorical=()):
+    """ Executado nos processos do pool: lê e interpreta uma faixa de linhas do CSV. """
+    with open(filepath, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    return pd.read_csv(io.BytesIO(data), header=None, names=columns, **_pandas_read_options(dialect, categorical))
+
+def _read_chunks_parallel(filepath, dialect, chunksize, workers, categorical=()):
+    """ Interpreta faixas de linhas do arquivo em um pool de processos, devolvendo os blocos em ordem.
+
+    No máximo `2 * workers` blocos ficam em memória ao mesmo tempo; a gravação no SQLite continua
+    sendo feita por um único escritor, no processo principal.
+    """
+    source = as_source(filepath)
+    columns = _read_header(source, dialect)
+    ranges = _split_line_ranges(filepath, _estimate_chunk_bytes(source, chunksize))
+    if len(ranges) <= 1:
+        yield from (_parse_line_range(filepath, start, end, columns, dialect, categorical) for start, end in ranges)
+        return
+
+    # 'spawn' evita herdar por fork as threads do processo principal (ex.: servidor do Streamlit)
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        pending = []
+        for start, end in ranges:
+            pending.append(executor.submit(_parse_line_range, filepath, start, end, columns, dialect, categorical))
+            if len(pending) >= 2 * workers:
+                yield pending.pop(0).result()
+        for future in pending:
+            yield future.result()
+
+def _pyarrow_read_options(source, dialect, block_size=None, categorical=()):
+    """ Opções do leitor de CSV do pyarrow para o dialeto, com todas as colunas como texto.
+
+    O engine 'pyarrow' do pd.read_csv infere os tipos antes de aplicar `dtype`, o que transformaria
+    a chave de acesso em float; por isso os tipos são fixados diretamente no pyarrow. As colunas de
+    `categorical` são lidas já codificadas em dicionário e chegam ao pandas como categóricas.
+    """
+    columns = _read_header(source, dialect)
+    # O pyarrow descarta sozinho o BOM do UTF-8
+    encoding = 'utf8' if dialect['encoding'] == 'utf-8-sig' else dialect['encoding']
+    read_options = pa_csv.ReadOptions(use_threads=True, encoding=encoding)
+    if block_size:
+        read_options.block_size = block_size
+    return {
+        'read_options': read_options,
+        'parse_options': pa_csv.ParseOptions(delimiter=dialect['sep'], quote_char=dialect['quotechar']),
+        # Campos vazios viram nulos, como no engine do pandas
+        'convert_options': pa_csv.ConvertOptions(
+            column_types={
+                column: pa.dictionary(pa.int32(), pa.string()) if column in categorical else pa.string()
+                for column in columns
+            },
+            strings_can_be_null=True,
+        ),
+    }
+
+def _read_chunks_pyarrow(source, dialect, chunksize, categorical=()):
+    """ Lê o CSV em streaming com o parser multithread do pyarrow. As colunas chegam como texto
+    (ou categóricas, as de `categorical`). """
+    options = _pyarrow_read_options(
+        source, dialect, block_size=_estimate_chunk_bytes(source, chunksize), categorical=categorical
+    )
+    with source.open() as f:
+        for batch in pa_csv.open_csv(f, **options):
+            yield batch.to_pandas()
+
+def _read_chunks_pandas(source, dialect, chunksize, categorical=()):
+    with source.open() as f:
+        yield from pd.read_csv(f, chunksize=chunksize, **_pandas_read_options(dialect, categorical))
+
+def read_csv_chunks(filepath, chunksize=CHUNK_SIZE, workers=1, categorical=()):
+    """ Lê um CSV em blocos de aproximadamente `chunksize` linhas, sem carregar o arquivo inteiro.
+
+    `filepath` é um caminho ou uma `csv_sources.CsvSource`; membros de ZIP e buffers do upload são
+    lidos em streaming, sem cópia intermediária em disco. Com o pyarrow instalado o parsing é
+    multithread; sem ele, com `workers > 1` e um arquivo em disco, as faixas do arquivo são
+    interpretadas em paralelo por um pool de processos. As colunas de `categorical` (nomes do CSV)
+    chegam como categóricas: cada valor distinto é guardado uma vez por bloco.
+    """
+    source = as_source(filepath)
+    dialect = sniff_csv_dialect(source)
+    sep = dialect['sep']
+    workers = min(workers or 1, PARSE_WORKERS)
+    if pa_csv is not None:
+        logging.info(f"CSV {source.name} será lido em blocos de ~{chunksize} linhas com separador '{sep}' (pyarrow)")
+        return _read_chunks_pyarrow(source, dialect, chunksize, categorical)
+    if workers > 1 and source.path is not None:
+        logging.info(f"CSV {source.name} será lido em blocos de ~{chunksize} linhas com separador '{sep}' ({workers} processos)")
+        return _read_chunks_parallel(source.path, dialect, chunksize, workers, categorical)
+    logging.info(f"CSV {source.name} será lido em blocos de {chunksize} linhas com separador '{sep}'")
+    return _read_chunks_pandas(source, dialect, chunksize, categorical)
+
+def _to_numeric(series, decimal, thousands):
+    """ Converte texto em número respeitando a convenção decimal/milhar do arquivo. """
+    if decimal != '.' and not pd.api.types.is_numeric_dtype(series):
+        series = series.astype(str)
+        if thousands:
+            series = series.str.replace(thousands, '', regex=False)
+        series = series.str.replace(decimal, '.', regex=False)
+    return pd.to_numeric(series, errors='coerce')
+
+def coerce_types(df, table, decimal='.', thousands=None):
+    """ Aplica as conversões de tipo de COLUMN_TYPES às colunas da tabela ('cabecalho' ou 'itens'). """
+    for column, dtype in COLUMN_TYPES[table].items():
+        values = _to_numeric(df[column], decimal, thousands)
+        df[column] = values.astype(dtype) if dtype == 'Int64' else values
+    return df
+
+def parse_dates(series):
+    """ Converte datas em texto para datetime64 de forma vetorizada (valores inválidos viram NaT).
+
+    O formato brasileiro 'dd/mm/aaaa[ hh:mm:ss]' é reordenado para ISO com fatiamento de strings e
+    lido pelo parser ISO-8601 do pandas, bem mais rápido que o strptime; o que não casar com nenhum
+    dos dois vai para o parser genérico com dia primeiro.
+    """
+    text = series.astype(object).where(series.notna(), None).str.strip()
+    brazilian = text.str.match(r"\d{2}/\d{2}/\d{4}", na=False)
+    reordered = text.str.slice(6, 10) + '-' + text.str.slice(3, 5) + '-' + text.str.slice(0, 2) + text.str.slice(10)
+    parsed = pd.to_datetime(text.where(~brazilian, reordered), format='ISO8601', errors='coerce')
+    failed = parsed.isna() & text.fillna('').ne('')
+    if failed.any():
+        parsed[failed] = pd.to_datetime(text[failed], format='mixed', dayfirst=True, errors='coerce')
+    return parsed
+
+def add_date_columns(df):
+    """ Acrescenta ao cabeçalho as colunas ISO de DATE_COLUMNS e o ano e mês de emissão. """
+    for column, iso_column in DATE_COLUMNS.items():
+        parsed = parse_dates(df[column])
+        df[iso_column] = parsed.dt.strftime('%Y-%m-%d %H:%M:%S')
+        if column == 'DATA_EMISSAO':
+            df['ANO_EMISSAO'] = parsed.dt.year.astype('Int64')
+            df['MES_EMISSAO'] = parsed.dt.month.astype('Int64')
+    return df
+
+def _peak_memory_mb():
+    """ Pico de memória residente do processo em MB (None se indisponível na plataforma). """
+    if resource is None:
+        return None
+    # ru_maxrss é reportado em KB no Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def _log_chunk_stats(table, chunk_number, rows, elapsed, total_rows):
+    rows_per_sec = rows / elapsed if elapsed > 0 else float('inf')
+    peak = _peak_memory_mb()
+    peak_str = f"{peak:.1f} MB" if peak is not None else "n/d"
+    logging.info(
+        f"[{table}] Bloco {chunk_number}: {rows} linhas em {elapsed:.2f}s "
+        f"({rows_per_sec:,.0f} linhas/s), total {total_rows}, pico de memória {peak_str}"
+    )
+
+class _DimensionIds:
+    """ Chaves das dimensões por combinação de valores, mantidas em memória pelo escritor durante a carga.
+
+    Combinações novas recebem a próxima chave e são gravadas na dimensão no mesmo bloco; linhas de
+    dimensão que deixam de ser referenciadas (nota atualizada na carga incremental) são mantidas.
+    """
+
+    def __init__(self, conn):
+        self.ids = {}  # dimensão -> {(valores das colunas): chave}
+        self.next_id = {}
+        for dimension, spec in DIMENSIONS.items():
+            rows = conn.execute(f"SELECT {spec['chave']}, {', '.join(spec['colunas'])} FROM {dimension}")
+            self.ids[dimension] = {tuple(row[1:]): row[0] for row in rows}
+            self.next_id[dimension] = max(self.ids[dimension].values(), default=0) + 1
+
+    def encode(self, conn, table, df):
+        """ Troca as colunas das dimensões da tabela pelas chaves inteiras. Retorna o novo DataFrame. """
+        for dimension, spec in DIMENSIONS.items():
+            if spec["tabela"] != table:
+                continue
+            columns = list(spec["colunas"])
+            # Um grupo por combinação distinta (nulos formam grupo próprio); só as primeiras linhas de
+            # cada grupo são convertidas em tuplas Python
+            groups = df.groupby(columns, dropna=False, observed=True, sort=False).ngroup().to_numpy()
+            first_rows = np.flatnonzero(~df.duplicated(columns).to_numpy())
+            values = df[columns].iloc[first_rows]
+            values = values.astype(object).where(values.notna(), None)
+            known = self.ids[dimension]
+            group_ids = np.empty(len(first_rows), dtype=np.int64)
+            new_rows = []
+            for group, key in zip(groups[first_rows], values.itertuples(index=False, name=None)):
+                key_id = known.get(key)
+                if key_id is None:
+                    key_id = known[key] = self.next_id[dimension]
+                    self.next_id[dimension] += 1
+                    new_rows.append((key_id,) + key)
+                group_ids[group] = key_id
+            if new_rows:
+                conn.executemany(
+                    f"INSERT INTO {dimension} ({spec['chave']}, {', '.join(columns)}) "
+                    f"VALUES ({', '.join('?' * (len(columns) + 1))})", new_rows
+                )
+            df = df.drop(columns=columns)
+            df[spec["chave"]] = group_ids[groups]
+        return df
+
+def insert_dataframe(conn, table, df, dimension_ids=None):
+    """ Insere o DataFrame (colunas de `nfs_<table>`) em `fato_<table>` via executemany, preservando o
+    esquema declarado.
+
+    As colunas das dimensões são trocadas pelas chaves inteiras (`dimension_ids`, um `_DimensionIds`
+    compartilhado pela carga; sem ele as chaves são lidas do banco). No cabeçalho a inserção é um
+    upsert pela chave primária: uma nota já existente é atualizada.
+    """
+    if dimension_ids is None:
+        dimension_ids = _DimensionIds(conn)
+    df = dimension_ids.encode(conn, table, df)
+    columns = list(df.columns)
+    sql = f"INSERT INTO fato_{table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+    if table == 'cabecalho':
+        updates = ', '.join(f"{column} = excluded.{column}" for column in columns if column != 'CHAVE_DE_ACESSO')
+        sql += f" ON CONFLICT(CHAVE_DE_ACESSO) DO UPDATE SET {updates}"
+    # Valores ausentes (NaN/NA) viram NULL; Int64 é convertido para int nativo aceito pelo sqlite3
+    values = df.astype(object).where(df.notna(), None)
+    conn.executemany(sql, values.itertuples(index=False, name=None))
+    return len(df)
+
+def _stage_chunk_keys(conn, chunk):
+    """ Grava as chaves de acesso do bloco na tabela temporária `chaves_bloco`. """
+    keys = [(key,) for key in chunk['CHAVE_DE_ACESSO'].dropna().unique()]
+    conn.execute("DELETE FROM temp.chaves_bloco")
+    conn.executemany("INSERT OR IGNORE INTO temp.chaves_bloco (CHAVE) VALUES (?)", keys)
+
+def _replace_items_of_chunk(conn):
+    """ Remove os itens já gravados das notas do bloco (em `chaves_bloco`), uma única vez por ingestão.
+
+    As chaves já tratadas ficam na tabela temporária `chaves_substituidas`, de modo que blocos
+    seguintes da mesma nota não apaguem os itens recém-inseridos.
+    """
+    conn.execute("DELETE FROM temp.chaves_bloco WHERE CHAVE IN (SELECT CHAVE FROM temp.chaves_substituidas)")
+    conn.execute("DELETE FROM fato_itens WHERE CHAVE_DE_ACESSO IN (SELECT CHAVE FROM temp.chaves_bloco)")
+    conn.execute("INSERT INTO temp.chaves_substituidas SELECT CHAVE FROM temp.chaves_bloco")
+
+def file_sha256(filepath, block_size=1 << 20):
+    """ Calcula o SHA-256 do arquivo lendo em blocos de 1 MB. """
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _is_file_ingested(conn, file_hash):
+    """ Consulta pontual pela chave primária do registro de arquivos ingeridos. """
+    cursor = conn.execute("SELECT 1 FROM arquivos_ingeridos WHERE HASH_ARQUIVO = ?", (file_hash,))
+    return cursor.fetchone() is not None
+
+def _register_file(conn, file_hash, source, table, rows):
+    conn.execute(
+        "INSERT OR REPLACE INTO arquivos_ingeridos (HASH_ARQUIVO, NOME_ARQUIVO, TABELA, LINHAS) VALUES (?, ?, ?, ?)",
+        (file_hash, source.name, table, rows),
+    )
+
+def _bump_db_generation(conn):
+    """ Incrementa a geração do banco (PRAGMA user_version), usada para invalidar caches dos leitores. """
+    generation = conn.execute("PRAGMA user_version").fetchone()[0] + 1
+    conn.execute(f"PRAGMA user_version = {generation}")
+    return generation
+
+def _write_content_fingerprint(conn):
+    """ Grava em `metadados_banco` uma impressão digital do conteúdo, derivada dos arquivos ingeridos.
+
+    Ao contrário da geração (user_version), ela não se repete se o arquivo do banco for recriado,
+    por isso é usada para invalidar caches persistentes como o de perguntas.
+    """
+    digest = hashlib.sha256()
+    for file_hash, rows in conn.execute("SELECT HASH_ARQUIVO, LINHAS FROM arquivos_ingeridos ORDER BY HASH_ARQUIVO"):
+        digest.update(f"{file_hash}:{rows};".encode())
+    fingerprint = digest.hexdigest()
+    conn.execute("INSERT OR REPLACE INTO metadados_banco (CHAVE, VALOR) VALUES ('fingerprint', ?)", (fingerprint,))
+    return fingerprint
+
+def _clear_tables(conn):
+    """ Limpa as tabelas antes de uma carga completa, mantendo esquema, chaves e índices. """
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM fato_itens;")
+    cursor.execute("DELETE FROM fato_cabecalho;")
+    for dimension in DIMENSIONS:
+        cursor.execute(f"DELETE FROM {dimension};")
+    cursor.execute("DELETE FROM arquivos_ingeridos;")
+    logging.info("Tabelas de notas, dimensões e arquivos_ingeridos limpas antes da inserção.")
+
+def _index_name(index_sql):
+    return re.search(r"INDEX IF NOT EXISTS (\w+)", index_sql).group(1)
+
+def _drop_secondary_indexes(conn):
+    """ Remove os índices secundários para que a carga completa não pague sua manutenção linha a linha. """
+    for index_sql in get_index_definitions():
+        conn.execute(f"DROP INDEX IF EXISTS {_index_name(index_sql)}")
+
+def _create_secondary_indexes(conn):
+    started = time.perf_counter()
+    for index_sql in get_index_definitions():
+        conn.execute(index_sql)
+    logging.info(f"Índices secundários criados em {time.perf_counter() - started:.2f}s.")
+
+def _iter_csv(csv_path, chunksize, workers, categorical=()):
+    """ Itera sobre o CSV em blocos de `chunksize` linhas, ou em um único bloco se `chunksize` for None. """
+    if chunksize:
+        yield from read_csv_chunks(csv_path, chunksize, workers, categorical)
+    else:
+        yield read_csv_flexible(csv_path, categorical)
+
+def _file_period(source):
+    """ 'AAAAMM' do prefixo do nome do arquivo, ou None se o nome não seguir o padrão. """
+    prefix = period_of(source.name)
+    return prefix if prefix and PERIOD_PATTERN.fullmatch(prefix) else None
+
+def _convert_chunk(chunk, table, column_mapping, dialect, period):
+    """ Renomeia as colunas, converte os tipos e acrescenta as colunas derivadas e o PERIODO do bloco. """
+    chunk.rename(columns=column_mapping, inplace=True)
+    chunk = coerce_types(
+        chunk[list(column_mapping.values())].copy(), table, dialect['decimal'], dialect['thousands']
+    )
+    if table == 'cabecalho':
+        chunk = add_date_columns(chunk)
+        if period is None:
+            # Sem período no nome do arquivo: mês de emissão da nota
+            period = chunk['ANO_EMISSAO'].astype(str) + chunk['MES_EMISSAO'].astype(str).str.zfill(2)
+            period = period.where(chunk['ANO_EMISSAO'].notna(), None)
+    chunk['PERIODO'] = period  # Itens sem período recebem o da nota em _fill_missing_periods
+    return chunk
+
+def _categorical_columns(column_mapping):
+    """ Nomes no CSV das colunas lidas como categóricas (ver CATEGORICAL_COLUMNS). """
+    return [column for column, target in column_mapping.items() if target in CATEGORICAL_COLUMNS]
+
+def _iter_converted_chunks(source, table, column_mapping, chunksize, workers):
+    dialect = sniff_csv_dialect(source)
+    period = _file_period(source)
+    for chunk in _iter_csv(source, chunksize, workers, _categorical_columns(column_mapping)):
+        yield _convert_chunk(chunk, table, column_mapping, dialect, period)
+
+def _parse_and_convert_range(filepath, start, end, columns, dialect, table, column_mapping, period):
+    """ Executado nos processos do pool da carga em lote: lê e converte uma faixa de linhas do CSV. """
+    chunk = _parse_line_range(filepath, start, end, columns, dialect, _categorical_columns(column_mapping))
+    return _convert_chunk(chunk, table, column_mapping, dialect, period)
+
+class _BatchChunkReader:
+    """ Lê e converte as faixas de vários CSVs em um único pool de processos, em ordem.
+
+    As tarefas de todos os arquivos entram em uma fila única: enquanto o escritor insere os blocos de
+    um período, os processos já interpretam os seguintes. No máximo `2 * workers` blocos ficam em
+    memória ao mesmo tempo.
+    """
+
+    def __init__(self, files, chunksize, workers):
+        self.workers = workers
+        self.tasks = deque()
+        for index, (source, table, column_mapping) in enumerate(files):
+            dialect = sniff_csv_dialect(source)
+            columns = _read_header(source, dialect)
+            for start, end in _split_line_ranges(source.path, _estimate_chunk_bytes(source, chunksize)):
+                self.tasks.append((index, (source.path, start, end, columns, dialect, table, column_mapping,
+                                           _file_period(source))))
+        self.pending = deque()
+        # 'spawn' evita herdar por fork as threads do processo principal (ex.: servidor do Streamlit)
+        self.executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+
+    def _fill(self):
+        while self.tasks and len(self.pending) < 2 * self.workers:
+            index, args = self.tasks.popleft()
+            self.pending.append((index, self.executor.submit(_parse_and_convert_range, *args)))
+
+    def chunks(self, index):
+        """ Blocos convertidos do arquivo `index`, que deve ser consumido na ordem dos arquivos. """
+        self._fill()
+        while self.pending and self.pending[0][0] == index:
+            _, future = self.pending.popleft()
+            self._fill()
+            yield future.result()
+
+    def close(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+def _ingest_csv(conn, chunks, table, incremental, progress, dimension_ids):
+    """ Insere os blocos já convertidos de um CSV na tabela `fato_<table>`. Retorna o total de linhas. """
+    total_rows = 0
+    progress(table, 0, 0)
+    started = chunk_started = time.perf_counter()
+    for chunk_number, chunk in enumerate(chunks, start=1):
+        progress(table, total_rows + len(chunk), total_rows)
+        if incremental:
+            _stage_chunk_keys(conn, chunk)
+            if table == 'itens':
+                _replace_items_of_chunk(conn)
+            else:
+                track_affected_months(conn, 'temp.chaves_bloco')  # Mês anterior das notas atualizadas
+        insert_dataframe(conn, table, chunk, dimension_ids)
+        if incremental and table == 'cabecalho':
+            track_affected_months(conn, 'temp.chaves_bloco')
+        total_rows += len(chunk)
+        progress(table, total_rows, total_rows)
+        # O tempo do bloco inclui a leitura do CSV, feita pelo iterador
+        now = time.perf_counter()
+        _log_chunk_stats(table, chunk_number, len(chunk), now - chunk_started, total_rows)
+        chunk_started = now
+    elapsed = time.perf_counter() - started
+    logging.info(f"{total_rows} registros inseridos em fato_{table} em {elapsed:.2f}s.")
+    return total_rows
+
+def _no_progress(stage, rows_parsed, rows_inserted):
+    pass
+
+def _ingest_in_transaction(conn, cabecalho_csv_path, itens_csv_path, chunksize, incremental, workers, progress):
+    """ Executa a ingestão em uma única transação explícita. Desfaz tudo se algo falhar. """
+    ingestion_instructions = get_ingestion_instructions()
+    # Todos os cabeçalhos primeiro: na carga incremental os meses afetados vêm das notas atualizadas
+    files = [
+        (as_source(csv), table, ingestion_instructions[table])
+        for table, csvs in (('cabecalho', cabecalho_csv_path), ('itens', itens_csv_path))
+        for csv in (csvs if isinstance(csvs, (list, tuple)) else [csvs])
+    ]
+
+    if conn.in_transaction:
+        conn.commit()
+    if incremental:
+        logging.info("Iniciando ingestão incremental.")
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS chaves_substituidas (CHAVE TEXT PRIMARY KEY)")
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS chaves_bloco (CHAVE TEXT PRIMARY KEY)")
+
+    conn.execute("BEGIN")
     try:
-        ingestion_instructions = get_ingestion_instructions()
-        cabecalho_mapping = ingestion_instructions["cabecalho"]
-        itens_mapping = ingestion_instructions["itens"]
-
-        logging.info(f"Iniciando ingestão do cabeçalho: {cabecalho_csv_path}")
-        df_cabecalho = read_csv_flexible(cabecalho_csv_path)
-        df_cabecalho.rename(columns=cabecalho_mapping, inplace=True)
-
-        # Tratamento de tipos para cabeçalho
-        df_cabecalho['VALOR_NOTA_FISCAL'] = pd.to_numeric(df_cabecalho['VALOR_NOTA_FISCAL'], errors='coerce')
-        df_cabecalho['SERIE'] = pd.to_numeric(df_cabecalho['SERIE'], errors='coerce').astype('Int64')
-        df_cabecalho['NUMERO'] = pd.to_numeric(df_cabecalho['NUMERO'], errors='coerce').astype('Int64')
-
-        logging.info("Inserindo dados na tabela nfs_cabecalho...")
-        df_cabecalho[list(cabecalho_mapping.values())].to_sql('nfs_cabecalho', conn, if_exists='replace', index=False)
-        logging.info(f"{len(df_cabecalho)} registros inseridos/substituídos em nfs_cabecalho.")
-
-        logging.info(f"Iniciando ingestão dos itens: {itens_csv_path}")
-        df_itens = read_csv_flexible(itens_csv_path)
-        df_itens.rename(columns=itens_mapping, inplace=True)
-
-        # Selecionar e tratar tipos para itens
-        df_itens_final = df_itens[list(itens_mapping.values())].copy()
-        df_itens_final['NUMERO_PRODUTO'] = pd.to_numeric(df_itens_final['NUMERO_PRODUTO'], errors='coerce').astype('Int64')
-        df_itens_final['CFOP'] = pd.to_numeric(df_itens_final['CFOP'], errors='coerce').astype('Int64')
-        df_itens_final['QUANTIDADE'] = pd.to_numeric(df_itens_final['QUANTIDADE'], errors='coerce')
-        df_itens_final['VALOR_UNITARIO'] = pd.to_numeric(df_itens_final['VALOR_UNITARIO'], errors='coerce')
-        df_itens_final['VALOR_TOTAL'] = pd.to_numeric(df_itens_final['VALOR_TOTAL'], errors='coerce')
-
-        logging.info("Inserindo dados na tabela nfs_itens...")
-        # Limpar tabela de itens antes de inserir para evitar duplicação se re-executado
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM nfs_itens;")
+        if incremental:
+            conn.execute("DELETE FROM temp.chaves_substituidas")
+            prepare_affected_months(conn)
+        else:
+            # Carga completa: sem índices secundários durante a carga e tabelas limpas
+            _drop_secondary_indexes(conn)
+            _clear_tables(conn)
+
+        if chunksize:
+            logging.info(f"Ingestão em streaming (blocos de {chunksize} linhas).")
+
+        pending_files = []
+        for source, table, column_mapping in files:
+            file_hash = source.fingerprint()
+            if incremental and _is_file_ingested(conn, file_hash):
+                logging.info(f"Arquivo {source.name} já ingerido anteriormente (mesmo hash). Pulando.")
+                continue
+            pending_files.append((source, table, column_mapping, file_hash))
+
+        # Vários períodos em disco: leitura e conversão de todos os arquivos em um único pool de processos
+        batch_reader = None
+        if (chunksize and min(workers or 1, PARSE_WORKERS) > 1 and len(pending_files) > 2
+                and all(source.path is not None for source, *_ in pending_files)):
+            workers = min(workers, PARSE_WORKERS)
+            logging.info(f"Carga em lote de {len(pending_files)} arquivos com {workers} processos de leitura.")
+            batch_reader = _BatchChunkReader([file[:3] for file in pending_files], chunksize, workers)
+        try:
+            rows_done = {'cabecalho': 0, 'itens': 0}  # Progresso acumulado por tabela entre os arquivos
+            dimension_ids = _DimensionIds(conn)
+            for index, (source, table, column_mapping, file_hash) in enumerate(pending_files):
+                logging.info(f"Iniciando ingestão de nfs_{table}: {source.name}")
+                offset = rows_done[table]
+                file_progress = lambda stage, parsed, inserted: progress(stage, offset + parsed, offset + inserted)
+                if batch_reader is not None:
+                    chunks = batch_reader.chunks(index)
+                else:
+                    chunks = _iter_converted_chunks(source, table, column_mapping, chunksize, workers)
+                rows = _ingest_csv(conn, chunks, table, incremental, file_progress, dimension_ids)
+                _register_file(conn, file_hash, source, table, rows)
+                rows_done[table] += rows
+        finally:
+            if batch_reader is not None:
+                batch_reader.close()
+
+        progress('finalizacao', 0, 0)
+        if not incremental:
+            _create_secondary_indexes(conn)
+        _fill_missing_periods(conn)
+        if incremental and not rollups_need_full_rebuild(conn):
+            track_affected_months(conn, 'temp.chaves_substituidas')  # Notas com itens substituídos
+            rebuild_rollups(conn, only_affected_months=True)
+        else:
+            rebuild_rollups(conn)
+        _write_content_fingerprint(conn)
+        generation = _bump_db_generation(conn)
         conn.commit()
-        logging.info("Tabela nfs_itens limpa antes da inserção.")
-        
-        df_itens_final.to_sql('nfs_itens', conn, if_exists='append', index=False) # Usar append agora que limpamos
-        logging.info(f"{len(df_itens_final)} registros inseridos em nfs_itens.")
+        logging.info(f"Banco de dados na geração {generation}.")
+    except BaseException:
+        conn.rollback()
+        logging.warning("Transação de ingestão desfeita; o banco permanece como antes.")
+        raise
+
+    logging.info("Ingestão de dados concluída com sucesso.")
+    return True
+
+def ingest_data(conn, cabecalho_csv_path, itens_csv_path, chunksize=None, incremental=False, workers=1,
+                export_backend=None, progress=None):
+    """ Lê os arquivos CSV e insere os dados nas tabelas SQLite usando as instruções do 'Agente Curador'.
+
+    Cada CSV pode ser um caminho ou uma `csv_sources.CsvSource` (membro de ZIP ou buffer do upload,
+    lidos em streaming), e cada argumento pode ser uma lista de CSVs (vários meses em uma só carga).
+    Os dados são gravados no esquema de `get_database_schema` (chave primária, chave estrangeira e
+    índices preservados): as colunas de texto repetitivas são lidas como categóricas e gravadas uma
+    vez nas dimensões de DIMENSIONS, referenciadas por chaves inteiras nas tabelas fato. Com
+    `chunksize` definido, os CSVs são lidos, convertidos e inseridos em blocos de até `chunksize`
+    linhas, mantendo o uso de memória constante.
+
+    Com `incremental=True` as tabelas não são limpas: cabeçalhos são atualizados pela CHAVE_DE_ACESSO,
+    os itens são substituídos apenas para as notas presentes no arquivo e arquivos já registrados em
+    `arquivos_ingeridos` (mesmo hash) são pulados.
+
+    Toda a ingestão ocorre em uma única transação, desfeita em caso de erro. Na carga completa os
+    índices secundários são recriados só depois dos dados. As tabelas de resumo mensal (`rollups`) são
+    reconstruídas ao final: por inteiro na carga completa e só nos meses afetados na incremental.
+
+    No modo em streaming, `workers > 1` paraleliza o parsing em processos (ver `read_csv_chunks`);
+    com mais de um par de arquivos em disco (carga de vários períodos), leitura e conversão de todos os
+    arquivos vão para um único pool de processos. A gravação continua em um único escritor. Cada linha
+    recebe em PERIODO o prefixo 'AAAAMM' do nome do arquivo (ou o mês de emissão da nota).
 
-        logging.info("Ingestão de dados concluída com sucesso.")
-        return True
+    Com `export_backend` ("duckdb" ou "parquet"), as tabelas são exportadas para o backend colunar
+    depois do commit (ver `columnar_backend`); o SQLite continua sendo a fonte da verdade.
 
+    `progress(etapa, linhas_lidas, linhas_inseridas)` é chamado a cada bloco, com a etapa 'cabecalho',
+    'itens' ou 'finalizacao' (índices e resumos). Se ele levantar `IngestionCancelled`, a transação é
+    desfeita e a exceção é propagada.
+    """
+    progress = progress or _no_progress
+    try:
+        success = _ingest_in_transaction(
+            conn, cabecalho_csv_path, itens_csv_path, chunksize, incremental, workers, progress
+        )
+        if success and export_backend:
+            db_file = conn.execute("PRAGMA database_list").fetchone()[2]
+            try:
+                columnar_backend.ensure_export(db_file, export_backend)
+            except Exception as e:
+                logging.error(f"Dados gravados no SQLite, mas a exportação para {export_backend} falhou: {e}")
+                return False
+        return success
+    except IngestionCancelled:
+        logging.warning("Ingestão cancelada; o banco permanece como antes.")
+        raise
     except FileNotFoundError as e:
         logging.error(f"Erro: Arquivo não encontrado - {e}")
         return False
@@ -194,31 +1115,111 @@ def ingest_data(conn, cabecalho_csv_path, itens_csv_path):
         logging.error(f"Erro inesperado durante a ingestão: {e}")
         return False
 
-# Bloco para teste direto do script (opcional)
-if __name__ == '__main__':
-    cabecalho_file = '/home/ubuntu/upload/202401_NFs_Cabecalho.csv'
-    itens_file = '/home/ubuntu/upload/202401_NFs_Itens.csv'
+def _source_list(csvs):
+    return [as_source(csv) for csv in (csvs if isinstance(csvs, (list, tuple)) else [csvs])]
+
+def _has_new_files(db_path, sources):
+    """ Algum dos arquivos ainda não está em `arquivos_ingeridos` do banco publicado? """
+    with read_connection(db_path) as conn:
+        try:
+            return any(not _is_file_ingested(conn, source.fingerprint()) for source in sources)
+        except sqlite3.OperationalError:
+            return True  # Banco criado por uma versão sem o registro de arquivos
+
+def ingest_new_generation(cabecalho_csv_path, itens_csv_path, db_file=DB_FILE, incremental=False, **ingest_kwargs):
+    """ Ingere em um banco-sombra da próxima geração e o publica só se a carga for válida.
 
-    conn = create_connection()
-    if conn is not None:
-        create_tables(conn) # Usa get_database_schema internamente
-        success = ingest_data(conn, cabecalho_file, itens_file) # Usa get_ingestion_instructions internamente
+    O banco publicado de `db_file` não é alterado durante a carga: as consultas seguem nele até a troca
+    atômica do ponteiro (ver `db_generations`). Na ingestão incremental a sombra parte de uma cópia do
+    banco atual; antes da cópia, os hashes dos arquivos são conferidos no registro `arquivos_ingeridos`
+    do banco publicado e, se todos já foram ingeridos, nada é copiado nem publicado. Se a carga falhar,
+    for cancelada ou não passar em `validate_shadow`, a sombra é descartada. Retorna True se uma nova
+    geração foi publicada ou se não havia arquivo novo; `IngestionCancelled` é propagada.
+    """
+    previous_counts = None
+    if incremental and db_generations.database_exists(db_file):
+        current = db_generations.resolve_db_file(db_file)
+        # As origens são criadas uma vez só, para que o hash calculado aqui seja reaproveitado na carga
+        cabecalho_csv_path, itens_csv_path = _source_list(cabecalho_csv_path), _source_list(itens_csv_path)
+        if not _has_new_files(current, cabecalho_csv_path + itens_csv_path):
+            logging.info("Todos os arquivos já foram ingeridos na geração publicada; nenhuma geração nova criada.")
+            return True
+        previous_counts = db_generations.table_counts(current)
+    shadow = db_generations.create_shadow(db_file, copy_current=incremental)
+    try:
+        with writer_connection(shadow) as conn:
+            create_tables(conn)
+            success = ingest_data(conn, cabecalho_csv_path, itens_csv_path, incremental=incremental, **ingest_kwargs)
         if success:
-            print("\nTeste de ingestão concluído com sucesso.")
-            try:
-                print("\nVerificando contagem de registros:")
-                cursor = conn.cursor()
-                cursor.execute("SELECT COUNT(*) FROM nfs_cabecalho")
-                print(f"Cabeçalhos: {cursor.fetchone()[0]}")
-                cursor.execute("SELECT COUNT(*) FROM nfs_itens")
-                print(f"Itens: {cursor.fetchone()[0]}")
-            except sqlite3.Error as e:
-                print(f"Erro ao verificar contagem: {e}")
-        else:
-            print("\nTeste de ingestão falhou.")
-        conn.close()
-        logging.info("Conexão com o banco de dados fechada.")
-    else:
-        print("Falha ao conectar ao banco de dados.")
+            problems = db_generations.validate_shadow(shadow, previous_counts)
+            if problems:
+                logging.error(f"Nova geração rejeitada na validação: {'; '.join(problems)}")
+                success = False
+    except BaseException:
+        db_generations.discard_shadow(shadow)
+        raise
+    if not success:
+        db_generations.discard_shadow(shadow)
+        return False
+    db_generations.publish(db_file, shadow)
+    return True
+
+def ingest_periods(paths, db_file=DB_FILE, incremental=False, chunksize=CHUNK_SIZE, workers=PARSE_WORKERS, **ingest_kwargs):
+    """ Carga em lote: encontra todos os pares `AAAAMM_NFs_Cabecalho.csv`/`AAAAMM_NFs_Itens.csv` em
+    `paths` (arquivos, diretórios ou ZIPs) e os ingere em uma única nova geração do banco.
 
+    Os CSVs em disco são lidos e convertidos em paralelo por um pool de processos e gravados por um
+    único escritor (ver `ingest_data`); membros de ZIP são lidos em streaming. Retorna
+    (sucesso, [períodos], [erros de pareamento]); com erros de pareamento nada é ingerido.
+    """
+    pairs, errors = find_csv_pairs(sources_from_paths(paths))
+    if errors:
+        for error in errors:
+            logging.error(error)
+        return False, [], errors
+    periods = [prefix for prefix, _, _ in pairs]
+    logging.info(f"{len(pairs)} período(s) encontrado(s): {', '.join(periods)}")
+    success = ingest_new_generation(
+        [cabecalho for _, cabecalho, _ in pairs], [itens for _, _, itens in pairs], db_file=db_file,
+        incremental=incremental, chunksize=chunksize, workers=workers, **ingest_kwargs
+    )
+    return success, periods, []
 
+# Bloco para teste direto do script (opcional)
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Ingestão dos CSVs de NF-e em uma nova geração do banco SQLite.")
+    parser.add_argument("caminhos", nargs="*", help="Arquivos CSV/ZIP ou diretórios com os pares AAAAMM_NFs_*.csv.")
+    parser.add_argument("--banco", default=DB_FILE)
+    parser.add_argument("--incremental", action="store_true", help="Mantém os dados já carregados.")
+    parser.add_argument("--processos", type=int, default=PARSE_WORKERS)
+    parser.add_argument("--bloco", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--exportar", choices=columnar_backend.COLUMNAR_BACKENDS, help="Exporta para o backend colunar.")
+    args = parser.parse_args()
+
+    paths = args.caminhos
+    if not paths:
+        cabecalho_file = '/home/ubuntu/upload/202401_NFs_Cabecalho.csv'
+        itens_file = '/home/ubuntu/upload/202401_NFs_Itens.csv'
+        if not (os.path.exists(cabecalho_file) and os.path.exists(itens_file)):
+            from synthetic_data import generate_synthetic_csvs
+            print("Arquivos de teste não encontrados; gerando NF-e sintéticas em dados_sinteticos/.")
+            cabecalho_file, itens_file = generate_synthetic_csvs('dados_sinteticos', 10_000)
+        paths = [cabecalho_file, itens_file]
+
+    # Usa get_database_schema e get_ingestion_instructions internamente, em uma nova geração do banco
+    success, periods, errors = ingest_periods(
+        paths, db_file=args.banco, incremental=args.incremental, chunksize=args.bloco, workers=args.processos,
+        export_backend=args.exportar,
+    )
+    if success:
+        print(f"\nIngestão concluída com sucesso: {len(periods)} período(s) ({', '.join(periods)}).")
+        try:
+            db_path = db_generations.resolve_db_file(args.banco)
+            print(f"\nVerificando contagem de registros em {db_path}:")
+            counts = db_generations.table_counts(db_path)
+            print(f"Cabeçalhos: {counts['nfs_cabecalho']}")
+            print(f"Itens: {counts['nfs_itens']}")
+        except sqlite3.Error as e:
+            print(f"Erro ao verificar contagem: {e}")
+    else:
+        print("\nIngestão falhou." + (f" {' '.join(errors)}" if errors else " Verifique os logs."))
@@ -2,88 +2,445 @@
 import sqlite3
 import logging
 import os
+import hashlib
+import threading
+import json
+import base64
+import contextvars
+from collections import OrderedDict
+import pandas as pd
 from langchain_community.utilities import SQLDatabase
 from langchain_google_genai import ChatGoogleGenerativeAI
 # Use the recommended create_sql_agent approach
 from langchain_community.agent_toolkits.sql.base import create_sql_agent
 from langchain_community.agent_toolkits.sql.toolkit import SQLDatabaseToolkit
 from langchain.agents.agent_types import AgentType
+import question_cache
+from result_cache import ResultCache, canonicalize_sql, is_read_only_select
+from db_pool import read_connection, writer_connection
+from rollups import describe_rollups
+from data_ingestion import NORMALIZED_TABLES
+import columnar_backend
+import db_generations
+import tracing
+
+try:
+    import pyarrow as pa  # Opcional: lotes no formato Arrow em iter_direct_sql
+except ImportError:
+    pa = None
 
 # Configuração básica de logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 DB_FILE = "notas_fiscais.db"
+LLM_MODEL = "gemini-2.0-flash"
+AGENT_POOL_MAX_SIZE = 8  # Agentes mantidos em memória (LRU)
+MAX_DIRECT_SQL_ROWS = 100_000  # Limite de linhas materializadas por execute_direct_sql
+STREAM_BATCH_ROWS = 10_000  # Linhas por lote em iter_direct_sql
+DEFAULT_PAGE_SIZE = 1_000
+QUERY_BACKEND = "sqlite"  # "sqlite", "duckdb" ou "parquet" (ver columnar_backend)
+
+# Resultados de SELECTs por (arquivo do banco, backend, geração do banco, SQL canonizado, limite)
+_result_cache = ResultCache()
+
+# Agentes prontos por (chave da API, arquivo do banco, backend, geração do banco); reutilizados entre perguntas
+_agent_pool = OrderedDict()
+_agent_pool_lock = threading.Lock()
+
+def current_db_file():
+    """ Arquivo da geração publicada do banco DB_FILE (ver db_generations). Resolvido a cada operação. """
+    return db_generations.resolve_db_file(DB_FILE)
+
+def get_db_generation(db_file=None):
+    """ Retorna a geração do banco (PRAGMA user_version), incrementada a cada ingestão concluída. """
+    with read_connection(db_file or current_db_file()) as conn:
+        return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def get_db_fingerprint(db_file=None):
+    """ Impressão digital do conteúdo gravada pela ingestão em `metadados_banco` (None se ausente). """
+    with read_connection(db_file or current_db_file()) as conn:
+        try:
+            row = conn.execute("SELECT VALOR FROM metadados_banco WHERE CHAVE = 'fingerprint'").fetchone()
+        except sqlite3.OperationalError:
+            return None  # Banco criado por uma versão sem a tabela de metadados
+        return row[0] if row else None
+
+# Resultado estruturado da última consulta do agente na pergunta em andamento (ver _CapturingSQLDatabase)
+_captured_result = contextvars.ContextVar("resultado_capturado", default=None)
 
-def get_db_connection():
-    """ Retorna um objeto SQLDatabase conectado ao banco SQLite. """
-    if not os.path.exists(DB_FILE):
-        logging.error(f"Arquivo do banco de dados não encontrado: {DB_FILE}")
-        raise FileNotFoundError(f"Arquivo do banco de dados não encontrado: {DB_FILE}")
+class _CapturingSQLDatabase(SQLDatabase):
+    """ SQLDatabase que, durante uma pergunta, guarda colunas e linhas do último SELECT do agente.
+
+    A ferramenta sql_db_query continua devolvendo texto ao LLM; a cópia estruturada segue na resposta
+    para a interface exibir a tabela sem que o modelo precise redigitá-la célula a célula.
+    """
+
+    def _execute(self, command, fetch="all", **kwargs):
+        result = super()._execute(command, fetch, **kwargs)
+        capture = _captured_result.get()
+        if capture is not None and fetch == "all":
+            rows = list(result)
+            capture.update(
+                sql=str(command).strip(),
+                columns=list(rows[0].keys()) if rows else [],
+                rows=[tuple(row.values()) for row in rows[:MAX_DIRECT_SQL_ROWS]],
+                truncated=len(rows) > MAX_DIRECT_SQL_ROWS,
+            )
+        return result
+
+def get_db_connection(backend=None, db_file=None):
+    """ Retorna um objeto SQLDatabase somente leitura no SQLite ou no backend colunar (`backend`).
+
+    Sem `db_file`, usa a geração publicada do banco no momento da chamada.
+    """
+    backend = backend or QUERY_BACKEND
+    db_file = db_file or current_db_file()
+    if not os.path.exists(db_file):
+        logging.error(f"Arquivo do banco de dados não encontrado: {db_file}")
+        raise FileNotFoundError(f"Arquivo do banco de dados não encontrado: {db_file}")
     
-    db_uri = f"sqlite:///{DB_FILE}"
+    engine_args = {}
+    if backend == "sqlite":
+        # O agente só consulta: a URI somente leitura impede escritas e não disputa a trava com a ingestão
+        db_uri = f"sqlite:///file:{os.path.abspath(db_file)}?mode=ro&uri=true"
+    else:
+        db_uri, engine_args = columnar_backend.sqlalchemy_engine_args(db_file, backend)
+    ignore_tables = None
+    if backend == "sqlite":
+        # As notas são expostas ao agente pelas visões nfs_cabecalho/nfs_itens; fatos e dimensões ficam ocultos
+        with read_connection(db_file) as conn:
+            existing = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        ignore_tables = [table for table in NORMALIZED_TABLES if table in existing] or None
     try:
-        db = SQLDatabase.from_uri(db_uri)
-        logging.info(f"Conexão Langchain SQLDatabase estabelecida com {DB_FILE}")
+        # Visões: nfs_cabecalho/nfs_itens no SQLite e todas as tabelas com Parquet (DuckDB)
+        db = _CapturingSQLDatabase.from_uri(
+            db_uri, engine_args=engine_args, view_support=backend in ("sqlite", "parquet"), ignore_tables=ignore_tables
+        )
+        logging.info(f"Conexão Langchain SQLDatabase ({backend}) estabelecida com {db_uri}")
         logging.info(f"Tabelas encontradas: {db.get_table_names()}")
         return db
     except Exception as e:
         logging.error(f"Erro ao criar SQLDatabase a partir da URI {db_uri}: {e}")
         raise
 
-def execute_direct_sql(sql_query: str):
-    """ Executa uma query SQL diretamente no banco e retorna os resultados. """
-    conn = None
+def _execute_columnar(db_file, sql_query, canonical_sql, backend, use_cache, max_rows):
+    """ SELECT no backend colunar (DuckDB/Parquet), com o mesmo cache de resultados do SQLite. """
+    if not columnar_backend.is_available(backend):
+        return {"error": f"O backend '{backend}' requer os pacotes duckdb e pyarrow."}
+    cache_key = None
+    if use_cache:
+        cache_key = (os.path.abspath(db_file), backend, get_db_generation(db_file), canonical_sql, max_rows)
+        cached = _result_cache.get(cache_key)
+        if cached is not None:
+            logging.info(f"SQL direto ({backend}) servido do cache ({len(cached)} linhas): {canonical_sql}")
+            return cached
+    try:
+        logging.info(f"Executando SQL direto ({backend}): {sql_query}")
+        column_names, results, truncated = columnar_backend.execute(db_file, backend, sql_query, max_rows)
+    except (columnar_backend.duckdb.Error, sqlite3.Error) as e:
+        logging.error(f"Erro ao executar SQL direto ({backend}) \n{sql_query}\n: {e}")
+        return {"error": str(e)}
+    if truncated:
+        logging.warning(f"Resultado truncado em {max_rows} linhas.")
+    formatted_results = [dict(zip(column_names, row)) for row in results]
+    if cache_key is not None:
+        _result_cache.put(cache_key, formatted_results)
+    return formatted_results
+
+def execute_direct_sql(sql_query: str, use_cache: bool = True, max_rows: int = MAX_DIRECT_SQL_ROWS, backend: str = None):
+    """ Executa uma query SQL diretamente no banco e retorna os resultados.
+
+    No máximo `max_rows` linhas são materializadas (None para sem limite); para resultados maiores use
+    `iter_direct_sql` ou `fetch_sql_page`. SELECTs somente leitura são servidos do cache de resultados
+    enquanto a geração do banco não mudar. A lista devolvida pode ser compartilhada com o cache e não
+    deve ser modificada.
+
+    Com `backend` "duckdb" ou "parquet" (padrão: QUERY_BACKEND), SELECTs rodam na exportação colunar
+    da geração atual; comandos de escrita continuam indo ao SQLite.
+    """
+    backend = backend or QUERY_BACKEND
+    with tracing.span("sql", origem="direto", backend=backend, sql=sql_query.strip()) as span_attributes:
+        results = _execute_direct_sql(sql_query, use_cache, max_rows, backend)
+        if isinstance(results, dict):
+            span_attributes["erro"] = results["error"]
+        else:
+            span_attributes["linhas"] = len(results)
+            tracing.increment("sql_linhas", len(results), origem="direto")
+    return results
+
+def _execute_direct_sql(sql_query, use_cache, max_rows, backend):
+    canonical_sql = canonicalize_sql(sql_query)
+    read_only = is_read_only_select(canonical_sql)
+    db_file = current_db_file()
+    if read_only and backend != "sqlite":
+        return _execute_columnar(db_file, sql_query, canonical_sql, backend, use_cache, max_rows)
     try:
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
-        logging.info(f"Executando SQL direto: {sql_query}")
-        cursor.execute(sql_query)
-        results = cursor.fetchall()
-        column_names = [description[0] for description in cursor.description] if cursor.description else []
-        conn.commit()
+        # Leituras usam o pool somente leitura; o restante passa pela conexão de escrita única
+        with (read_connection(db_file) if read_only else writer_connection(db_file)) as conn:
+            cache_key = None
+            if use_cache and read_only:
+                generation = conn.execute("PRAGMA user_version").fetchone()[0]
+                cache_key = (os.path.abspath(db_file), "sqlite", generation, canonical_sql, max_rows)
+                cached = _result_cache.get(cache_key)
+                if cached is not None:
+                    logging.info(f"SQL direto servido do cache ({len(cached)} linhas): {canonical_sql}")
+                    return cached
+
+            cursor = conn.cursor()
+            logging.info(f"Executando SQL direto: {sql_query}")
+            cursor.execute(sql_query)
+            results = cursor.fetchall() if max_rows is None else cursor.fetchmany(max_rows)
+            column_names = [description[0] for description in cursor.description] if cursor.description else []
+            if max_rows is not None and len(results) == max_rows and cursor.fetchone() is not None:
+                logging.warning(f"Resultado truncado em {max_rows} linhas. Use iter_direct_sql/fetch_sql_page para o restante.")
+            cursor.close()
+            if not read_only:
+                conn.commit()
         logging.info(f"SQL direto executado com sucesso. {len(results)} linhas retornadas.")
         formatted_results = [dict(zip(column_names, row)) for row in results]
+        if cache_key is not None:
+            _result_cache.put(cache_key, formatted_results)
         return formatted_results
     except sqlite3.Error as e:
         logging.error(f"Erro ao executar SQL direto \n{sql_query}\n: {e}")
         return {"error": str(e)}
-    finally:
-        if conn:
-            conn.close()
 
-def query_database_agent(question: str, google_api_key: str):
+def _to_columnar(columns, rows, block_format):
+    """ Converte um lote de tuplas em colunas NumPy ou em um RecordBatch do Arrow. """
+    frame = pd.DataFrame.from_records(rows, columns=columns)
+    if block_format == "arrow":
+        return pa.RecordBatch.from_pandas(frame, preserve_index=False)
+    return {column: frame[column].to_numpy() for column in columns}
+
+def iter_direct_sql(sql_query: str, batch_size: int = STREAM_BATCH_ROWS, max_rows: int = None, block_format: str = "rows"):
+    """ Executa um SELECT e devolve os resultados em lotes, com memória constante.
+
+    Cada lote é um dict {"columns": [...], "rows": [tuplas]} (`block_format="rows"`), um dict
+    {"columns": [...], "arrays": {coluna: np.ndarray}} (`"numpy"`) ou um pyarrow.RecordBatch
+    (`"arrow"`, requer pyarrow). `max_rows` limita o total de linhas lidas.
+    """
+    if block_format == "arrow" and pa is None:
+        raise ImportError("block_format='arrow' requer o pacote pyarrow.")
+    if not is_read_only_select(canonicalize_sql(sql_query)):
+        raise ValueError("iter_direct_sql aceita apenas um único SELECT somente leitura.")
+
+    with read_connection(current_db_file()) as conn:
+        cursor = conn.execute(sql_query)
+        try:
+            columns = [description[0] for description in cursor.description]
+            remaining = max_rows
+            while remaining is None or remaining > 0:
+                rows = cursor.fetchmany(batch_size if remaining is None else min(batch_size, remaining))
+                if not rows:
+                    break
+                if remaining is not None:
+                    remaining -= len(rows)
+                if block_format == "rows":
+                    yield {"columns": columns, "rows": rows}
+                elif block_format == "numpy":
+                    yield {"columns": columns, "arrays": _to_columnar(columns, rows, "numpy")}
+                else:
+                    yield _to_columnar(columns, rows, "arrow")
+        finally:
+            cursor.close()  # Encerra a leitura antes de devolver a conexão ao pool
+
+def _encode_page_token(offset, canonical_sql, generation):
+    payload = {"offset": offset, "sql": hashlib.sha256(canonical_sql.encode()).hexdigest()[:16], "geracao": generation}
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+
+def _decode_page_token(page_token):
+    return json.loads(base64.urlsafe_b64decode(page_token.encode()))
+
+def fetch_sql_page(sql_query: str, page_size: int = DEFAULT_PAGE_SIZE, page_token: str = None):
+    """ Retorna uma página do resultado de um SELECT e o token da próxima página.
+
+    Resultado: {"columns": [...], "rows": [dicts], "next_page_token": str ou None}, ou {"error": ...}.
+    A paginação usa LIMIT/OFFSET sobre a consulta original; o token guarda o deslocamento, um hash do
+    SQL e a geração do banco, e deixa de valer se o banco for recarregado entre as páginas.
+    """
+    canonical_sql = canonicalize_sql(sql_query)
+    if not is_read_only_select(canonical_sql):
+        return {"error": "fetch_sql_page aceita apenas um único SELECT somente leitura."}
+
+    try:
+        with read_connection(current_db_file()) as conn:
+            generation = conn.execute("PRAGMA user_version").fetchone()[0]
+            offset = 0
+            if page_token:
+                token = _decode_page_token(page_token)
+                expected = _decode_page_token(_encode_page_token(token["offset"], canonical_sql, generation))
+                if token != expected:
+                    return {"error": "Token de página inválido ou expirado (consulta diferente ou banco recarregado)."}
+                offset = token["offset"]
+
+            # Uma linha a mais indica se existe próxima página
+            cursor = conn.execute(f"SELECT * FROM ({canonical_sql}) LIMIT ? OFFSET ?", (page_size + 1, offset))
+            columns = [description[0] for description in cursor.description]
+            rows = cursor.fetchall()
+        next_token = _encode_page_token(offset + page_size, canonical_sql, generation) if len(rows) > page_size else None
+        return {
+            "columns": columns,
+            "rows": [dict(zip(columns, row)) for row in rows[:page_size]],
+            "next_page_token": next_token,
+        }
+    except (sqlite3.Error, ValueError, KeyError) as e:
+        logging.error(f"Erro ao paginar SQL \n{sql_query}\n: {e}")
+        return {"error": str(e)}
+
+def get_result_cache_stats():
+    """ Acertos, falhas, remoções e memória estimada do cache de resultados de execute_direct_sql. """
+    return _result_cache.stats()
+
+def _build_llm(google_api_key: str):
+    return ChatGoogleGenerativeAI(
+        model=LLM_MODEL,
+        google_api_key=google_api_key,
+        temperature=0,
+        convert_system_message_to_human=True
+    )
+
+def _build_agent_executor(llm, backend=None, db_file=None):
+    """ Monta o SQLDatabase (com reflexão do esquema), o toolkit e o executor do agente SQL. """
+    db = get_db_connection(backend, db_file)
+    toolkit = SQLDatabaseToolkit(db=db, llm=llm)
+
+    # Criar o Agente SQL com handle_parsing_errors=True
+    return create_sql_agent(
+        llm=llm,
+        toolkit=toolkit,
+        verbose=True, 
+        agent_type=AgentType.ZERO_SHOT_REACT_DESCRIPTION,
+        handle_parsing_errors=True, # Adicionado para tratar erros de parsing
+        # Os passos intermediários trazem o SQL executado, guardado no cache de perguntas
+        agent_executor_kwargs={"return_intermediate_steps": True}
+    )
+
+def get_agent_executor(google_api_key: str, llm=None, backend=None):
+    """ Retorna um executor do agente SQL reaproveitado do pool ou cria um novo.
+
+    O pool é indexado por (chave da API, arquivo do banco, backend, geração do banco): uma nova
+    ingestão muda a geração e os agentes antigos deixam de ser usados. `llm` permite injetar um
+    modelo (ex.: um chat falso local em testes) no lugar do Gemini.
+    """
+    backend = backend or QUERY_BACKEND
+    llm_key = hashlib.sha256(google_api_key.encode()).hexdigest() if llm is None else f"llm-{id(llm)}"
+    db_path = os.path.abspath(current_db_file())
+    generation = get_db_generation(db_path)
+    key = (llm_key, db_path, backend, generation)
+
+    with _agent_pool_lock:
+        executor = _agent_pool.get(key)
+        if executor is not None:
+            _agent_pool.move_to_end(key)
+            logging.info(f"Reutilizando agente SQL do pool (geração {generation} do banco).")
+            return executor
+
+    logging.info(f"Criando agente SQL para a geração {generation} do banco.")
+    executor = _build_agent_executor(llm if llm is not None else _build_llm(google_api_key), backend, db_path)
+    with _agent_pool_lock:
+        # Agentes da mesma chave/backend em gerações (arquivos) anteriores não serão mais usados
+        for stale_key in [k for k in _agent_pool if (k[0], k[2]) == (key[0], key[2]) and k != key]:
+            del _agent_pool[stale_key]
+        _agent_pool[key] = executor
+        while len(_agent_pool) > AGENT_POOL_MAX_SIZE:
+            _agent_pool.popitem(last=False)
+    return executor
+
+def invalidate_agent_pool():
+    """ Descarta todos os agentes em cache. Chamado ao fim de uma ingestão. """
+    with _agent_pool_lock:
+        _agent_pool.clear()
+    logging.info("Pool de agentes SQL invalidado.")
+
+def _final_sql(intermediate_steps):
+    """ Último SQL executado com sucesso pela ferramenta sql_db_query, ou None. """
+    for action, observation in reversed(intermediate_steps or []):
+        if getattr(action, "tool", None) == "sql_db_query" and not str(observation).startswith("Error"):
+            return str(action.tool_input).strip()
+    return None
+
+def _rows_to_result(rows):
+    """ Converte a lista de dicts de execute_direct_sql no resultado estruturado da resposta. """
+    columns = list(rows[0].keys()) if rows else []
+    return {"columns": columns, "rows": [tuple(row[c] for c in columns) for row in rows], "truncated": False}
+
+def _describe_result(data):
+    """ Frase curta que acompanha a tabela estruturada (a interface exibe as linhas). """
+    if not data["rows"]:
+        return "A consulta não retornou resultados."
+    suffix = " (resultado truncado)" if data["truncated"] else ""
+    return f"A consulta retornou {len(data['rows'])} linha(s){suffix}."
+
+def _answer_from_cache(question, fingerprint, backend):
+    """ Responde pela execução direta do SQL em cache, sem o LLM. Retorna None em caso de miss ou erro. """
+    sql, hit_type = question_cache.lookup_sql(question, fingerprint)
+    if sql is None:
+        return None
+    rows = execute_direct_sql(sql, backend=backend)
+    if isinstance(rows, dict):  # {"error": ...}: SQL em cache não é mais válido, voltar ao agente
+        logging.warning(f"SQL em cache falhou ({rows['error']}); consultando o agente.")
+        return None
+    data = _rows_to_result(rows)
+    return {"result": _describe_result(data), "sql": sql, "data": data, "cache": hit_type}
+
+def query_database_agent(question: str, google_api_key: str, llm=None, use_cache=True, backend=None):
     """ 
     Usa um agente Langchain SQL para traduzir a pergunta em SQL, executar e retornar o resultado.
+    O agente é reaproveitado entre perguntas (ver `get_agent_executor`). Com `use_cache`, perguntas
+    equivalentes já respondidas são atendidas pelo cache de perguntas, sem chamar o LLM.
+    `backend` escolhe onde o agente consulta: SQLite (padrão) ou a exportação DuckDB/Parquet.
+    Retorna {"result": texto, "sql": último SQL} e, quando houver, "data" com o resultado estruturado
+    desse SQL ({"columns", "rows", "truncated"}) para a interface exibir como tabela.
     """
-    if not google_api_key:
+    backend = backend or QUERY_BACKEND
+    if not google_api_key and llm is None:
         logging.error("Chave da API do Google não fornecida.")
         return {"error": "Chave da API do Google não fornecida."}
 
     try:
-        db = get_db_connection()
-        llm = ChatGoogleGenerativeAI(
-            model="gemini-2.0-flash",
-            google_api_key=google_api_key,
-            temperature=0,
-            convert_system_message_to_human=True
-        )
-        toolkit = SQLDatabaseToolkit(db=db, llm=llm)
-
-        # Criar o Agente SQL com handle_parsing_errors=True
-        agent_executor = create_sql_agent(
-            llm=llm,
-            toolkit=toolkit,
-            verbose=True, 
-            agent_type=AgentType.ZERO_SHOT_REACT_DESCRIPTION,
-            handle_parsing_errors=True # Adicionado para tratar erros de parsing
-        )
+        db_file = current_db_file()
+        if not os.path.exists(db_file):
+            raise FileNotFoundError(f"Arquivo do banco de dados não encontrado: {db_file}")
+        fingerprint = get_db_fingerprint(db_file) if use_cache else None
+        if fingerprint:
+            with tracing.span("cache_perguntas") as span_attributes:
+                cached_answer = _answer_from_cache(question, fingerprint, backend)
+                span_attributes["acerto"] = cached_answer["cache"] if cached_answer else None
+            if cached_answer is not None:
+                return cached_answer
+
+        with tracing.span("construcao_agente", backend=backend):
+            agent_executor = get_agent_executor(google_api_key, llm=llm, backend=backend)
 
         logging.info(f"Executando agente SQL com a pergunta: {question}")
-        prompt_with_context = f"Responda em português. Analise as tabelas nfs_cabecalho (cabeçalho das notas fiscais) e nfs_itens (itens das notas fiscais) que estão relacionadas pela coluna CHAVE_DE_ACESSO. Questão: {question}"
+        prompt_with_context = (
+            f"Responda em português. Analise as tabelas nfs_cabecalho (cabeçalho das notas fiscais) e nfs_itens (itens das notas fiscais) que estão relacionadas pela coluna CHAVE_DE_ACESSO.\n"
+            f"Para filtrar ou agrupar por data use DATA_EMISSAO_ISO e DATA_HORA_EVENTO_ISO ('AAAA-MM-DD HH:MM:SS'), ANO_EMISSAO e MES_EMISSAO (indexadas) em vez de DATA_EMISSAO (texto 'dd/mm/aaaa').\n"
+            f"As duas tabelas têm a coluna indexada PERIODO ('AAAAMM', mês do arquivo de origem): filtre por ela para restringir a consulta a meses específicos.\n"
+            f"{describe_rollups()}\n"
+            f"O resultado da sua última consulta SQL será exibido ao usuário como tabela: não reescreva as linhas na resposta final, apenas resuma ou comente o resultado.\n"
+            f"Questão: {question}"
+        )
         
-        response = agent_executor.run(prompt_with_context)
+        capture = {}
+        token = _captured_result.set(capture)
+        try:
+            with tracing.span("agente"):
+                # O callback transforma passos ReAct, chamadas ao LLM e SQLs do agente em spans
+                response = agent_executor.invoke(
+                    {"input": prompt_with_context},
+                    config={"callbacks": [tracing.TracingCallbackHandler()]}
+                )
+        finally:
+            _captured_result.reset(token)
         logging.info(f"Agente SQL retornou a resposta.")
-        return {"result": response}
+        final_sql = _final_sql(response.get("intermediate_steps"))
+        if fingerprint and final_sql:
+            question_cache.store_sql(question, final_sql, fingerprint)
+        answer = {"result": response["output"], "sql": final_sql}
+        if final_sql and capture.get("sql") == final_sql:
+            answer["data"] = {key: capture[key] for key in ("columns", "rows", "truncated")}
+        return answer
 
     except FileNotFoundError as e:
          logging.error(f"Erro no agente SQL: {e}")
@@ -100,7 +457,7 @@ def query_database_agent(question: str, google_api_key: str):
 # Bloco para teste direto do script (opcional)
 if __name__ == '__main__':
     print("--- Teste do Agente Especialista em Banco de Dados ---")
-    if not os.path.exists(DB_FILE):
+    if not db_generations.database_exists(DB_FILE):
         print(f"Erro: Banco de dados {DB_FILE} não encontrado. Execute data_ingestion.py primeiro.")
     else:
         print("\nTeste 1: Execução SQL Direta (Contar cabeçalhos)")
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+""" Gerações do banco SQLite publicadas por troca atômica de um ponteiro.
+
+Cada ingestão grava em um banco-sombra novo (`notas_fiscais.gNNNNNN.db`), que só passa a ser consultado
+depois de pronto: índices criados, contagens validadas e WAL consolidado no arquivo. A publicação
+reescreve o arquivo-ponteiro (`notas_fiscais.db.atual`) com `os.replace`, que é atômico; leitores
+resolvem o arquivo atual a cada conexão nova por `resolve_db_file`, então nunca veem uma carga pela
+metade, e uma carga que falha não toca o banco publicado. A geração anterior é mantida para
+`rollback_generation` e para leitores que ainda a estejam usando.
+
+Sem ponteiro (bancos criados antes das gerações), o próprio `notas_fiscais.db` é o banco atual.
+"""
+import os
+import json
+import glob
+import sqlite3
+import logging
+import threading
+
+from db_pool import read_connection, writer_connection, close_database, enable_wal, NEW_DB_PAGE_SIZE
+
+# Configuração básica de logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+POINTER_SUFFIX = ".atual"
+SIDE_FILE_SUFFIXES = ("-wal", "-shm", "-journal")
+
+_publish_lock = threading.Lock()
+_pointer_cache = {}  # caminho do ponteiro -> (mtime_ns, conteúdo)
+
+def _pointer_path(db_file):
+    return os.path.abspath(db_file) + POINTER_SUFFIX
+
+def generation_file(db_file, generation):
+    """ Caminho do banco da geração: 'notas_fiscais.db' -> 'notas_fiscais.g000007.db'. """
+    base, extension = os.path.splitext(os.path.abspath(db_file))
+    return f"{base}.g{generation:06d}{extension}"
+
+def _read_pointer(db_file):
+    """ Conteúdo do ponteiro ({"atual", "anterior", "ultima_geracao"}) ou None se não existir. """
+    path = _pointer_path(db_file)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    cached = _pointer_cache.get(path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    with open(path, encoding="utf-8") as f:
+        pointer = json.load(f)
+    _pointer_cache[path] = (mtime, pointer)
+    return pointer
+
+def _write_pointer(db_file, pointer):
+    """ Grava o ponteiro em um arquivo temporário e o publica com os.replace (atômico). """
+    path = _pointer_path(db_file)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(pointer, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + ".tmp", path)
+
+def resolve_db_file(db_file):
+    """ Arquivo do banco publicado para o nome lógico `db_file` (ele mesmo, se não houver gerações). """
+    pointer = _read_pointer(db_file)
+    if pointer is None:
+        return db_file
+    return os.path.join(os.path.dirname(os.path.abspath(db_file)), pointer["atual"])
+
+def database_exists(db_file):
+    """ Existe um banco publicado (geração atual ou banco antigo sem ponteiro)? """
+    return os.path.exists(resolve_db_file(db_file))
+
+def _db_generation(path):
+    with read_connection(path) as conn:
+        return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def _remove_database_file(path):
+    close_database(path)
+    for file_path in [path] + [path + suffix for suffix in SIDE_FILE_SUFFIXES]:
+        try:
+            os.remove(file_path)
+        except FileNotFoundError:
+            pass
+
+def create_shadow(db_file, copy_current=False):
+    """ Cria o banco-sombra da próxima geração e retorna o caminho.
+
+    Com `copy_current` (ingestão incremental) a sombra começa como cópia do banco publicado, feita pela
+    API de backup do SQLite; caso contrário começa vazia. Em ambos os casos a sombra fica com
+    NEW_DB_PAGE_SIZE: a vazia recebe o page_size antes da primeira escrita, e a cópia de um banco com
+    outro page_size é convertida uma vez por VACUUM (as gerações seguintes herdam o novo valor). O
+    user_version da sombra é a última geração publicada, e a ingestão o incrementa ao confirmar, então
+    números de geração nunca se repetem.
+    """
+    current = resolve_db_file(db_file)
+    pointer = _read_pointer(db_file) or {}
+    last_generation = pointer.get("ultima_geracao", 0)
+    if os.path.exists(current):
+        last_generation = max(last_generation, _db_generation(current))
+    shadow = generation_file(db_file, last_generation + 1)
+    _remove_database_file(shadow)  # Sombra de uma tentativa anterior que não foi publicada
+
+    target = sqlite3.connect(shadow)
+    try:
+        if copy_current and os.path.exists(current):
+            with read_connection(current) as source:
+                source.backup(target)
+            logging.info(f"Banco-sombra {shadow} criado como cópia de {current}.")
+            page_size = target.execute("PRAGMA page_size").fetchone()[0]
+            if page_size != NEW_DB_PAGE_SIZE:
+                # A cópia ainda não está em WAL, então o VACUUM pode trocar o page_size
+                target.execute(f"PRAGMA page_size = {NEW_DB_PAGE_SIZE}")
+                target.execute("VACUUM")
+                logging.info(f"page_size da sombra convertido de {page_size} para {NEW_DB_PAGE_SIZE}.")
+        else:
+            logging.info(f"Banco-sombra {shadow} criado vazio.")
+        enable_wal(target)  # Num banco vazio, define o page_size antes da primeira escrita
+        target.execute(f"PRAGMA user_version = {last_generation}")
+    finally:
+        target.close()
+    return shadow
+
+def validate_shadow(shadow, previous_counts=None):
+    """ Confere as contagens da sombra antes da publicação. Retorna a lista de problemas (vazia se ok).
+
+    As duas tabelas de notas precisam ter linhas; na carga completa os itens devem bater com as linhas
+    registradas em `arquivos_ingeridos`, e na incremental o cabeçalho não pode encolher.
+    """
+    problems = []
+    counts = table_counts(shadow)
+    for table in ("nfs_cabecalho", "nfs_itens"):
+        if counts[table] == 0:
+            problems.append(f"{table} está vazia")
+    with read_connection(shadow) as conn:
+        registered = conn.execute(
+            "SELECT COALESCE(SUM(LINHAS), 0) FROM arquivos_ingeridos WHERE TABELA = 'itens'"
+        ).fetchone()[0]
+    if previous_counts is None and counts["nfs_itens"] != registered:
+        problems.append(f"nfs_itens tem {counts['nfs_itens']} linhas, mas {registered} foram lidas dos arquivos")
+    if previous_counts is not None and counts["nfs_cabecalho"] < previous_counts["nfs_cabecalho"]:
+        problems.append(
+            f"nfs_cabecalho encolheu de {previous_counts['nfs_cabecalho']} para {counts['nfs_cabecalho']} notas"
+        )
+    return problems
+
+def table_counts(path):
+    """ Linhas de nfs_cabecalho e nfs_itens no arquivo. """
+    with read_connection(path) as conn:
+        return {
+            table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+            for table in ("nfs_cabecalho", "nfs_itens")
+        }
+
+def discard_shadow(shadow):
+    """ Remove uma sombra que não será publicada (carga cancelada, com erro ou inválida). """
+    _remove_database_file(shadow)
+    logging.warning(f"Banco-sombra {shadow} descartado.")
+
+def publish(db_file, shadow):
+    """ Torna a sombra o banco atual. A geração que estava publicada passa a ser a anterior.
+
+    O WAL da sombra é consolidado no arquivo e a conexão de escrita é fechada antes da troca, de modo
+    que o banco publicado é um arquivo único. Gerações mais antigas que a anterior são removidas.
+    """
+    with writer_connection(shadow) as conn:
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        generation = conn.execute("PRAGMA user_version").fetchone()[0]
+    close_database(shadow)
+
+    with _publish_lock:
+        previous = resolve_db_file(db_file)
+        pointer = {
+            "atual": os.path.basename(shadow),
+            "anterior": os.path.basename(previous) if os.path.exists(previous) else None,
+            "ultima_geracao": generation,
+        }
+        _write_pointer(db_file, pointer)
+        logging.info(f"Geração {generation} publicada: {shadow}")
+        _remove_old_generations(db_file, pointer)
+    return shadow
+
+def _remove_old_generations(db_file, pointer):
+    """ Mantém só a geração atual e a anterior (inclusive o banco antigo sem geração, se for uma delas). """
+    directory = os.path.dirname(os.path.abspath(db_file))
+    keep = {os.path.join(directory, name) for name in (pointer["atual"], pointer["anterior"]) if name}
+    base, extension = os.path.splitext(os.path.abspath(db_file))
+    candidates = glob.glob(f"{glob.escape(base)}.g[0-9]*{extension}") + [os.path.abspath(db_file)]
+    for path in candidates:
+        if path not in keep and os.path.exists(path):
+            try:
+                _remove_database_file(path)
+                logging.info(f"Geração antiga removida: {path}")
+            except OSError as e:
+                logging.warning(f"Não foi possível remover a geração antiga {path}: {e}")
+
+def rollback_generation(db_file):
+    """ Volta o ponteiro para a geração anterior. Retorna o arquivo publicado ou None se não houver anterior. """
+    with _publish_lock:
+        pointer = _read_pointer(db_file)
+        if pointer is None or not pointer.get("anterior"):
+            logging.warning("Não há geração anterior para a qual voltar.")
+            return None
+        directory = os.path.dirname(os.path.abspath(db_file))
+        if not os.path.exists(os.path.join(directory, pointer["anterior"])):
+            logging.warning(f"Geração anterior {pointer['anterior']} não encontrada.")
+            return None
+        # A geração desfeita continua em disco como "anterior" até a próxima publicação
+        rolled_back = {
+            "atual": pointer["anterior"], "anterior": pointer["atual"],
+            "ultima_geracao": pointer.get("ultima_geracao", 0),
+        }
+        _write_pointer(db_file, rolled_back)
+    logging.info(f"Ponteiro do banco voltou para {rolled_back['atual']}.")
+    return os.path.join(directory, rolled_back["atual"])
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+""" Pool de conexões SQLite compartilhado entre as sessões do Streamlit.
+
+Consultas usam conexões somente leitura (URI `mode=ro`) reaproveitadas de um pool por arquivo de
+banco; escritas (ingestão, SQL direto que altera dados) passam por uma única conexão de escrita
+protegida por trava. O banco fica em modo WAL de forma permanente, então as leituras continuam
+respondendo a partir do último commit enquanto uma ingestão está em andamento.
+"""
+import os
+import queue
+import sqlite3
+import logging
+import threading
+from contextlib import contextmanager
+
+# Configuração básica de logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+READ_POOL_SIZE = 8  # Conexões de leitura simultâneas por arquivo de banco
+BUSY_TIMEOUT_MS = 5000
+NEW_DB_PAGE_SIZE = 65536  # page_size de bancos novos; depois do WAL ele não pode mais mudar
+
+_read_pools = {}  # caminho absoluto -> ReadOnlyPool
+_writers = {}  # caminho absoluto -> (conexão, trava)
+_registry_lock = threading.Lock()
+
+def enable_wal(conn):
+    """ Coloca o banco em WAL (persistente no arquivo) com synchronous=NORMAL e busy_timeout. """
+    if conn.execute("PRAGMA page_count").fetchone()[0] == 0:
+        conn.execute(f"PRAGMA page_size = {NEW_DB_PAGE_SIZE}")
+    mode = conn.execute("PRAGMA journal_mode = WAL").fetchone()[0]
+    if str(mode).lower() != 'wal':
+        logging.warning(f"Não foi possível ativar o modo WAL (journal_mode={mode}).")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+    return conn
+
+def connect_read_only(db_file):
+    """ Abre uma conexão somente leitura que pode ser usada por outra thread depois de devolvida ao pool. """
+    conn = sqlite3.connect(f"file:{os.path.abspath(db_file)}?mode=ro", uri=True, check_same_thread=False)
+    conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+    return conn
+
+class ReadOnlyPool:
+    """ Pool limitado de conexões somente leitura para um arquivo de banco. Seguro entre threads. """
+
+    def __init__(self, db_file, max_size=READ_POOL_SIZE):
+        self.db_file = db_file
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(max_size)
+
+    @contextmanager
+    def connection(self):
+        self._slots.acquire()
+        try:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = connect_read_only(self.db_file)
+            try:
+                yield conn
+            except sqlite3.Error:
+                conn.close()  # Conexão possivelmente inconsistente: não volta ao pool
+                raise
+            except BaseException:
+                self._release(conn)
+                raise
+            else:
+                self._release(conn)
+        finally:
+            self._slots.release()
+
+    def _release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+@contextmanager
+def read_connection(db_file):
+    """ Empresta uma conexão somente leitura do pool do arquivo `db_file`. """
+    key = os.path.abspath(db_file)
+    with _registry_lock:
+        pool = _read_pools.get(key)
+        if pool is None:
+            pool = _read_pools[key] = ReadOnlyPool(key)
+    with pool.connection() as conn:
+        yield conn
+
+@contextmanager
+def writer_connection(db_file):
+    """ Empresta a conexão de escrita única do arquivo `db_file`; escritores concorrentes aguardam a vez. """
+    key = os.path.abspath(db_file)
+    with _registry_lock:
+        if key not in _writers:
+            conn = enable_wal(sqlite3.connect(key, check_same_thread=False))
+            _writers[key] = (conn, threading.Lock())
+            logging.info(f"Conexão de escrita aberta em {key} (WAL).")
+        conn, lock = _writers[key]
+    with lock:
+        try:
+            yield conn
+        except BaseException:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+
+def close_database(db_file):
+    """ Fecha as conexões ociosas de leitura e a conexão de escrita de um arquivo (ex.: geração descartada). """
+    key = os.path.abspath(db_file)
+    with _registry_lock:
+        pool = _read_pools.pop(key, None)
+        writer = _writers.pop(key, None)
+    if pool is not None:
+        pool.close()
+    if writer is not None:
+        conn, lock = writer
+        with lock:
+            conn.close()
+
+def close_pools():
+    """ Fecha as conexões ociosas de leitura e as conexões de escrita. """
+    with _registry_lock:
+        for pool in _read_pools.values():
+            pool.close()
+        _read_pools.clear()
+        for conn, lock in _writers.values():
+            with lock:
+                conn.close()
+        _writers.clear()
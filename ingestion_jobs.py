@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+""" Ingestão em segundo plano, com registro de jobs, progresso e cancelamento.
+
+O botão de ingestão do Streamlit só submete um job e a interface passa a consultar o seu progresso,
+sem bloquear a thread do script da sessão. Os jobs rodam em um executor de uma única thread (o banco
+tem um único escritor) e ficam registrados no processo, então uma sessão nova (ex.: após recarregar a
+página) encontra o job em andamento por `active_job`. A carga é feita em um banco-sombra (ver
+`data_ingestion.ingest_new_generation`): o chat continua consultando a geração publicada até a troca
+atômica do ponteiro no fim do job.
+"""
+import os
+import time
+import uuid
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from data_ingestion import ingest_new_generation, estimate_row_count, IngestionCancelled
+
+# Configuração básica de logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+MAX_FINISHED_JOBS = 20  # Jobs encerrados mantidos no registro para consulta
+
+# Estados de um job
+QUEUED, RUNNING, SUCCEEDED, FAILED, CANCELLED = "na_fila", "executando", "concluida", "falhou", "cancelada"
+FINISHED_STATES = (SUCCEEDED, FAILED, CANCELLED)
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ingestao")
+_jobs = {}  # id -> IngestionJob, em ordem de submissão
+_jobs_lock = threading.Lock()
+
+def _as_list(csvs):
+    return list(csvs) if isinstance(csvs, (list, tuple)) else [csvs]
+
+class IngestionJob:
+    """ Estado de uma ingestão em segundo plano. Atualizado pela thread do job e lido pela interface. """
+
+    def __init__(self, cabecalho_path, itens_path, options, cleanup_paths, on_success):
+        self.id = uuid.uuid4().hex[:8]
+        self.cabecalho_path = cabecalho_path
+        self.itens_path = itens_path
+        self.options = options
+        self.cleanup_paths = cleanup_paths
+        self.on_success = on_success
+        self.status = QUEUED
+        self.stage = None
+        self.error = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        # tabela -> {"lidas", "inseridas", "estimadas"}, somando todos os CSVs da tabela
+        self.tables = {
+            table: {"lidas": 0, "inseridas": 0, "estimadas": sum(estimate_row_count(csv) for csv in _as_list(csvs))}
+            for table, csvs in (("cabecalho", cabecalho_path), ("itens", itens_path))
+        }
+        self._cancel = threading.Event()
+
+    def cancel(self):
+        """ Pede o cancelamento; a ingestão para no próximo bloco e o banco-sombra é descartado. """
+        self._cancel.set()
+
+    @property
+    def cancel_requested(self):
+        return self._cancel.is_set()
+
+    def _progress(self, stage, rows_parsed, rows_inserted):
+        """ Callback de progresso de `ingest_data`, executado na thread do job. """
+        if self._cancel.is_set():
+            raise IngestionCancelled(f"Ingestão {self.id} cancelada pelo usuário.")
+        self.stage = stage
+        if stage in self.tables:
+            counts = self.tables[stage]
+            counts["lidas"], counts["inseridas"] = rows_parsed, rows_inserted
+            # A estimativa pelo tamanho do arquivo pode ficar abaixo do real
+            counts["estimadas"] = max(counts["estimadas"], rows_parsed)
+
+    def fraction_done(self):
+        """ Fração concluída, pelas linhas inseridas sobre as estimadas (a finalização conta como 95%). """
+        if self.status == SUCCEEDED:
+            return 1.0
+        if self.stage == "finalizacao":
+            return 0.95
+        inserted = sum(counts["inseridas"] for counts in self.tables.values())
+        estimated = sum(counts["estimadas"] for counts in self.tables.values())
+        return min(0.95 * inserted / estimated, 0.95) if estimated else 0.0
+
+    def eta_seconds(self):
+        """ Tempo restante estimado pela taxa observada até agora (None se ainda não há como estimar). """
+        if self.status != RUNNING or self.started is None:
+            return None
+        fraction = self.fraction_done()
+        if fraction <= 0:
+            return None
+        elapsed = time.time() - self.started
+        return elapsed * (1 - fraction) / fraction
+
+    def to_dict(self):
+        return {
+            "id": self.id, "status": self.status, "etapa": self.stage, "erro": self.error,
+            "tabelas": {table: dict(counts) for table, counts in self.tables.items()},
+            "fracao": self.fraction_done(), "eta_s": self.eta_seconds(),
+        }
+
+    def _run(self):
+        if self._cancel.is_set():
+            self.status, self.finished = CANCELLED, time.time()
+            self._cleanup()
+            return
+        self.status, self.started = RUNNING, time.time()
+        logging.info(f"Job de ingestão {self.id} iniciado.")
+        try:
+            success = ingest_new_generation(
+                self.cabecalho_path, self.itens_path, progress=self._progress, **self.options
+            )
+            if success:
+                self.status = SUCCEEDED
+                if self.on_success is not None:
+                    self.on_success()
+            else:
+                self.status, self.error = FAILED, "Falha na ingestão dos dados. Verifique os logs."
+        except IngestionCancelled:
+            self.status = CANCELLED
+        except Exception as e:
+            logging.error(f"Erro excepcional no job de ingestão {self.id}: {e}", exc_info=True)
+            self.status, self.error = FAILED, str(e)
+        finally:
+            self.finished = time.time()
+            self._cleanup()
+        logging.info(f"Job de ingestão {self.id} encerrado: {self.status} em {self.finished - self.started:.1f}s.")
+
+    def _cleanup(self):
+        """ Remove os arquivos temporários do upload, que pertencem ao job depois da submissão. """
+        for path in self.cleanup_paths:
+            try:
+                if path and os.path.exists(path):
+                    os.remove(path)
+            except OSError as e:
+                logging.error(f"Erro ao limpar {path}: {e}")
+
+def _prune_finished():
+    finished = [job_id for job_id, job in _jobs.items() if job.status in FINISHED_STATES]
+    for job_id in finished[:-MAX_FINISHED_JOBS]:
+        del _jobs[job_id]
+
+def submit_ingestion(cabecalho_path, itens_path, cleanup_paths=(), on_success=None, **options):
+    """ Enfileira a ingestão e retorna o job. Cabeçalho e itens são caminhos, `CsvSource`s ou listas
+    deles (ver `ingest_data`); `options` são repassadas a `ingest_new_generation`. Os arquivos de
+    `cleanup_paths` são removidos ao final. """
+    job = IngestionJob(cabecalho_path, itens_path, options, list(cleanup_paths), on_success)
+    with _jobs_lock:
+        _prune_finished()
+        _jobs[job.id] = job
+    _executor.submit(job._run)
+    logging.info(f"Job de ingestão {job.id} enfileirado: {cabecalho_path}, {itens_path}")
+    return job
+
+def get_job(job_id):
+    with _jobs_lock:
+        return _jobs.get(job_id)
+
+def active_job():
+    """ Job na fila ou em execução mais recente, se houver. """
+    with _jobs_lock:
+        for job in reversed(list(_jobs.values())):
+            if job.status not in FINISHED_STATES:
+                return job
+    return None
+
+def cancel_job(job_id):
+    """ Pede o cancelamento do job. Retorna False se ele não existe ou já terminou. """
+    job = get_job(job_id)
+    if job is None or job.status in FINISHED_STATES:
+        return False
+    job.cancel()
+    return True
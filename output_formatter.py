@@ -1,7 +1,10 @@
 # -*- coding: utf-8 -*-
 import pandas as pd
+import numpy as np
 import logging
 import re
+from functools import lru_cache
+from itertools import islice
 
 # Configuração básica de logging
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
@@ -20,7 +23,7 @@ def format_brazilian_currency(value):
         num = float(value)
         formatted = f"{num:_.2f}".replace(".", "#").replace("_", ".").replace("#", ",")
         return f"R$ {formatted}"
-    except: return str(value)
+    except (TypeError, ValueError): return str(value)
 
 def format_brazilian_number(value):
     if pd.isna(value): return ""
@@ -29,40 +32,179 @@ def format_brazilian_number(value):
             return f"{int(value):_}".replace("_", ".")
         else:
             return f"{float(value):_.2f}".replace(".", "#").replace("_", ".").replace("#", ",")
-    except: return str(value)
+    except (TypeError, ValueError, OverflowError): return str(value)
+
+# Maior valor absoluto formatado pela aritmética inteira (precisão do float em centavos); acima disso usa o escalar
+_MAX_VECTORIZED_ABS = 1e12
+_THOUSAND_GROUPS = 4  # Grupos de 3 dígitos cobertos por _MAX_VECTORIZED_ABS
+
+def _layout(decimals):
+    """ Posições fixas de ' -DDD.DDD.DDD.DDD,dd': coluna do sinal, dígitos inteiros, pontos, vírgula e casas. """
+    integer_digits = 3 * _THOUSAND_GROUPS
+    digit_columns, column = [], 1  # Coluna 0: sinal
+    for digit in range(integer_digits):
+        if digit and digit % 3 == 0:
+            column += 1  # Ponto de milhar
+        digit_columns.append(column)
+        column += 1
+    dot_columns = [digit_columns[digit] - 1 for digit in range(3, integer_digits, 3)]
+    comma_column = column
+    fraction_columns = list(range(column + 1, column + 1 + decimals)) if decimals else []
+    return digit_columns, dot_columns, comma_column, fraction_columns
+
+def _scalar_number_like(values):
+    """ Máscara das células que as funções escalares tratam como número (int/float do Python ou do numpy).
+
+    Textos, bool, Decimal e outros objetos ficam de fora e seguem o caminho escalar, que é a referência.
+    """
+    return np.fromiter(
+        (isinstance(v, (int, float, np.number)) and not isinstance(v, (bool, np.bool_)) for v in values),
+        dtype=bool, count=len(values),
+    )
+
+def _format_brazilian_array(values, decimals, prefix, drop_integral_decimals=None):
+    """ Formata uma coluna inteira com separadores brasileiros usando operações do numpy.
+
+    Os números viram inteiros em unidades de 10^-decimals e seus dígitos são escritos numa matriz de
+    bytes de largura fixa (' -DDD.DDD.DDD.DDD,dd'); o que fica antes do primeiro dígito
+    significativo vira espaço e é removido no fim. NaN/None resultam em texto vazio.
+    `drop_integral_decimals` (máscara booleana) indica as células cujas casas decimais somem se forem inteiras.
+    O resultado é idêntico ao das funções escalares: perto de um empate de meio centavo, onde o produto
+    em float pode arredondar diferente do valor exato, os centavos vêm do mesmo f-string do escalar;
+    células fora da faixa vetorizada ou que não são números passam pela função escalar.
+    """
+    if isinstance(values, pd.Series):
+        original = values
+    else:
+        original = pd.Series(values if isinstance(values, np.ndarray) else np.asarray(values, dtype=object))
+    numbers = pd.to_numeric(original, errors="coerce").to_numpy(dtype=float, na_value=np.nan)
+    finite = np.isfinite(numbers)
+    magnitudes = np.abs(np.where(finite, numbers, 0))
+
+    scale = 10 ** decimals
+    products = magnitudes * scale
+    near_tie = np.abs(products - np.floor(products) - 0.5) <= 4 * np.spacing(products)
+    vectorized = finite & (magnitudes < _MAX_VECTORIZED_ABS)
+    if original.dtype == object:
+        vectorized &= _scalar_number_like(original)
+    scaled = np.round(np.where(vectorized, products, 0)).astype(np.int64)
+    ties = np.flatnonzero(vectorized & near_tie)
+    if len(ties):
+        # O f-string arredonda o valor binário exato, como a função escalar
+        scaled[ties] = [int(f"{m:.{decimals}f}".replace(".", "")) for m in magnitudes[ties]]
+    integer_part, fraction_part = np.divmod(scaled, scale)
+    digit_columns, dot_columns, comma_column, fraction_columns = _layout(decimals)
+
+    chars = np.full((len(numbers), comma_column + 1 + decimals if decimals else comma_column), ord(" "), dtype=np.uint8)
+    powers = 10 ** np.arange(len(digit_columns) - 1, -1, -1, dtype=np.int64)
+    digits = (integer_part[:, None] // powers) % 10
+    # Primeiro dígito significativo pela quantidade de dígitos (o zero mostra um dígito)
+    n_digits = np.maximum(np.searchsorted(powers[::-1], integer_part, side="right"), 1)
+    first_digit = len(digit_columns) - n_digits
+    digit_index = np.arange(len(digit_columns))
+    chars[:, digit_columns] = np.where(digit_index >= first_digit[:, None], digits + ord("0"), ord(" "))
+    for dot, next_digit in zip(dot_columns, range(3, len(digit_columns), 3)):
+        chars[:, dot] = np.where(first_digit < next_digit, ord("."), ord(" "))
+    # Como no f-string, o sinal aparece mesmo quando o valor arredonda para zero ('-0,00')
+    negative = np.signbit(numbers)
+    dropped = np.zeros(len(numbers), dtype=bool)
+    if decimals and drop_integral_decimals is not None:
+        dropped = drop_integral_decimals & (numbers == np.floor(numbers))
+        negative = np.where(dropped, numbers < 0, negative)  # Inteiro sem casas: -0.0 vira '0'
+    negative &= vectorized
+    sign_column = np.asarray(digit_columns)[first_digit] - 1
+    chars[np.flatnonzero(negative), sign_column[negative]] = ord("-")
+    if decimals:
+        chars[:, comma_column] = ord(",")
+        chars[:, fraction_columns] = (fraction_part[:, None] // 10 ** np.arange(decimals - 1, -1, -1)) % 10 + ord("0")
+        chars[dropped, comma_column:] = ord(" ")
+
+    text = np.char.strip(chars.view(f"S{chars.shape[1]}").ravel().astype(str))
+    if prefix:
+        text = np.char.add(prefix, text)
+    result = np.where(vectorized, text.astype(object), "")
+    # Valores enormes ou infinitos e textos: caminho escalar, com as células como o chamador as itera
+    scalar = format_brazilian_currency if prefix else format_brazilian_number
+    cells = values if isinstance(values, np.ndarray) else original.to_numpy(dtype=object)
+    for i in np.flatnonzero(~vectorized & ~original.isna().to_numpy()):
+        result[i] = scalar(cells[i])
+    if isinstance(values, pd.Series):
+        return pd.Series(result, index=values.index, name=values.name, dtype=object)
+    return result
+
+def format_brazilian_currency_column(values):
+    """ Versão vetorizada de format_brazilian_currency para uma Series/array inteira ('R$ 1.234,56'). """
+    return _format_brazilian_array(values, 2, "R$ ")
+
+def format_brazilian_number_column(values):
+    """ Versão vetorizada de format_brazilian_number: inteiros sem casas decimais, demais com 2 casas. """
+    dtype = getattr(values, "dtype", None)
+    if dtype is not None and dtype != object:
+        # Coluna tipada: todas as células chegam ao escalar com o mesmo tipo (int/float do Python ao
+        # iterar uma Series; escalares do numpy ao iterar um array, e np.int64 não é int)
+        sample = next(iter(values.dropna() if isinstance(values, pd.Series) else values), None)
+        numeric = isinstance(sample, (int, float))
+    else:
+        # Como no escalar, só int/float (não textos numéricos nem np.int64) perdem as casas quando inteiros
+        numeric = np.fromiter((isinstance(v, (int, float)) for v in values), dtype=bool, count=len(values))
+    return _format_brazilian_array(values, 2, "", drop_integral_decimals=numeric)
+
+# Números com 2 casas decimais entre espaços (ou início/fim): grupo 1 no formato brasileiro (1.234,56),
+# grupo 2 com ponto decimal (1234.56). Um único padrão compilado uma vez cobre os dois em uma passada.
+_CURRENCY_IN_TEXT = re.compile(r"(?<!\S)(?:(\d+(?:\.\d+)*,\d{2})|(\d+\.\d{2}))(?!\S)")
+# Tabela Markdown: linha de separador (|---|---| ou |:---|:---:|) ou várias linhas entre barras
+_MARKDOWN_TABLE_SEPARATOR = re.compile(r"\|.*\|.*\|\n\| *[:-]-+[:-]? *\|.*\|")
+_MARKDOWN_TABLE_ROW = re.compile(r"^\|.*\|$", re.MULTILINE)
+FORMAT_CACHE_SIZE = 1024  # Textos já formatados mantidos em memória (respostas e histórico)
+FORMAT_CURRENCY_IN_TEXT = False  # Reescrever valores do texto conversacional como moeda (R$)
 
 def _format_matched_number_as_currency(match):
-    number_str = match.group(1).replace(".", "").replace(",", ".")
+    brazilian, dotted = match.groups()
+    number_str = brazilian.replace(".", "").replace(",", ".") if brazilian is not None else dotted
     try: return format_brazilian_currency(float(number_str))
-    except: return match.group(0)
+    except (TypeError, ValueError): return match.group(0)
+
+@lru_cache(maxsize=FORMAT_CACHE_SIZE)
+def _format_currency_in_str(text):
+    return _CURRENCY_IN_TEXT.sub(_format_matched_number_as_currency, text)
 
 def format_currency_in_text(text):
+    """ Reescreve como moeda os números com 2 casas do texto, em uma única passada e com memoização. """
     if not isinstance(text, str): return text
-    # Regex simplificado para evitar complexidade e erros
-    # Apenas números com 2 casas decimais precedidos por espaço ou início de linha
-    pattern = r"(?<=\s|^)(\d+(?:\.\d+)*,\d{2})(?=\s|$)"
-    pattern_dot = r"(?<=\s|^)(\d+\.\d{2})(?=\s|$)" # Formato 123.45
-    try:
-        formatted_text = re.sub(pattern, _format_matched_number_as_currency, text)
-        formatted_text = re.sub(pattern_dot, _format_matched_number_as_currency, formatted_text)
-        return formatted_text
-    except Exception as e:
-        logging.error(f"Erro na formatação de moeda em texto (regex): {e}")
-        return text
+    return _format_currency_in_str(text)
 # --- Fim Funções de Formatação ---
 
+@lru_cache(maxsize=FORMAT_CACHE_SIZE)
+def _is_markdown_table_str(text):
+    if _MARKDOWN_TABLE_SEPARATOR.search(text):
+        return True
+    # Basta encontrar a segunda linha entre barras
+    return next(islice(_MARKDOWN_TABLE_ROW.finditer(text), 1, None), None) is not None
+
 def is_markdown_table(text: str) -> bool:
     """ Verifica heuristicamente se o texto parece ser uma tabela Markdown. """
     if not isinstance(text, str):
         return False
-    # Procurar por padrões comuns de tabelas Markdown
-    # Linha de separador: |---|---| ou |:---|:---:|
-    if re.search(r"\|.*\|.*\|\n\| *[:-]-+[:-]? *\|.*\|", text):
-        return True
-    # Múltiplas linhas começando e terminando com |
-    if len(re.findall(r"^\|.*\|$", text, re.MULTILINE)) > 1:
-        return True
-    return False
+    return _is_markdown_table_str(text)
+
+def result_dataframe(agent_response):
+    """ DataFrame do resultado estruturado ("data") da resposta do agente, ou None se não houver.
+
+    Os valores continuam numéricos (a formatação brasileira fica para a exibição, ver app.py), para
+    que a tabela ordene por valor e não perca casas decimais. Colunas inteiras com NULL (ANO_EMISSAO,
+    CFOP) viram Int64 em vez de float.
+    """
+    data = agent_response.get("data") if isinstance(agent_response, dict) else None
+    if not data or not data.get("columns"):
+        return None
+    df = pd.DataFrame.from_records(data["rows"], columns=data["columns"])
+    for position, column in enumerate(df.columns):
+        if pd.api.types.is_float_dtype(df[column]) and df[column].notna().any():
+            # O SQLite devolve int para INTEGER e float para REAL: só o pandas converteu para float por causa dos NULLs
+            values = (row[position] for row in data["rows"] if row[position] is not None)
+            if all(isinstance(value, (int, np.integer)) and not isinstance(value, bool) for value in values):
+                df[column] = df[column].astype("Int64")
+    return df
 
 def format_response(agent_response: dict, original_question: str) -> str:
     """ 
@@ -90,6 +232,11 @@ def format_response(agent_response: dict, original_question: str) -> str:
         result_content = agent_response["result"]
         logging.info("Processando conteúdo de \'result\'.")
         
+        # Com o resultado estruturado a tabela é exibida à parte; o texto não precisa ser analisado
+        if isinstance(result_content, str) and agent_response.get("data"):
+            logging.info("Resposta com resultado estruturado. Exibindo o texto; a tabela é renderizada à parte.")
+            return f"**Resposta:**\n\n{result_content}"
+
         # Verificar se o conteúdo é uma string (esperado do agente .run())
         if isinstance(result_content, str):
             # Verificar se a string parece ser uma tabela Markdown
@@ -100,11 +247,9 @@ def format_response(agent_response: dict, original_question: str) -> str:
                 return f"**Resultado da Consulta:**\n\n{result_content}"
             else:
                 logging.info("Resultado identificado como texto conversacional. Exibindo diretamente.")
-                # É texto conversacional, retorna como está.
-                # Nenhuma formatação numérica aplicada aqui para garantir estabilidade
-                # Se quiséssemos tentar formatar moeda no texto, seria aqui:
-                # formatted_text = format_currency_in_text(result_content) # Desativado por padrão
-                # return f"**Resposta:**\n\n{formatted_text}"
+                # É texto conversacional; a reescrita de moeda fica desativada por padrão
+                if FORMAT_CURRENCY_IN_TEXT:
+                    result_content = format_currency_in_text(result_content)
                 return f"**Resposta:**\n\n{result_content}"
         else:
             # Se o resultado não for string (inesperado, mas tratar)
@@ -144,4 +289,17 @@ if __name__ == '__main__':
     print("\nTeste 5: Resposta Inesperada (Dict)")
     print(format_response(unexpected_dict, "Pergunta"))
 
+    # Teste 6: Resultado estruturado
+    structured_resp = {"result": "Dois estados encontrados.", "data": {
+        "columns": ["UF", "TOTAL"], "rows": [("SP", 1234.5), ("RJ", 99.0)], "truncated": False}}
+    print("\nTeste 6: Resultado estruturado")
+    print(format_response(structured_resp, "Total por UF?"))
+    print(result_dataframe(structured_resp))
+
+    # Teste 7: Formatação vetorizada de colunas
+    valores = pd.Series([1234567.891, -0.5, None, 42])
+    print("\nTeste 7: Colunas vetorizadas")
+    print(format_brazilian_currency_column(valores).tolist())
+    print(format_brazilian_number_column(valores).tolist())
+
     print("\n--- Teste Concluído ---")
\ No newline at end of file
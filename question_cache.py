@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+""" Cache persistente de perguntas -> SQL final gerado pelo agente.
+
+Perguntas repetidas (ou com pequenas variações de redação) reaproveitam o SQL já gerado e são
+respondidas com `execute_direct_sql`, sem passar pelo LLM. As entradas valem apenas para a
+impressão digital de conteúdo do banco gravada na ingestão (`metadados_banco`).
+"""
+import sqlite3
+import logging
+import re
+import threading
+import time
+import unicodedata
+
+# Configuração básica de logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+QUESTION_CACHE_FILE = "question_cache.db"
+QUESTION_CACHE_MAX_ENTRIES = 500
+SIMILARITY_THRESHOLD = 0.8  # Similaridade mínima (Jaccard de trigramas) para reaproveitar um SQL
+
+# Palavras que não mudam o sentido da pergunta para fins de cache
+STOPWORDS = {
+    'a', 'o', 'as', 'os', 'de', 'da', 'do', 'das', 'dos', 'e', 'em', 'no', 'na', 'nos', 'nas',
+    'um', 'uma', 'por', 'para', 'pelo', 'pela', 'com', 'qual', 'quais', 'me', 'mostre', 'liste',
+    'listar', 'mostrar', 'informe', 'diga', 'favor', 'ao', 'aos', 'que',
+}
+
+_stats = {"hits_exatos": 0, "hits_similares": 0, "misses": 0, "invalidacoes": 0, "remocoes_lru": 0}
+_stats_lock = threading.Lock()
+
+def _connect():
+    conn = sqlite3.connect(QUESTION_CACHE_FILE)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS cache_perguntas (
+        PERGUNTA_NORMALIZADA TEXT PRIMARY KEY,
+        PERGUNTA TEXT NOT NULL,
+        SQL TEXT NOT NULL,
+        FINGERPRINT TEXT NOT NULL,
+        ULTIMO_ACESSO REAL NOT NULL,
+        ACESSOS INTEGER NOT NULL DEFAULT 0
+    );""")
+    return conn
+
+def _count(stat):
+    with _stats_lock:
+        _stats[stat] += 1
+
+def normalize_question(question):
+    """ Minúsculas, sem acentos, sem pontuação e sem palavras de ligação. """
+    text = unicodedata.normalize('NFKD', question.lower())
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    words = re.findall(r"[a-z0-9]+", text)
+    return ' '.join(word for word in words if word not in STOPWORDS)
+
+def _trigrams(text):
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def question_similarity(normalized_a, normalized_b):
+    """ Similaridade de Jaccard entre os trigramas de caracteres das duas perguntas normalizadas. """
+    trigrams_a, trigrams_b = _trigrams(normalized_a), _trigrams(normalized_b)
+    if not trigrams_a or not trigrams_b:
+        return 0.0
+    return len(trigrams_a & trigrams_b) / len(trigrams_a | trigrams_b)
+
+def _numbers(normalized):
+    """ Números (CNPJs, anos, 'top 5'...) precisam coincidir: mudam o resultado da consulta. """
+    return set(re.findall(r"\d+", normalized))
+
+def lookup_sql(question, fingerprint):
+    """ Busca o SQL de uma pergunta equivalente já respondida para o mesmo conteúdo do banco.
+
+    Tenta primeiro a pergunta normalizada exata e depois a mais similar acima de SIMILARITY_THRESHOLD.
+    Retorna (sql, tipo_de_hit) ou (None, None).
+    """
+    normalized = normalize_question(question)
+    conn = _connect()
+    try:
+        removed = conn.execute("DELETE FROM cache_perguntas WHERE FINGERPRINT != ?", (fingerprint,)).rowcount
+        if removed:
+            logging.info(f"Cache de perguntas: {removed} entradas invalidadas por nova ingestão.")
+            with _stats_lock:
+                _stats["invalidacoes"] += removed
+
+        row = conn.execute(
+            "SELECT PERGUNTA_NORMALIZADA, SQL FROM cache_perguntas WHERE PERGUNTA_NORMALIZADA = ?", (normalized,)
+        ).fetchone()
+        hit_type = "exato"
+        if row is None:
+            hit_type = "similar"
+            numbers = _numbers(normalized)
+            best_score = SIMILARITY_THRESHOLD
+            for candidate, sql in conn.execute("SELECT PERGUNTA_NORMALIZADA, SQL FROM cache_perguntas"):
+                if _numbers(candidate) != numbers:
+                    continue
+                score = question_similarity(normalized, candidate)
+                if score >= best_score:
+                    best_score, row = score, (candidate, sql)
+
+        if row is None:
+            conn.commit()
+            _count("misses")
+            return None, None
+
+        conn.execute(
+            "UPDATE cache_perguntas SET ULTIMO_ACESSO = ?, ACESSOS = ACESSOS + 1 WHERE PERGUNTA_NORMALIZADA = ?",
+            (time.time(), row[0]),
+        )
+        conn.commit()
+        _count("hits_exatos" if hit_type == "exato" else "hits_similares")
+        logging.info(f"Cache de perguntas: hit {hit_type} para '{question}' (pergunta em cache: '{row[0]}').")
+        return row[1], hit_type
+    finally:
+        conn.close()
+
+def store_sql(question, sql, fingerprint):
+    """ Grava o SQL final do agente para a pergunta e aplica a remoção LRU acima do limite. """
+    conn = _connect()
+    try:
+        conn.execute(
+            "INSERT OR REPLACE INTO cache_perguntas "
+            "(PERGUNTA_NORMALIZADA, PERGUNTA, SQL, FINGERPRINT, ULTIMO_ACESSO) VALUES (?, ?, ?, ?, ?)",
+            (normalize_question(question), question, sql, fingerprint, time.time()),
+        )
+        evicted = conn.execute(
+            "DELETE FROM cache_perguntas WHERE PERGUNTA_NORMALIZADA NOT IN "
+            "(SELECT PERGUNTA_NORMALIZADA FROM cache_perguntas ORDER BY ULTIMO_ACESSO DESC LIMIT ?)",
+            (QUESTION_CACHE_MAX_ENTRIES,),
+        ).rowcount
+        conn.commit()
+        if evicted:
+            with _stats_lock:
+                _stats["remocoes_lru"] += evicted
+    finally:
+        conn.close()
+
+def get_cache_stats():
+    """ Contadores do processo e taxa de acerto do cache de perguntas. """
+    with _stats_lock:
+        stats = dict(_stats)
+    lookups = stats["hits_exatos"] + stats["hits_similares"] + stats["misses"]
+    stats["taxa_de_acerto"] = (stats["hits_exatos"] + stats["hits_similares"]) / lookups if lookups else 0.0
+    return stats
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+""" Cache em memória dos resultados de SELECTs executados por `execute_direct_sql`.
+
+As entradas são indexadas pelo SQL canonizado e pela geração do banco (PRAGMA user_version,
+incrementada a cada ingestão), com limite de entradas, de memória estimada e de tempo de vida.
+"""
+import logging
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+# Configuração básica de logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+RESULT_CACHE_MAX_ENTRIES = 256
+RESULT_CACHE_MAX_BYTES = 64 * 1024 * 1024
+RESULT_CACHE_TTL_SECONDS = 600
+SIZE_SAMPLE_ROWS = 100  # Linhas medidas para estimar a memória de resultados grandes
+
+# Literais entre aspas, comentários ou qualquer outro trecho do SQL
+_SQL_TOKEN = re.compile(r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|--[^\n]*|/\*.*?\*/|[^'\"\-/]+|.", re.DOTALL)
+_WRITE_KEYWORDS = re.compile(
+    r"\b(INSERT|UPDATE|DELETE|REPLACE|CREATE|DROP|ALTER|ATTACH|DETACH|PRAGMA|VACUUM|REINDEX|BEGIN|COMMIT)\b",
+    re.IGNORECASE,
+)
+
+def canonicalize_sql(sql):
+    """ Remove comentários, compacta espaços fora de literais e descarta o ';' final. """
+    parts, code = [], []
+    for token in _SQL_TOKEN.findall(sql):
+        if token.startswith('--') or token.startswith('/*'):
+            code.append(' ')
+        elif token[0] in "'\"":
+            parts.append(re.sub(r"\s+", " ", ''.join(code)))
+            parts.append(token)
+            code = []
+        else:
+            code.append(token)
+    parts.append(re.sub(r"\s+", " ", ''.join(code)))
+    return ''.join(parts).strip().rstrip(';').strip()
+
+def is_read_only_select(canonical_sql):
+    """ Apenas um SELECT (ou WITH ... SELECT) sem comandos de escrita fora dos literais. """
+    if not re.match(r"(SELECT|WITH)\b", canonical_sql, re.IGNORECASE):
+        return False
+    code = ''.join(token for token in _SQL_TOKEN.findall(canonical_sql) if token[0] not in "'\"")
+    return ';' not in code and not _WRITE_KEYWORDS.search(code)
+
+def estimate_size(rows):
+    """ Estima os bytes ocupados por uma lista de dicts, medindo uma amostra das linhas. """
+    size = sys.getsizeof(rows)
+    if not rows:
+        return size
+    sample = rows[:SIZE_SAMPLE_ROWS]
+    sample_size = sum(sys.getsizeof(row) + sum(sys.getsizeof(value) for value in row.values()) for row in sample)
+    return size + sample_size * len(rows) // len(sample)
+
+class ResultCache:
+    """ Cache LRU limitado por número de entradas, memória estimada e TTL. Seguro entre threads.
+
+    Os resultados devolvidos são compartilhados entre chamadas e não devem ser modificados.
+    """
+
+    def __init__(self, max_entries=RESULT_CACHE_MAX_ENTRIES, max_bytes=RESULT_CACHE_MAX_BYTES,
+                 ttl_seconds=RESULT_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # chave -> (resultado, bytes, expira_em)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "remocoes_lru": 0, "expiracoes": 0, "rejeitados": 0}
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] < time.monotonic():
+                self._remove(key)
+                self._stats["expiracoes"] += 1
+                entry = None
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return entry[0]
+
+    def put(self, key, result):
+        size = estimate_size(result)
+        with self._lock:
+            # Um único resultado não pode ocupar mais de 1/4 do orçamento
+            if size > self.max_bytes // 4:
+                self._stats["rejeitados"] += 1
+                return False
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (result, size, time.monotonic() + self.ttl_seconds)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self._stats["remocoes_lru"] += 1
+            return True
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats, entradas=len(self._entries), bytes=self._bytes)
+        lookups = stats["hits"] + stats["misses"]
+        stats["taxa_de_acerto"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
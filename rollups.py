@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+""" Tabelas de resumo mensal (rollups) mantidas pela ingestão.
+
+As perguntas mais comuns são agregações por mês de emissão, UF, emitente, destinatário, NCM/CFOP
+ou produto. Os resumos guardam essas agregações já calculadas: a carga completa os reconstrói do
+zero e a incremental recalcula apenas os meses das notas tocadas (ver `track_affected_months`).
+"""
+import logging
+import time
+
+# Configuração básica de logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Mês de emissão 'AAAA-MM', a partir da data ISO gravada pela ingestão
+MONTH_EXPRESSION = "substr(c.DATA_EMISSAO_ISO, 1, 7)"
+# Filtro dos meses afetados pelo índice (ANO_EMISSAO, MES_EMISSAO)
+_AFFECTED_MONTHS_FILTER = (
+    "WHERE (c.ANO_EMISSAO, c.MES_EMISSAO) IN (SELECT CAST(substr(MES, 1, 4) AS INTEGER), "
+    "CAST(substr(MES, 6, 2) AS INTEGER) FROM temp.meses_afetados)"
+)
+# Notas sem data de emissão válida formam o mês NULL dos resumos, que o IN acima nunca alcança
+_NULL_MONTH_FILTER = " OR c.DATA_EMISSAO_ISO IS NULL"
+
+_FROM_CABECALHO = "FROM nfs_cabecalho c"
+_FROM_ITENS = "FROM nfs_itens i JOIN nfs_cabecalho c ON c.CHAVE_DE_ACESSO = i.CHAVE_DE_ACESSO"
+
+# Nome da tabela -> descrição (exibida ao agente), colunas e consulta de agregação.
+# `{mes}` é a expressão do mês e `{filtro}` restringe a reconstrução aos meses afetados.
+ROLLUPS = {
+    "resumo_mensal_uf": {
+        "descricao": "quantidade e valor das notas por mês, UF do emitente e UF do destinatário",
+        "colunas": "MES TEXT, UF_EMITENTE TEXT, UF_DESTINATARIO TEXT, QTD_NOTAS INTEGER, VALOR_TOTAL_NOTAS REAL",
+        "select": (
+            "SELECT {mes}, c.UF_EMITENTE, c.UF_DESTINATARIO, COUNT(*), SUM(c.VALOR_NOTA_FISCAL) "
+            f"{_FROM_CABECALHO} {{filtro}} GROUP BY 1, 2, 3"
+        ),
+    },
+    "resumo_mensal_emitente": {
+        "descricao": "quantidade e valor das notas por mês e emitente (CPF_CNPJ_EMITENTE)",
+        "colunas": (
+            "MES TEXT, CPF_CNPJ_EMITENTE TEXT, RAZAO_SOCIAL_EMITENTE TEXT, UF_EMITENTE TEXT, "
+            "QTD_NOTAS INTEGER, VALOR_TOTAL_NOTAS REAL"
+        ),
+        "select": (
+            "SELECT {mes}, c.CPF_CNPJ_EMITENTE, MAX(c.RAZAO_SOCIAL_EMITENTE), MAX(c.UF_EMITENTE), "
+            f"COUNT(*), SUM(c.VALOR_NOTA_FISCAL) {_FROM_CABECALHO} {{filtro}} GROUP BY 1, 2"
+        ),
+    },
+    "resumo_mensal_destinatario": {
+        "descricao": "quantidade e valor das notas por mês e destinatário (CNPJ_DESTINATARIO)",
+        "colunas": (
+            "MES TEXT, CNPJ_DESTINATARIO TEXT, NOME_DESTINATARIO TEXT, UF_DESTINATARIO TEXT, "
+            "QTD_NOTAS INTEGER, VALOR_TOTAL_NOTAS REAL"
+        ),
+        "select": (
+            "SELECT {mes}, c.CNPJ_DESTINATARIO, MAX(c.NOME_DESTINATARIO), MAX(c.UF_DESTINATARIO), "
+            f"COUNT(*), SUM(c.VALOR_NOTA_FISCAL) {_FROM_CABECALHO} {{filtro}} GROUP BY 1, 2"
+        ),
+    },
+    "resumo_mensal_ncm_cfop": {
+        "descricao": "itens, quantidade e valor dos itens por mês, NCM e CFOP",
+        "colunas": (
+            "MES TEXT, CODIGO_NCM_SH TEXT, NCM_SH_TIPO_PRODUTO TEXT, CFOP INTEGER, "
+            "QTD_ITENS INTEGER, QUANTIDADE_TOTAL REAL, VALOR_TOTAL_ITENS REAL"
+        ),
+        "select": (
+            "SELECT {mes}, i.CODIGO_NCM_SH, MAX(i.NCM_SH_TIPO_PRODUTO), i.CFOP, "
+            f"COUNT(*), SUM(i.QUANTIDADE), SUM(i.VALOR_TOTAL) {_FROM_ITENS} {{filtro}} GROUP BY 1, 2, 4"
+        ),
+    },
+    "resumo_mensal_produto": {
+        "descricao": "itens, quantidade e valor por mês e produto (DESCRICAO_PRODUTO_SERVICO), para rankings de produtos",
+        "colunas": (
+            "MES TEXT, DESCRICAO_PRODUTO_SERVICO TEXT, CODIGO_NCM_SH TEXT, UNIDADE TEXT, "
+            "QTD_ITENS INTEGER, QUANTIDADE_TOTAL REAL, VALOR_TOTAL_ITENS REAL"
+        ),
+        "select": (
+            "SELECT {mes}, i.DESCRICAO_PRODUTO_SERVICO, i.CODIGO_NCM_SH, i.UNIDADE, "
+            f"COUNT(*), SUM(i.QUANTIDADE), SUM(i.VALOR_TOTAL) {_FROM_ITENS} {{filtro}} GROUP BY 1, 2, 3, 4"
+        ),
+    },
+}
+
+def get_rollup_schema():
+    """ Retorna o SQL de criação das tabelas de resumo e de seus índices por mês. """
+    statements = []
+    for table, rollup in ROLLUPS.items():
+        statements.append(f"CREATE TABLE IF NOT EXISTS {table} ({rollup['colunas']});")
+        statements.append(f"CREATE INDEX IF NOT EXISTS idx_{table}_mes ON {table} (MES);")
+    return statements
+
+def describe_rollups():
+    """ Texto com as tabelas de resumo e suas colunas, incluído no contexto do agente SQL. """
+    lines = [
+        "Para totais por mês (coluna MES no formato 'AAAA-MM'), prefira as tabelas de resumo abaixo, "
+        "muito menores que as tabelas de notas:"
+    ]
+    for table, rollup in ROLLUPS.items():
+        columns = ', '.join(column.split()[0] for column in rollup['colunas'].split(', '))
+        lines.append(f"- {table} ({columns}): {rollup['descricao']}.")
+    return '\n'.join(lines)
+
+def prepare_affected_months(conn):
+    """ Cria (vazia) a tabela temporária com os meses a recalcular na ingestão incremental. """
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS meses_afetados (MES TEXT PRIMARY KEY)")
+    conn.execute("DELETE FROM temp.meses_afetados")
+
+def track_affected_months(conn, keys_table):
+    """ Registra os meses de emissão das notas cujas chaves estão na tabela `keys_table` (coluna CHAVE).
+
+    Chamado antes e depois do upsert dos cabeçalhos, para que o mês antigo de uma nota que mudou de
+    data também seja recalculado.
+    """
+    conn.execute(
+        f"INSERT OR IGNORE INTO temp.meses_afetados SELECT DISTINCT {MONTH_EXPRESSION} FROM nfs_cabecalho c "
+        f"WHERE c.CHAVE_DE_ACESSO IN (SELECT CHAVE FROM {keys_table})"
+    )
+
+def rollups_need_full_rebuild(conn):
+    """ Resumos vazios com notas já carregadas (ex.: banco criado antes dos resumos) exigem reconstrução total. """
+    has_notes = conn.execute("SELECT 1 FROM nfs_cabecalho LIMIT 1").fetchone() is not None
+    has_rollups = conn.execute(f"SELECT 1 FROM {next(iter(ROLLUPS))} LIMIT 1").fetchone() is not None
+    return has_notes and not has_rollups
+
+def rebuild_rollups(conn, only_affected_months=False):
+    """ Reconstrói os resumos: todos os meses, ou só os de `temp.meses_afetados`. Não faz commit.
+
+    O mês NULL (notas sem data de emissão válida) é tratado à parte, já que `MES IN (...)` não casa NULL.
+    """
+    started = time.perf_counter()
+    month_filter = delete_filter = ""
+    if only_affected_months:
+        months = conn.execute("SELECT COUNT(*) FROM temp.meses_afetados").fetchone()[0]
+        if not months:
+            logging.info("Nenhum mês afetado; resumos mantidos.")
+            return
+        month_filter = _AFFECTED_MONTHS_FILTER
+        delete_filter = "WHERE MES IN (SELECT MES FROM temp.meses_afetados)"
+        if conn.execute("SELECT 1 FROM temp.meses_afetados WHERE MES IS NULL LIMIT 1").fetchone():
+            month_filter += _NULL_MONTH_FILTER
+            delete_filter += " OR MES IS NULL"
+
+    for table, rollup in ROLLUPS.items():
+        if only_affected_months:
+            conn.execute(f"DELETE FROM {table} {delete_filter}")
+        else:
+            conn.execute(f"DELETE FROM {table}")
+        conn.execute(f"INSERT INTO {table} " + rollup["select"].format(mes=MONTH_EXPRESSION, filtro=month_filter))
+
+    scope = "meses afetados" if only_affected_months else "todos os meses"
+    logging.info(f"Tabelas de resumo reconstruídas ({scope}) em {time.perf_counter() - started:.2f}s.")
@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+""" Gerador de NF-e sintéticas no formato dos arquivos *_NFs_Cabecalho.csv / *_NFs_Itens.csv.
+
+Os arquivos usam exatamente os cabeçalhos de `get_ingestion_instructions` e imitam os dados reais:
+chaves de acesso de 44 dígitos com dígito verificador, CNPJs válidos, emitentes, destinatários,
+produtos e NCMs com frequências em lei de potência (poucos concentram a maior parte das notas),
+operações internas e interestaduais com o CFOP correspondente e valor da nota igual à soma dos itens.
+Com separador ';' os números saem com vírgula decimal, como nos arquivos do Portal da Transparência.
+A geração é determinística para a mesma semente, então benchmarks repetidos usam os mesmos dados.
+
+Uso:
+    python synthetic_data.py --notas 100000 --separador ';' --prefixo 202401 --destino dados/
+"""
+import argparse
+import calendar
+import csv
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+
+from data_ingestion import get_ingestion_instructions
+
+try:
+    import pyarrow as pa  # Opcional: escrita dos CSVs dezenas de vezes mais rápida que o to_csv
+    import pyarrow.csv as pa_csv
+except ImportError:
+    pa = None
+    pa_csv = None
+
+# Configuração básica de logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+SEED = 42
+N_EMITENTES = 2_000
+N_DESTINATARIOS = 20_000
+N_PRODUTOS = 5_000
+N_NCMS = 1_500
+# Concentração das frequências (1.0 ~ lei de Zipf clássica): emitentes mais concentrados que produtos
+ZIPF_EXPONENTS = {'emitente': 1.0, 'destinatario': 0.9, 'produto': 0.8, 'ncm': 0.8}
+
+# Participação aproximada das UFs nas notas emitidas, com o código IBGE usado na chave de acesso
+UFS = {
+    'SP': (35, 0.30), 'MG': (31, 0.10), 'PR': (41, 0.08), 'RS': (43, 0.08), 'SC': (42, 0.07),
+    'RJ': (33, 0.07), 'GO': (52, 0.05), 'BA': (29, 0.05), 'PE': (26, 0.04), 'ES': (32, 0.04),
+    'CE': (23, 0.03), 'MT': (51, 0.03), 'MS': (50, 0.02), 'PA': (15, 0.02), 'AM': (13, 0.02),
+}
+# Capítulos NCM mais comuns e a descrição gravada em NCM/SH (TIPO DE PRODUTO)
+NCM_CHAPTERS = {
+    '02': 'CARNES E MIUDEZAS, COMESTÍVEIS', '04': 'LEITE E LATICÍNIOS', '10': 'CEREAIS',
+    '19': 'PREPARAÇÕES À BASE DE CEREAIS', '22': 'BEBIDAS, LÍQUIDOS ALCOÓLICOS E VINAGRES',
+    '27': 'COMBUSTÍVEIS MINERAIS, ÓLEOS MINERAIS', '30': 'PRODUTOS FARMACÊUTICOS',
+    '33': 'ÓLEOS ESSENCIAIS, PERFUMARIA E COSMÉTICOS', '39': 'PLÁSTICOS E SUAS OBRAS',
+    '48': 'PAPEL E CARTÃO', '61': 'VESTUÁRIO DE MALHA', '73': 'OBRAS DE FERRO FUNDIDO, FERRO OU AÇO',
+    '84': 'REATORES NUCLEARES, CALDEIRAS, MÁQUINAS', '85': 'MÁQUINAS E APARELHOS ELÉTRICOS',
+    '87': 'VEÍCULOS AUTOMÓVEIS, TRATORES E PARTES', '94': 'MÓVEIS, MOBILIÁRIO MÉDICO-CIRÚRGICO',
+}
+UNITS = np.array(['UN', 'UN', 'UN', 'CX', 'KG', 'LT', 'PC'])
+# Evento mais recente: (descrição, probabilidade)
+EVENTS = (('Autorização de Uso', 0.93), ('Carta de Correção', 0.05), ('Cancelamento da NF-e', 0.02))
+NATURES = np.array(['VENDA DE MERCADORIA', 'VENDA DE PRODUÇÃO DO ESTABELECIMENTO', 'REMESSA PARA INDUSTRIALIZAÇÃO',
+                    'DEVOLUÇÃO DE COMPRA', 'TRANSFERÊNCIA ENTRE FILIAIS'])
+
+def _zipf_weights(n, exponent):
+    weights = 1.0 / np.arange(1, n + 1) ** exponent
+    return weights / weights.sum()
+
+def _format_decimal(values, decimal):
+    """ Texto com 2 casas decimais a partir dos centavos inteiros (bem mais rápido que o float_format do to_csv). """
+    cents = np.round(np.asarray(values) * 100).astype(np.int64)
+    return pd.Series(cents // 100).astype(str) + decimal + pd.Series(cents % 100).astype(str).str.zfill(2)
+
+def _digits(strings, width):
+    """ Matriz (n, width) com os dígitos de um array de strings numéricas de mesmo tamanho. """
+    return np.frombuffer(np.asarray(strings, dtype=f'S{width}').tobytes(), dtype=np.uint8).reshape(-1, width) - 48
+
+def _mod11_digit(digits, weights):
+    remainder = (digits * np.asarray(weights)).sum(axis=1) % 11
+    return np.where(remainder < 2, 0, 11 - remainder)
+
+def _cnpjs(roots):
+    """ CNPJs (matriz 0001) com os dois dígitos verificadores, a partir das raízes de 8 dígitos. """
+    base = np.char.add(np.char.zfill(roots.astype(str), 8), '0001')
+    first = _mod11_digit(_digits(base, 12), [5, 4, 3, 2, 9, 8, 7, 6, 5, 4, 3, 2])
+    base = np.char.add(base, first.astype(str))
+    second = _mod11_digit(_digits(base, 13), [6, 5, 4, 3, 2, 9, 8, 7, 6, 5, 4, 3, 2])
+    return np.char.add(base, second.astype(str))
+
+def emitente_cnpj(rank):
+    """ CNPJ do emitente na posição `rank` da frequência (0 = o que mais emite notas). """
+    return str(_cnpjs(np.array([10_000_000 + rank * 4_999]))[0])
+
+def destinatario_cnpj(rank):
+    """ CNPJ do destinatário na posição `rank` da frequência (0 = o que mais recebe notas). """
+    return str(_cnpjs(np.array([50_000_000 + rank * 97]))[0])
+
+def ncm_codes():
+    """ Códigos NCM de 8 dígitos em ordem de frequência. Independem da semente dos dados. """
+    rng = np.random.default_rng(SEED)
+    chapters = np.array(list(NCM_CHAPTERS))
+    codes = np.char.add(rng.choice(chapters, size=N_NCMS * 2), np.char.zfill(rng.integers(0, 10**6, N_NCMS * 2).astype(str), 6))
+    _, first_index = np.unique(codes, return_index=True)
+    return codes[np.sort(first_index)][:N_NCMS]
+
+def _entities(n, root_start, root_step, name_prefix, rng):
+    uf_names = np.array(list(UFS))
+    uf_weights = np.array([weight for _, weight in UFS.values()])
+    return pd.DataFrame({
+        'cnpj': _cnpjs(root_start + np.arange(n) * root_step),
+        'nome': [f"{name_prefix} {i + 1:05d} LTDA" for i in range(n)],
+        'uf': rng.choice(uf_names, size=n, p=uf_weights / uf_weights.sum()),
+        'ie': np.char.zfill(rng.integers(10**8, 10**12, n).astype(str), 12),
+    })
+
+def _access_keys(uf_codes, year, month, cnpjs, series, numbers, rng):
+    """ Chaves de acesso de 44 dígitos (cUF, AAMM, CNPJ, modelo 55, série, número, tpEmis, cNF, DV). """
+    keys = pd.Series(uf_codes.astype(str)) + f"{year % 100:02d}{month:02d}" + pd.Series(cnpjs) + "55" \
+        + pd.Series(series).astype(str).str.zfill(3) + pd.Series(numbers).astype(str).str.zfill(9) + "1" \
+        + pd.Series(rng.integers(0, 10**8, len(numbers))).astype(str).str.zfill(8)
+    weights = np.resize([4, 3, 2, 9, 8, 7, 6, 5], 43)  # Pesos 2..9 da direita para a esquerda
+    return (keys + _mod11_digit(_digits(keys.to_numpy(), 43), weights).astype(str)).to_numpy()
+
+def _write_csv(df, path, sep, encoding):
+    """ Grava o DataFrame (só texto) com todos os campos entre aspas, como nos arquivos do Portal. """
+    if pa_csv is not None and encoding.replace('-', '').lower() == 'utf8':
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        pa_csv.write_csv(table, path, pa_csv.WriteOptions(delimiter=sep, quoting_style='all_valid'))
+    else:
+        df.to_csv(path, sep=sep, index=False, encoding=encoding, quoting=csv.QUOTE_ALL)
+
+def generate_synthetic_csvs(directory, n_notas, itens_por_nota=3, sep=',', prefix='202401', seed=SEED,
+                            encoding='utf-8'):
+    """ Gera um par {prefix}_NFs_Cabecalho.csv / {prefix}_NFs_Itens.csv sintético. Retorna os caminhos.
+
+    `prefix` (AAAAMM) define o mês de emissão. Cada nota tem `itens_por_nota` itens, o que mantém o
+    total de linhas previsível para os benchmarks.
+    """
+    rng = np.random.default_rng(seed)
+    entity_rng = np.random.default_rng(SEED)  # Cadastros estáveis entre meses e sementes
+    year, month = int(prefix[:4]), int(prefix[4:6])
+    emitentes = _entities(N_EMITENTES, 10_000_000, 4_999, "EMITENTE", entity_rng)
+    destinatarios = _entities(N_DESTINATARIOS, 50_000_000, 97, "DESTINATARIO", entity_rng)
+    ncms = ncm_codes()
+    product_ncm = ncms[entity_rng.choice(N_NCMS, size=N_PRODUTOS, p=_zipf_weights(N_NCMS, ZIPF_EXPONENTS['ncm']))]
+    product_unit = entity_rng.choice(UNITS, size=N_PRODUTOS)
+    product_price = np.round(entity_rng.lognormal(mean=3.5, sigma=1.2, size=N_PRODUTOS), 2)
+
+    # Cabeçalhos
+    emitter = emitentes.iloc[rng.choice(N_EMITENTES, size=n_notas, p=_zipf_weights(N_EMITENTES, ZIPF_EXPONENTS['emitente']))].reset_index(drop=True)
+    recipient = destinatarios.iloc[rng.choice(N_DESTINATARIOS, size=n_notas, p=_zipf_weights(N_DESTINATARIOS, ZIPF_EXPONENTS['destinatario']))].reset_index(drop=True)
+    interstate = (emitter['uf'] != recipient['uf']).to_numpy()
+    series = rng.integers(1, 4, n_notas)
+    numbers = np.arange(1, n_notas + 1)
+    days = calendar.monthrange(year, month)[1]
+    emission = pd.Timestamp(year=year, month=month, day=1) + pd.to_timedelta(rng.integers(0, days * 86_400, n_notas), unit='s')
+    event_names = np.array([name for name, _ in EVENTS])
+    event = rng.choice(event_names, size=n_notas, p=[p for _, p in EVENTS])
+    event_delay = np.where(event == EVENTS[0][0], rng.integers(1, 600, n_notas), rng.integers(3_600, 5 * 86_400, n_notas))
+    event_time = emission + pd.to_timedelta(event_delay, unit='s')
+    uf_codes = emitter['uf'].map({uf: code for uf, (code, _) in UFS.items()}).to_numpy()
+    keys = _access_keys(uf_codes, year, month, emitter['cnpj'].to_numpy(), series, numbers, rng)
+
+    # Itens: produtos em lei de potência, quantidade e preço com variação em torno do preço de tabela
+    n_itens = n_notas * itens_por_nota
+    product = rng.choice(N_PRODUTOS, size=n_itens, p=_zipf_weights(N_PRODUTOS, ZIPF_EXPONENTS['produto']))
+    quantity = np.where(product_unit[product] == 'KG', np.round(rng.lognormal(2, 1, n_itens), 2),
+                        rng.geometric(0.15, n_itens)).astype(float)
+    unit_price = np.round(product_price[product] * rng.uniform(0.9, 1.1, n_itens), 2)
+    total = np.round(quantity * unit_price, 2)
+    cfop = np.repeat(np.where(interstate, 6102, 5102), itens_por_nota)
+    cfop = np.where(rng.random(n_itens) < 0.15, cfop + 303, cfop)  # 5405/6405: substituição tributária
+
+    mapping = get_ingestion_instructions()
+    decimal = ',' if sep == ';' else '.'
+    date_format = '%d/%m/%Y %H:%M:%S'
+    cabecalho = pd.DataFrame({
+        'CHAVE DE ACESSO': keys,
+        'MODELO': '55 - NF-E EMITIDA EM SUBSTITUIÇÃO AO MODELO 1 OU 1A',
+        'SÉRIE': series,
+        'NÚMERO': numbers,
+        'NATUREZA DA OPERAÇÃO': rng.choice(NATURES, size=n_notas, p=[0.7, 0.12, 0.06, 0.06, 0.06]),
+        'DATA EMISSÃO': emission.strftime(date_format),
+        'EVENTO MAIS RECENTE': event,
+        'DATA/HORA EVENTO MAIS RECENTE': event_time.strftime(date_format),
+        'CPF/CNPJ Emitente': emitter['cnpj'],
+        'RAZÃO SOCIAL EMITENTE': emitter['nome'],
+        'INSCRIÇÃO ESTADUAL EMITENTE': emitter['ie'],
+        'UF EMITENTE': emitter['uf'],
+        'MUNICÍPIO EMITENTE': 'MUNICIPIO ' + emitter['uf'],
+        'CNPJ DESTINATÁRIO': recipient['cnpj'],
+        'NOME DESTINATÁRIO': recipient['nome'],
+        'UF DESTINATÁRIO': recipient['uf'],
+        'INDICADOR IE DESTINATÁRIO': '1 - CONTRIBUINTE ICMS',
+        'DESTINO DA OPERAÇÃO': np.where(interstate, '2 - OPERAÇÃO INTERESTADUAL', '1 - OPERAÇÃO INTERNA'),
+        'CONSUMIDOR FINAL': rng.choice(['0 - NORMAL', '1 - CONSUMIDOR FINAL'], size=n_notas, p=[0.8, 0.2]),
+        'PRESENÇA DO COMPRADOR': '1 - OPERAÇÃO PRESENCIAL',
+        'VALOR NOTA FISCAL': _format_decimal(total.reshape(n_notas, itens_por_nota).sum(axis=1), decimal),
+    })
+    itens = pd.DataFrame({
+        'CHAVE DE ACESSO': np.repeat(keys, itens_por_nota),
+        'NÚMERO PRODUTO': np.tile(np.arange(1, itens_por_nota + 1), n_notas),
+        'DESCRIÇÃO DO PRODUTO/SERVIÇO': np.char.add('PRODUTO ', np.char.zfill((product + 1).astype(str), 5)),
+        'CÓDIGO NCM/SH': product_ncm[product],
+        'NCM/SH (TIPO DE PRODUTO)': pd.Series(product_ncm[product]).str[:2].map(NCM_CHAPTERS),
+        'CFOP': cfop,
+        'QUANTIDADE': _format_decimal(quantity, decimal),
+        'UNIDADE': product_unit[product],
+        'VALOR UNITÁRIO': _format_decimal(unit_price, decimal),
+        'VALOR TOTAL': _format_decimal(total, decimal),
+    })
+
+    os.makedirs(directory, exist_ok=True)
+    cabecalho_path = os.path.join(directory, f"{prefix}_NFs_Cabecalho.csv")
+    itens_path = os.path.join(directory, f"{prefix}_NFs_Itens.csv")
+    for df, path, columns in ((cabecalho, cabecalho_path, mapping["cabecalho"]), (itens, itens_path, mapping["itens"])):
+        _write_csv(df[list(columns)].astype(str), path, sep, encoding)
+    logging.info(f"NF-e sintéticas geradas: {n_notas} notas e {n_itens} itens em {cabecalho_path} / {itens_path}")
+    return cabecalho_path, itens_path
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Gera arquivos CSV sintéticos de NF-e.")
+    parser.add_argument("--notas", type=int, default=100_000)
+    parser.add_argument("--itens-por-nota", type=int, default=3)
+    parser.add_argument("--separador", default=',', choices=[',', ';'])
+    parser.add_argument("--prefixo", default='202401', help="Mês de emissão no formato AAAAMM.")
+    parser.add_argument("--semente", type=int, default=SEED)
+    parser.add_argument("--destino", default='.')
+    args = parser.parse_args()
+    generate_synthetic_csvs(args.destino, args.notas, args.itens_por_nota, args.separador, args.prefixo, args.semente)
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+""" Pool de agentes SQL com um chat falso local: reaproveitamento entre perguntas e recriação por geração. """
+import sqlite3
+
+import pytest
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+
+import data_ingestion
+import database_agent
+from db_pool import writer_connection
+
+SQL = "SELECT COUNT(*) FROM nfs_cabecalho"
+
+
+@pytest.fixture
+def agent_db(tmp_path, monkeypatch):
+    """ Banco vazio no esquema atual, usado como DB_FILE do agente; o pool começa e termina vazio. """
+    db_file = str(tmp_path / "notas_fiscais.db")
+    with writer_connection(db_file) as conn:
+        data_ingestion.create_tables(conn)
+    monkeypatch.chdir(tmp_path)  # traces.jsonl e afins ficam no diretório temporário
+    monkeypatch.setattr(database_agent, "DB_FILE", db_file)
+    database_agent.invalidate_agent_pool()
+    yield db_file
+    database_agent.invalidate_agent_pool()
+
+
+@pytest.fixture
+def builds(monkeypatch):
+    """ Conta as construções de agente (reflexão do esquema + toolkit) feitas por get_agent_executor. """
+    calls = []
+    build = database_agent._build_agent_executor
+
+    def counting_build(llm, backend=None, db_file=None):
+        calls.append(db_file)
+        return build(llm, backend, db_file)
+
+    monkeypatch.setattr(database_agent, "_build_agent_executor", counting_build)
+    return calls
+
+
+def fake_llm():
+    # Um passo ReAct com SQL e a resposta final; as respostas são percorridas em ciclo, duas por pergunta
+    return FakeListChatModel(responses=[
+        f"Thought: Vou contar as notas.\nAction: sql_db_query\nAction Input: {SQL}",
+        "Thought: Já sei a resposta.\nFinal Answer: Não há notas no banco.",
+    ])
+
+
+def ask(question, llm):
+    return database_agent.query_database_agent(question, google_api_key=None, llm=llm, use_cache=False)
+
+
+def test_second_question_reuses_pooled_agent(agent_db, builds):
+    llm = fake_llm()
+    first = ask("Quantas notas existem?", llm)
+    second = ask("E quantas notas existem agora?", llm)
+
+    assert "error" not in first and "error" not in second
+    assert first["sql"] == second["sql"] == SQL
+    assert second["result"] == "Não há notas no banco."
+    assert len(builds) == 1
+
+
+def test_generation_bump_rebuilds_agent(agent_db, builds):
+    llm = fake_llm()
+    ask("Quantas notas existem?", llm)
+    pooled = database_agent.get_agent_executor(None, llm=llm)
+    assert len(builds) == 1
+
+    conn = sqlite3.connect(agent_db)  # O que uma nova ingestão faz ao concluir
+    generation = conn.execute("PRAGMA user_version").fetchone()[0]
+    conn.execute(f"PRAGMA user_version = {generation + 1}")
+    conn.close()
+
+    answer = ask("Quantas notas existem?", llm)
+    assert "error" not in answer
+    assert len(builds) == 2
+    rebuilt = database_agent.get_agent_executor(None, llm=llm)
+    assert rebuilt is not pooled
+    assert len(builds) == 2
+    # O agente da geração anterior sai do pool
+    assert [key[3] for key in database_agent._agent_pool] == [generation + 1]
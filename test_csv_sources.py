@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+""" Impressão digital das origens de CSV: a mesma para o arquivo em disco, o upload e o membro de ZIP. """
+import hashlib
+import os
+import zipfile
+
+import data_ingestion
+import db_generations
+from csv_sources import source_from_path, source_from_buffer, sources_from_zip
+from db_pool import close_pools
+from synthetic_data import generate_synthetic_csvs
+
+
+def zip_of(paths, zip_path):
+    with zipfile.ZipFile(zip_path, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for path in paths:
+            archive.write(path, arcname=f"dados/{os.path.basename(path)}")
+    return zip_path
+
+
+def test_same_csv_has_same_fingerprint_everywhere(tmp_path):
+    cabecalho, itens = generate_synthetic_csvs(str(tmp_path), 50)
+    archive = zip_of([cabecalho, itens], str(tmp_path / "notas.zip"))
+    with open(cabecalho, "rb") as f:
+        data = f.read()
+
+    expected = hashlib.sha256(data).hexdigest()
+    from_zip_path = {source.name: source for source in sources_from_zip(archive)}
+    with open(archive, "rb") as f:
+        from_zip_bytes = {source.name: source for source in sources_from_zip(f.read())}
+    name = os.path.basename(cabecalho)
+
+    assert source_from_path(cabecalho).fingerprint() == expected
+    assert source_from_buffer(name, data).fingerprint() == expected
+    assert from_zip_path[name].fingerprint() == expected
+    assert from_zip_bytes[name].fingerprint() == expected
+
+
+def test_zip_of_already_ingested_files_is_skipped(tmp_path):
+    cabecalho, itens = generate_synthetic_csvs(str(tmp_path), 50)
+    archive = zip_of([cabecalho, itens], str(tmp_path / "notas.zip"))
+    db_file = str(tmp_path / "notas_fiscais.db")
+
+    assert data_ingestion.ingest_new_generation(cabecalho, itens, db_file=db_file)
+    published = db_generations.resolve_db_file(db_file)
+
+    sources = {source.name: source for source in sources_from_zip(archive)}
+    assert data_ingestion.ingest_new_generation(
+        sources[os.path.basename(cabecalho)], sources[os.path.basename(itens)], db_file=db_file, incremental=True
+    )
+    close_pools()
+
+    assert db_generations.resolve_db_file(db_file) == published  # Nenhuma geração nova
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+""" Bancos-sombra de db_generations: page_size, modo WAL e geração de partida. """
+import sqlite3
+
+import db_generations
+from db_pool import NEW_DB_PAGE_SIZE, close_pools
+
+
+def pragmas(path):
+    conn = sqlite3.connect(path)
+    try:
+        return {name: conn.execute(f"PRAGMA {name}").fetchone()[0] for name in ("page_size", "journal_mode", "user_version")}
+    finally:
+        conn.close()
+
+
+def legacy_db(path, page_size=4096):
+    """ Banco antigo (sem ponteiro de gerações) com page_size pequeno e journal padrão. """
+    conn = sqlite3.connect(path)
+    conn.execute(f"PRAGMA page_size = {page_size}")
+    conn.execute("CREATE TABLE notas (ID INTEGER PRIMARY KEY, VALOR TEXT)")
+    conn.executemany("INSERT INTO notas (VALOR) VALUES (?)", [(f"nota {i}",) for i in range(1000)])
+    conn.execute("PRAGMA user_version = 3")
+    conn.commit()
+    conn.close()
+
+
+def test_fresh_shadow_gets_new_page_size(tmp_path):
+    db_file = str(tmp_path / "notas_fiscais.db")
+    shadow = db_generations.create_shadow(db_file)
+
+    assert pragmas(shadow) == {"page_size": NEW_DB_PAGE_SIZE, "journal_mode": "wal", "user_version": 0}
+
+
+def test_copied_shadow_is_converted_to_new_page_size(tmp_path):
+    db_file = str(tmp_path / "notas_fiscais.db")
+    legacy_db(db_file)
+
+    shadow = db_generations.create_shadow(db_file, copy_current=True)
+    close_pools()
+
+    assert pragmas(shadow) == {"page_size": NEW_DB_PAGE_SIZE, "journal_mode": "wal", "user_version": 3}
+    conn = sqlite3.connect(shadow)
+    assert conn.execute("SELECT COUNT(*), MAX(VALOR) FROM notas").fetchone() == (1000, "nota 999")
+    conn.close()
+
+
+def test_copy_of_published_generation_keeps_page_size(tmp_path):
+    db_file = str(tmp_path / "notas_fiscais.db")
+    first = db_generations.create_shadow(db_file)
+    conn = sqlite3.connect(first)
+    conn.execute("CREATE TABLE notas (ID INTEGER PRIMARY KEY)")
+    conn.execute("PRAGMA user_version = 1")
+    conn.commit()
+    conn.close()
+    db_generations.publish(db_file, first)
+
+    shadow = db_generations.create_shadow(db_file, copy_current=True)
+    close_pools()
+
+    assert shadow != first
+    assert pragmas(shadow) == {"page_size": NEW_DB_PAGE_SIZE, "journal_mode": "wal", "user_version": 1}
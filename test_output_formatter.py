@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+""" Resultado estruturado do agente como DataFrame e formatação brasileira das colunas. """
+import numpy as np
+import pandas as pd
+import pytest
+
+import output_formatter
+
+
+def response(columns, rows):
+    return {"result": "ok", "data": {"columns": columns, "rows": rows, "truncated": False}}
+
+
+def test_result_dataframe_keeps_numeric_values():
+    df = output_formatter.result_dataframe(response(
+        ["UF", "VALOR_UNITARIO", "QTD"], [("SP", 1.23456, 3), ("RJ", 1234567.5, 10), ("MG", None, 2)]
+    ))
+
+    assert pd.api.types.is_float_dtype(df["VALOR_UNITARIO"])
+    assert df["VALOR_UNITARIO"].tolist()[:2] == [1.23456, 1234567.5]  # Sem arredondar para 2 casas
+    assert df["QTD"].dtype == "int64"
+    assert df.sort_values("VALOR_UNITARIO")["UF"].tolist()[:2] == ["SP", "RJ"]  # Ordem numérica
+
+
+def test_result_dataframe_nullable_integers_stay_integers():
+    df = output_formatter.result_dataframe(response(
+        ["ANO_EMISSAO", "CFOP", "TOTAL"], [(2024, 5102, 10.0), (None, None, 20.0), (2025, 6102, None)]
+    ))
+
+    assert df["ANO_EMISSAO"].dtype == "Int64" and df["CFOP"].dtype == "Int64"
+    assert df["ANO_EMISSAO"].tolist() == [2024, pd.NA, 2025]
+    assert pd.api.types.is_float_dtype(df["TOTAL"])  # REAL com valores inteiros continua decimal
+
+
+def test_result_dataframe_without_data():
+    assert output_formatter.result_dataframe({"result": "texto"}) is None
+    assert output_formatter.result_dataframe(response([], [])) is None
+
+
+# Casos em que a versão vetorizada já divergiu da escalar: empates de meio centavo, negativos que
+# arredondam para zero e tipos do numpy (np.int64 não é int para format_brazilian_number)
+PARITY_VALUES = [
+    1.115, 2.675, -2.675, 0.125, 0.375, 1.005, 12345678.905, -0.001, -0.004, -0.005, -0.0, -5.0, 0.0,
+    np.int64(5), np.float32(5), np.float32(1.115), 5, 5.0, True, "12.5", "abc", None, float("nan"),
+    float("inf"), 1e13, 999999999999.995,
+]
+PARITY_FORMATTERS = [
+    (output_formatter.format_brazilian_currency, output_formatter.format_brazilian_currency_column),
+    (output_formatter.format_brazilian_number, output_formatter.format_brazilian_number_column),
+]
+
+
+@pytest.mark.parametrize("scalar, column", PARITY_FORMATTERS)
+@pytest.mark.parametrize("container", [list, lambda values: np.array(values, dtype=object), lambda values: pd.Series(values, dtype=object)])
+def test_column_formatters_match_scalar_on_edge_cases(scalar, column, container):
+    values = container(PARITY_VALUES)
+
+    assert list(column(values)) == [scalar(value) for value in values]
+
+
+@pytest.mark.parametrize("scalar, column", PARITY_FORMATTERS)
+def test_column_formatters_match_scalar_on_typed_columns(scalar, column):
+    rng = np.random.default_rng(0)
+    prices = np.round(rng.lognormal(6, 3, 20000) * rng.choice([-1, 1], 20000), 3)  # Muitos empates
+    prices[::50] = np.nan
+    columns = [
+        prices, pd.Series(prices), prices.astype(np.float32), pd.Series(prices.astype(np.float32)),
+        np.array([-3, 0, 7, 10**13], dtype=np.int64), pd.Series([-3, 0, 7, 10**13]),
+        pd.Series([1, None, -3], dtype="Int64"),
+    ]
+
+    for values in columns:
+        assert list(column(values)) == [scalar(value) for value in values]
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+""" Resumos mensais na carga incremental: devem coincidir com uma reconstrução completa. """
+import os
+import sqlite3
+
+import pandas as pd
+
+import data_ingestion
+import db_generations
+from db_pool import close_pools
+from rollups import ROLLUPS, rebuild_rollups
+from synthetic_data import generate_synthetic_csvs
+
+INVALID_DATE = "data inválida"
+
+
+def rollup_rows(conn):
+    return {table: sorted(conn.execute(f"SELECT * FROM {table}").fetchall(), key=repr) for table in ROLLUPS}
+
+
+def write_pair(directory, prefix, cabecalho, itens):
+    os.makedirs(directory, exist_ok=True)
+    paths = (os.path.join(directory, f"{prefix}_NFs_Cabecalho.csv"), os.path.join(directory, f"{prefix}_NFs_Itens.csv"))
+    cabecalho.to_csv(paths[0], index=False)
+    itens.to_csv(paths[1], index=False)
+    return paths
+
+
+def test_incremental_correction_refreshes_null_month(tmp_path):
+    generated = generate_synthetic_csvs(str(tmp_path / "gerado"), 30)
+    cabecalho, itens = (pd.read_csv(path, dtype=str, keep_default_na=False) for path in generated)
+    cabecalho.loc[[0, 1], "DATA EMISSÃO"] = INVALID_DATE  # Duas notas no mês NULL
+    db_file = str(tmp_path / "notas_fiscais.db")
+    assert data_ingestion.ingest_new_generation(*write_pair(str(tmp_path / "jan"), "202401", cabecalho, itens), db_file=db_file)
+
+    # Correção: a nota 0 continua sem data e muda de valor; a nota 1 ganha uma data válida
+    correction = cabecalho.loc[[0, 1]].copy()
+    correction.loc[0, "VALOR NOTA FISCAL"] = cabecalho.loc[5, "VALOR NOTA FISCAL"]
+    correction.loc[1, "DATA EMISSÃO"] = cabecalho.loc[5, "DATA EMISSÃO"]
+    correction_items = itens[itens["CHAVE DE ACESSO"].isin(correction["CHAVE DE ACESSO"])]
+    assert data_ingestion.ingest_new_generation(
+        *write_pair(str(tmp_path / "fev"), "202402", correction, correction_items), db_file=db_file, incremental=True
+    )
+    close_pools()
+
+    conn = sqlite3.connect(db_generations.resolve_db_file(db_file))
+    try:
+        incremental = rollup_rows(conn)
+        null_month = conn.execute(
+            "SELECT QTD_NOTAS, VALOR_TOTAL_NOTAS FROM resumo_mensal_uf WHERE MES IS NULL"
+        ).fetchall()
+        expected_value = conn.execute(
+            "SELECT VALOR_NOTA_FISCAL FROM nfs_cabecalho WHERE CHAVE_DE_ACESSO = ?", (correction.iloc[0]["CHAVE DE ACESSO"],)
+        ).fetchone()[0]
+        rebuild_rollups(conn)
+        full = rollup_rows(conn)
+        conn.rollback()
+    finally:
+        conn.close()
+
+    assert null_month == [(1, expected_value)]
+    assert incremental == full
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+""" Gravação opcional dos traces em arquivo, com rotação por tamanho. """
+import json
+
+import pytest
+
+import tracing
+
+
+@pytest.fixture
+def trace_log():
+    """ Restaura a configuração do arquivo de traces ao fim do teste. """
+    previous = (tracing.TRACE_LOG_FILE, tracing.TRACE_LOG_MAX_BYTES, tracing.TRACE_LOG_BACKUPS)
+    yield
+    tracing.configure_trace_log(*previous)
+
+
+def ask(question):
+    with tracing.start_trace("pergunta", pergunta=question):
+        with tracing.span("agente", sql="SELECT 1"):
+            pass
+
+
+def test_traces_are_not_written_by_default(tmp_path, monkeypatch, trace_log):
+    monkeypatch.chdir(tmp_path)
+    tracing.configure_trace_log(None)
+
+    ask("Quantas notas existem?")
+
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_trace_log_is_opt_in_and_rotates(tmp_path, trace_log):
+    path = tmp_path / "traces.jsonl"
+    tracing.configure_trace_log(str(path), max_bytes=2048, backups=2)
+
+    ask("Quantas notas existem?")
+    first = json.loads(path.read_text(encoding="utf-8").splitlines()[0])
+    assert first["atributos"]["pergunta"] == "Quantas notas existem?"
+
+    for number in range(100):
+        ask(f"Pergunta {number}")
+    files = sorted(p.name for p in tmp_path.iterdir())
+    assert files == ["traces.jsonl", "traces.jsonl.1", "traces.jsonl.2"]
+    assert all((tmp_path / name).stat().st_size <= 2048 for name in files)
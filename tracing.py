@@ -0,0 +1,345 @@
+# -*- coding: utf-8 -*-
+""" Instrumentação do fluxo de perguntas: spans com tempos por etapa, métricas e logs estruturados.
+
+Cada pergunta do chat abre um trace (`start_trace`) e as etapas do caminho quente abrem spans
+aninhados (`span`): cache de perguntas, construção do agente, cada passo ReAct, cada chamada ao LLM
+(com tokens), cada SQL executado (com número de linhas) e a formatação da resposta. Ao final o
+trace pode ser gravado como uma linha JSON em TRACE_LOG_FILE (opcional, com rotação) e as durações
+alimentam histogramas expostos no formato texto do Prometheus (`render_prometheus` /
+`start_metrics_server`).
+"""
+import ast
+import json
+import logging
+import logging.handlers
+import os
+import threading
+import time
+import uuid
+import contextvars
+from collections import defaultdict
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+# Configuração básica de logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Arquivo de traces (uma linha JSON por pergunta, com a pergunta e o SQL gerado): desligado por padrão.
+# TRACE_LOG_FILE=traces.jsonl ativa; o arquivo gira ao passar de TRACE_LOG_MAX_BYTES (ver configure_trace_log)
+TRACE_LOG_FILE = os.environ.get("TRACE_LOG_FILE") or None
+TRACE_LOG_MAX_BYTES = int(os.environ.get("TRACE_LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+TRACE_LOG_BACKUPS = 3  # Arquivos girados mantidos (traces.jsonl.1 ... .3)
+# Endpoint /metrics: desligado por padrão e, quando ligado, só na interface local (sem autenticação)
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "").strip().lower() in ("1", "true", "sim", "yes")
+METRICS_HOST = os.environ.get("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "9464"))
+# Limites (s) dos buckets dos histogramas de duração
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_current_trace = contextvars.ContextVar("trace_atual", default=None)
+_current_span = contextvars.ContextVar("span_atual", default=None)
+
+_metrics_lock = threading.Lock()
+_histograms = defaultdict(lambda: {"buckets": [0] * len(DURATION_BUCKETS), "soma": 0.0, "contagem": 0})
+_counters = defaultdict(float)
+_metrics_server = None
+_metrics_server_failed = False  # Porta ocupada: não tenta de novo a cada rerun do Streamlit
+
+_trace_logger = logging.getLogger("tracing.traces")
+_trace_logger.propagate = False  # As linhas JSON vão só para o arquivo, não para o console
+
+class Trace:
+    """ Spans de uma pergunta, com início relativo ao começo do trace. """
+
+    def __init__(self, name, **attributes):
+        self.id = uuid.uuid4().hex[:12]
+        self.name = name
+        self.attributes = attributes
+        self.started = time.perf_counter()
+        self.duration_ms = None
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add_span(self, name, started, ended, parent=None, **attributes):
+        span = {
+            "id": uuid.uuid4().hex[:8],
+            "nome": name,
+            "pai": parent,
+            "inicio_ms": round((started - self.started) * 1000, 2),
+            "duracao_ms": round((ended - started) * 1000, 2),
+            "atributos": attributes,
+        }
+        with self._lock:
+            self.spans.append(span)
+        return span
+
+    def to_dict(self):
+        with self._lock:
+            spans = sorted(self.spans, key=lambda span: span["inicio_ms"])
+        return {
+            "trace_id": self.id,
+            "nome": self.name,
+            "atributos": self.attributes,
+            "duracao_ms": self.duration_ms,
+            "spans": spans,
+        }
+
+def current_trace():
+    return _current_trace.get()
+
+def _observe(metric, seconds, label):
+    with _metrics_lock:
+        histogram = _histograms[(metric, label)]
+        histogram["soma"] += seconds
+        histogram["contagem"] += 1
+        for i, limit in enumerate(DURATION_BUCKETS):
+            if seconds <= limit:
+                histogram["buckets"][i] += 1
+
+def increment(counter, value=1, **labels):
+    """ Soma `value` ao contador `counter` com os rótulos dados. """
+    with _metrics_lock:
+        _counters[(counter, tuple(sorted(labels.items())))] += value
+
+def record_span(name, started, ended, trace=None, parent=None, **attributes):
+    """ Registra um span já medido (ex.: eventos de callback) no trace e nas métricas. """
+    _observe("span", ended - started, name)
+    trace = trace or _current_trace.get()
+    if trace is None:
+        return None
+    return trace.add_span(name, started, ended, parent=parent, **attributes)
+
+@contextmanager
+def span(name, **attributes):
+    """ Mede o bloco como um span filho do span atual. O dict produzido aceita novos atributos. """
+    parent = _current_span.get()
+    attributes = dict(attributes)
+    span_id = uuid.uuid4().hex[:8]
+    token = _current_span.set(span_id)
+    started = time.perf_counter()
+    try:
+        yield attributes
+    except BaseException as e:
+        attributes["erro"] = type(e).__name__
+        raise
+    finally:
+        _current_span.reset(token)
+        recorded = record_span(name, started, time.perf_counter(), parent=parent, **attributes)
+        if recorded is not None:
+            recorded["id"] = span_id
+
+@contextmanager
+def start_trace(name, **attributes):
+    """ Abre o trace de uma pergunta; ao sair grava a linha JSON e a métrica de duração total. """
+    trace = Trace(name, **attributes)
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+        trace.duration_ms = round((time.perf_counter() - trace.started) * 1000, 2)
+        _observe("trace", trace.duration_ms / 1000, name)
+        _write_trace_log(trace)
+
+def configure_trace_log(path, max_bytes=None, backups=None):
+    """ Ativa (ou, com `path=None`, desativa) a gravação dos traces em `path`, com rotação por tamanho. """
+    global TRACE_LOG_FILE, TRACE_LOG_MAX_BYTES, TRACE_LOG_BACKUPS
+    TRACE_LOG_FILE = path
+    if max_bytes is not None:
+        TRACE_LOG_MAX_BYTES = max_bytes
+    if backups is not None:
+        TRACE_LOG_BACKUPS = backups
+    for handler in list(_trace_logger.handlers):
+        _trace_logger.removeHandler(handler)
+        handler.close()
+
+def _write_trace_log(trace):
+    if TRACE_LOG_FILE is None:
+        return
+    if not _trace_logger.handlers:
+        handler = logging.handlers.RotatingFileHandler(
+            TRACE_LOG_FILE, maxBytes=TRACE_LOG_MAX_BYTES, backupCount=TRACE_LOG_BACKUPS, encoding='utf-8'
+        )
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        _trace_logger.addHandler(handler)
+        _trace_logger.setLevel(logging.INFO)
+    _trace_logger.info(json.dumps(trace.to_dict(), ensure_ascii=False, default=str))
+
+def _count_result_rows(output):
+    """ Linhas do resultado textual da ferramenta sql_db_query (repr de uma lista de tuplas). """
+    text = str(output).strip()
+    if not text:
+        return 0
+    try:
+        return len(ast.literal_eval(text))
+    except (ValueError, SyntaxError, TypeError):
+        return None  # Tipos sem repr literal (ex.: Decimal, datetime) ou mensagem de erro
+
+def _token_usage(response):
+    """ (tokens de entrada, tokens de saída) de um LLMResult, quando o provedor informa. """
+    for generations in response.generations:
+        for generation in generations:
+            usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+            if usage:
+                return usage.get("input_tokens"), usage.get("output_tokens")
+    usage = (response.llm_output or {}).get("token_usage") or {}
+    return usage.get("prompt_tokens"), usage.get("completion_tokens")
+
+class TracingCallbackHandler(BaseCallbackHandler):
+    """ Converte os eventos do agente LangChain em spans: passos ReAct, chamadas ao LLM e ferramentas. """
+
+    def __init__(self, trace=None):
+        self.trace = trace or _current_trace.get()
+        self.parent = _current_span.get()
+        self._started = {}  # run_id -> (início, nome[, entrada da ferramenta])
+        self._step_started = None
+        self._step_id = None
+        self._step_number = 0
+
+    def _open_step(self):
+        if self._step_started is None:
+            self._step_started = time.perf_counter()
+            self._step_id = uuid.uuid4().hex[:8]
+
+    def _step_parent(self):
+        """ Chamadas ao LLM e ferramentas ficam sob o passo ReAct em andamento. """
+        return self._step_id or self.parent
+
+    def _close_step(self, **attributes):
+        if self._step_started is None:
+            return
+        self._step_number += 1
+        recorded = record_span("passo_react", self._step_started, time.perf_counter(), trace=self.trace,
+                               parent=self.parent, passo=self._step_number, **attributes)
+        if recorded is not None:
+            recorded["id"] = self._step_id
+        self._step_started = None
+        self._step_id = None
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._open_step()
+        self._started[run_id] = (time.perf_counter(), "llm")
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self.on_llm_start(serialized, [], run_id=run_id, **kwargs)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        started, _ = self._started.pop(run_id, (None, None))
+        if started is None:
+            return
+        input_tokens, output_tokens = _token_usage(response)
+        if input_tokens is not None:
+            increment("llm_tokens", input_tokens, tipo="entrada")
+        if output_tokens is not None:
+            increment("llm_tokens", output_tokens, tipo="saida")
+        record_span("llm", started, time.perf_counter(), trace=self.trace, parent=self._step_parent(),
+                    tokens_entrada=input_tokens, tokens_saida=output_tokens)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        started, _ = self._started.pop(run_id, (None, None))
+        if started is not None:
+            record_span("llm", started, time.perf_counter(), trace=self.trace, parent=self._step_parent(),
+                        erro=type(error).__name__)
+
+    def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+        self._started[run_id] = (time.perf_counter(), (serialized or {}).get("name", "ferramenta"), input_str)
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        started, name, tool_input = self._started.pop(run_id, (None, None, None))
+        if started is None:
+            return
+        attributes = {"ferramenta": name}
+        if name == "sql_db_query":
+            rows = _count_result_rows(output)
+            attributes.update(sql=str(tool_input).strip(), linhas=rows)
+            if rows is not None:
+                increment("sql_linhas", rows, origem="agente")
+        record_span(f"ferramenta:{name}", started, time.perf_counter(), trace=self.trace,
+                    parent=self._step_parent(), **attributes)
+        self._close_step(ferramenta=name)
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        started, name, _ = self._started.pop(run_id, (None, None, None))
+        if started is not None:
+            record_span(f"ferramenta:{name}", started, time.perf_counter(), trace=self.trace,
+                        parent=self._step_parent(), ferramenta=name, erro=type(error).__name__)
+        self._close_step(ferramenta=name, erro=True)
+
+    def on_agent_finish(self, finish, **kwargs):
+        self._close_step(final=True)
+
+def _format_labels(labels):
+    return ",".join(f'{key}="{value}"' for key, value in labels)
+
+# Família do histograma -> (nome da métrica, rótulo, descrição)
+_HISTOGRAM_FAMILIES = {
+    "trace": ("csv_nav_trace_duration_seconds", "trace", "Duração total de cada pergunta."),
+    "span": ("csv_nav_span_duration_seconds", "span", "Duração das etapas do fluxo de perguntas."),
+}
+_COUNTER_HELP = {
+    "llm_tokens": "Tokens enviados e recebidos do LLM.",
+    "sql_linhas": "Linhas devolvidas pelos SQLs executados.",
+}
+
+def render_prometheus():
+    """ Métricas no formato texto de exposição do Prometheus. """
+    with _metrics_lock:
+        histograms = {key: dict(value, buckets=list(value["buckets"])) for key, value in _histograms.items()}
+        counters = dict(_counters)
+    lines = []
+    for family, (name, key, help_text) in _HISTOGRAM_FAMILIES.items():
+        series = sorted((label, histogram) for (metric, label), histogram in histograms.items() if metric == family)
+        if not series:
+            continue
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+        for label, histogram in series:
+            for limit, count in zip(DURATION_BUCKETS, histogram["buckets"]):
+                lines.append(f'{name}_bucket{{{key}="{label}",le="{limit}"}} {count}')
+            lines.append(f'{name}_bucket{{{key}="{label}",le="+Inf"}} {histogram["contagem"]}')
+            lines.append(f'{name}_sum{{{key}="{label}"}} {histogram["soma"]:.6f}')
+            lines.append(f'{name}_count{{{key}="{label}"}} {histogram["contagem"]}')
+    for counter in sorted({counter for counter, _ in counters}):
+        name = f"csv_nav_{counter}_total"
+        lines += [f"# HELP {name} {_COUNTER_HELP.get(counter, counter)}", f"# TYPE {name} counter"]
+        for (other, labels), value in sorted(counters.items()):
+            if other == counter:
+                lines.append(f"{name}{{{_format_labels(labels)}}} {value:g}")
+    return "\n".join(lines) + "\n"
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = render_prometheus().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Sem uma linha de log por coleta
+
+def start_metrics_server(port=METRICS_PORT, host=METRICS_HOST):
+    """ Sobe (uma única vez por processo) o endpoint HTTP /metrics em uma thread daemon.
+
+    O endpoint não tem autenticação: por padrão escuta só em 127.0.0.1 (METRICS_HOST). Se a porta
+    estiver ocupada, registra um aviso e retorna None, sem tentar de novo nas chamadas seguintes.
+    """
+    global _metrics_server, _metrics_server_failed
+    with _metrics_lock:
+        if _metrics_server is not None or _metrics_server_failed:
+            return _metrics_server
+        try:
+            _metrics_server = ThreadingHTTPServer((host, port), _MetricsHandler)
+        except OSError as e:
+            _metrics_server_failed = True
+            logging.warning(f"Endpoint de métricas não iniciado em {host}:{port}: {e}")
+            return None
+    threading.Thread(target=_metrics_server.serve_forever, daemon=True).start()
+    bound_host, bound_port = _metrics_server.server_address[:2]
+    logging.info(f"Métricas no formato Prometheus em http://{bound_host}:{bound_port}/metrics")
+    return _metrics_server